@@ -0,0 +1,163 @@
+"""
+Change log published by the ingestion loads, so consumers can refresh only what changed.
+
+Every load that wrote to a table publishes one entry: the table version after the load, the
+CustomerIDs of the rows it merged and the year/month partitions of its "partition_by_date"
+column. The IDs are a superset of the rows that actually changed: a merged row that turned
+out identical is still listed. When the table was overwritten (a full refresh, or a table
+rewritten from all its files), the load touched more than CHANGE_LOG_MAX_CUSTOMERS customers,
+or the table has no CustomerID column, customer_ids is null, meaning "assume every customer
+changed".
+
+The entry is published after the table write and before the loader records its source files
+as processed, so a load that fails in between is redone and published by the next run instead
+of being lost.
+
+The log is one small JSON file per entry under state_dir/change_log/, named by entry id so the
+files sort in publication order. A consumer keeps a cursor (the last entry id it processed):
+
+    log = ChangeLog.for_manifest(manifest)
+    since = log.read_cursor("app_cache")
+    customers, last_entry = log.affected_customers(since, tables=["portfolio", "transactions"])
+    ...  # refresh `customers`, or everything when it is None
+    log.commit_cursor("app_cache", last_entry)
+"""
+
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+
+from ingestion.manifest import Manifest, TableSpec
+
+logger = logging.getLogger(__name__)
+
+CHANGE_LOG_DIR_NAME = "change_log"
+CHANGE_LOG_MAX_CUSTOMERS = int(os.getenv("CHANGE_LOG_MAX_CUSTOMERS", "100000"))
+CHANGE_LOG_KEEP_ENTRIES = int(os.getenv("CHANGE_LOG_KEEP_ENTRIES", "10000"))
+_CURSORS_DIR_NAME = "_cursors"
+# Tables load on several threads; ids are taken and written under this lock so they stay in publication order
+_publish_lock = threading.Lock()
+
+
+def collect_changes(table: TableSpec, df, merged: bool = False) -> dict:
+    """
+    CustomerIDs and date partitions of the rows about to be written from `df`. The IDs are only
+    listed when `merged` is True: an overwrite also removes the rows that are no longer in `df`.
+    """
+    from pyspark.sql import functions as F
+
+    changes = {"customer_ids": None, "partitions": []}
+    if merged and "CustomerID" in df.columns:
+        ids = [row[0] for row in df.select("CustomerID").where(F.col("CustomerID").isNotNull()).distinct()
+               .limit(CHANGE_LOG_MAX_CUSTOMERS + 1).collect()]
+        if len(ids) <= CHANGE_LOG_MAX_CUSTOMERS:
+            changes["customer_ids"] = sorted(ids)
+    date_column = table.config.get("partition_by_date")
+    if date_column:
+        # Same year=/month= layout as the Parquet written by ingestion.convert
+        months = df.select(F.date_format(date_column, "yyyy-MM").alias("m")).where("m IS NOT NULL").distinct()
+        changes["partitions"] = sorted(
+            f"year={m[:4]}/month={int(m[5:])}" for m in (row[0] for row in months.collect())
+        )
+    return changes
+
+
+def table_version(spark, manifest: Manifest, full_name: str):
+    """Current version of a Delta table, None for other formats."""
+    if manifest.format != "delta":
+        return None
+    return spark.sql(f"DESCRIBE HISTORY {full_name} LIMIT 1").first()["version"]
+
+
+class ChangeLog:
+    """Folder of change files, one per table load, plus one cursor file per consumer."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    @classmethod
+    def for_manifest(cls, manifest: Manifest) -> "ChangeLog":
+        return cls(os.path.join(manifest.state_dir, CHANGE_LOG_DIR_NAME))
+
+    def _write_json(self, path: str, data) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    def publish(self, table: str, changes: dict) -> str:
+        """Write the changes of one load of `table` as a new entry, after every entry already published."""
+        with _publish_lock:
+            now = datetime.now(timezone.utc)
+            entry_id = now.strftime("%Y%m%dT%H%M%S%fZ")
+            ids = self.entry_ids()
+            if ids and entry_id <= ids[-1]:
+                # Same microsecond, or the clock went back: keep the ids increasing
+                entry_id = f"{ids[-1]}.1"
+            path = os.path.join(self.directory, f"{entry_id}.json")
+            self._write_json(path, {"entry_id": entry_id, "published_at": now.isoformat(), "table": table,
+                                    **changes})
+        self.prune()
+        return path
+
+    def entry_ids(self) -> list[str]:
+        try:
+            return sorted(name[:-len(".json")] for name in os.listdir(self.directory) if name.endswith(".json"))
+        except FileNotFoundError:
+            return []
+
+    def entries(self, since: str = None) -> list[dict]:
+        """Entries published after entry id `since` (default: all kept entries), oldest first."""
+        entries = []
+        for entry_id in self.entry_ids():
+            if since is None or entry_id > since:
+                with open(os.path.join(self.directory, f"{entry_id}.json")) as f:
+                    entries.append(json.load(f))
+        return entries
+
+    def affected_customers(self, since: str = None, tables: list[str] = None):
+        """
+        CustomerIDs changed in `tables` (default: all) by the entries after `since`, or None when
+        every customer must be assumed changed; and the last entry id read, to commit as the next cursor.
+        """
+        ids = self.entry_ids()
+        if since is not None and ids and since < ids[0]:
+            # Entries after the cursor may have been pruned
+            logger.warning("Change log cursor %s is older than the log; assuming everything changed", since)
+            return None, ids[-1]
+        customers, last_entry = set(), since
+        for entry in self.entries(since):
+            last_entry = entry["entry_id"]
+            if tables is not None and entry["table"] not in tables:
+                continue
+            if entry["customer_ids"] is None:
+                customers = None
+            elif customers is not None:
+                customers.update(entry["customer_ids"])
+        return customers, last_entry
+
+    def prune(self, keep: int = CHANGE_LOG_KEEP_ENTRIES) -> None:
+        for entry_id in self.entry_ids()[:-keep]:
+            os.remove(os.path.join(self.directory, f"{entry_id}.json"))
+
+    def read_cursor(self, consumer: str):
+        try:
+            with open(os.path.join(self.directory, _CURSORS_DIR_NAME, f"{consumer}.json")) as f:
+                return json.load(f)["entry_id"]
+        except FileNotFoundError:
+            return None
+
+    def commit_cursor(self, consumer: str, entry_id: str) -> None:
+        if entry_id is not None:
+            self._write_json(os.path.join(self.directory, _CURSORS_DIR_NAME, f"{consumer}.json"),
+                             {"entry_id": entry_id})
+
+
+def publish_table_changes(manifest: Manifest, table: TableSpec, changes: dict) -> str:
+    """Publish the changes of a load that has written to `table`; returns the entry's file."""
+    path = ChangeLog.for_manifest(manifest).publish(table.name, changes)
+    logger.info("Published changes of %s to %s", table.name, path)
+    return path
@@ -0,0 +1,284 @@
+"""
+Converts the source CSVs of the manifest to compressed Parquet without Spark.
+
+Each file is streamed through pyarrow's CSV reader in record batches of about
+`block_size` bytes, so memory stays bounded however large the feed grows. Values are
+converted to the registered schema (ingestion/schemas.py); rows with the wrong number of
+fields, values that do not convert, or nulls in non-nullable columns are written as JSON to
+quarantine_dir/<table>/<UTC timestamp>-convert.json instead, in batches as they are found, with
+the raw text of unparsable lines in CORRUPT_RECORD_COLUMN, as in the Spark loader. Like Spark,
+decimals with more digits than their scale are rounded half up (12.555 -> 12.56), not rejected.
+
+Tables with "partition_by_date" in the manifest are written as Hive partitions year=/month=
+(or year=/month=/day= with --granularity day) of that column:
+
+    python -m ingestion.convert --source-dir ./source_feed --out ./parquet [--tables transactions]
+"""
+
+import argparse
+import csv
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timezone
+from functools import reduce
+
+from ingestion.manifest import DEFAULT_MANIFEST_PATH, Manifest, TableSpec, load_manifest
+from ingestion.reader import table_columns
+from ingestion.schemas import CORRUPT_RECORD_COLUMN, arrow_schema, validate_header
+
+logger = logging.getLogger(__name__)
+
+CONVERT_BLOCK_SIZE_BYTES = int(os.getenv("CONVERT_BLOCK_SIZE_BYTES", str(16 * 1024 * 1024)))
+CONVERT_COMPRESSION = os.getenv("CONVERT_COMPRESSION", "zstd")
+CONVERT_MAX_ROWS_PER_FILE = 5_000_000
+# Rows are buffered per open partition until a row group is full, which bounds the memory used
+CONVERT_ROWS_PER_GROUP = 256_000
+# Rejected rows are held until this many, then appended to the quarantine file
+QUARANTINE_FLUSH_ROWS = 10_000
+# Only these parts of a Spark date pattern can be translated to strptime
+SPARK_DATE_TOKENS = [("yyyy", "%Y"), ("MM", "%m"), ("dd", "%d")]
+PARTITION_GRANULARITIES = {"year": ["year"], "month": ["year", "month"], "day": ["year", "month", "day"]}
+
+
+def _strptime_format(date_format: str):
+    """strptime format of a Spark date pattern, or None for ISO dates, which Arrow casts directly."""
+    if date_format == "yyyy-MM-dd":
+        return None
+    for spark_token, strptime_token in SPARK_DATE_TOKENS:
+        date_format = date_format.replace(spark_token, strptime_token)
+    return date_format
+
+
+def _to_decimal(column, type_):
+    """Strings to `type_`, rounding extra fractional digits half up (away from zero) as Spark does."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    # Same integer digits as `type_`, and as many fractional digits as fit
+    wide = pa.decimal128(38, 38 - (type_.precision - type_.scale))
+    rounded = pc.round(column.cast(wide), ndigits=type_.scale, round_mode="half_towards_infinity")
+    return rounded.cast(type_)
+
+
+def _typed_batch(batch, schema, strptime_format):
+    """Cast a batch of string columns to `schema`; raises pyarrow.ArrowInvalid on a bad value."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    arrays = []
+    for field, column in zip(schema, batch.columns):
+        if field.type == pa.date32() and strptime_format:
+            arrays.append(pc.strptime(column, format=strptime_format, unit="s").cast(pa.date32()))
+        elif pa.types.is_decimal(field.type):
+            arrays.append(_to_decimal(column, field.type))
+        else:
+            arrays.append(column.cast(field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def _cast_rows(batch, schema, strptime_format, good: list, rejected: list) -> None:
+    # Halve a batch that fails until the bad rows are isolated, so a few bad values cost
+    # O(bad rows * log(batch size)) casts instead of one per row
+    import pyarrow as pa
+
+    try:
+        good.append(_typed_batch(batch, schema, strptime_format))
+    except pa.ArrowInvalid:
+        if batch.num_rows == 1:
+            rejected.extend(batch.to_pylist())
+            return
+        half = batch.num_rows // 2
+        _cast_rows(batch.slice(0, half), schema, strptime_format, good, rejected)
+        _cast_rows(batch.slice(half), schema, strptime_format, good, rejected)
+
+
+def convert_batch(batch, schema, strptime_format=None):
+    """
+    A batch of strings as a table typed with `schema`, and the rows that failed as dicts. A bad
+    value rejects its row only, not the whole batch.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    good, rejected = [], []
+    _cast_rows(batch, schema, strptime_format, good, rejected)
+    typed = pa.Table.from_batches(good, schema=schema)
+
+    required = [field.name for field in schema if not field.nullable]
+    if required and typed.num_rows:
+        has_null = reduce(pc.or_, [pc.is_null(typed[name]) for name in required])
+        if pc.any(has_null).as_py():
+            rejected.extend(typed.filter(has_null).to_pylist())
+            typed = typed.filter(pc.invert(has_null))
+    return typed, rejected
+
+
+def _read_header(path: str) -> list[str]:
+    with open(path, newline="") as f:
+        return next(csv.reader(f), [])
+
+
+def _partition_columns(batch, date_column: str, granularity: str):
+    import pyarrow.compute as pc
+
+    dates = batch[date_column]
+    parts = {"year": pc.year(dates), "month": pc.month(dates), "day": pc.day(dates)}
+    for name in PARTITION_GRANULARITIES[granularity]:
+        batch = batch.append_column(name, parts[name].cast("int16"))
+    return batch
+
+
+class TableConversion:
+    """Streams the source files of one table into a Parquet dataset and counts what it did."""
+
+    def __init__(self, manifest: Manifest, table: TableSpec, out_dir: str, block_size: int = CONVERT_BLOCK_SIZE_BYTES,
+                 granularity: str = "month"):
+        self.manifest = manifest
+        self.table = table
+        self.out_dir = out_dir
+        self.block_size = block_size
+        self.granularity = granularity
+        self.columns = table_columns(table)
+        self.schema = arrow_schema(self.columns)
+        self.partition_column = table.config.get("partition_by_date")
+        self.strptime_format = _strptime_format(table.config.get("date_format", "yyyy-MM-dd"))
+        self.rows_read = 0
+        self.rows_written = 0
+        self.rows_rejected = 0
+        self.quarantine_path = None
+        self._pending_rejects = []
+        # The CSV reader may call _invalid_row from its own threads
+        self._rejects_lock = threading.Lock()
+        self._run_stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+    def _reject(self, rows: list[dict]) -> None:
+        with self._rejects_lock:
+            self.rows_rejected += len(rows)
+            self._pending_rejects.extend(rows)
+            if len(self._pending_rejects) >= QUARANTINE_FLUSH_ROWS:
+                self._flush_rejects()
+
+    def _flush_rejects(self) -> None:
+        # Called with _rejects_lock held, or once reading is over
+        if not self._pending_rejects:
+            return
+        if self.quarantine_path is None:
+            self.quarantine_path = os.path.join(self.manifest.quarantine_dir, self.table.name,
+                                                f"{self._run_stamp}-convert.json")
+            os.makedirs(os.path.dirname(self.quarantine_path), exist_ok=True)
+        with open(self.quarantine_path, "a") as f:
+            f.writelines(json.dumps(row, default=str) + "\n" for row in self._pending_rejects)
+        self._pending_rejects = []
+
+    def _invalid_row(self, row) -> str:
+        # Lines with too few or too many fields
+        self.rows_read += 1
+        self._reject([{CORRUPT_RECORD_COLUMN: row.text}])
+        return "skip"
+
+    def _batches(self, path: str):
+        import pyarrow as pa
+        from pyarrow import csv as pa_csv
+
+        validate_header(self.table.name, _read_header(path), self.columns)
+        names = [name for name, _, _ in self.columns]
+        reader = pa_csv.open_csv(
+            path,
+            read_options=pa_csv.ReadOptions(column_names=names, skip_rows=1, block_size=self.block_size),
+            parse_options=pa_csv.ParseOptions(invalid_row_handler=self._invalid_row),
+            # Everything is read as text and cast afterwards, so a bad value rejects its row, not the file
+            convert_options=pa_csv.ConvertOptions(
+                column_types={name: pa.string() for name in names}, null_values=[""], strings_can_be_null=True
+            ),
+        )
+        for batch in reader:
+            self.rows_read += batch.num_rows
+            typed, rejected = convert_batch(batch, self.schema, self.strptime_format)
+            self._reject(rejected)
+            if self.partition_column:
+                typed = _partition_columns(typed, self.partition_column, self.granularity)
+            self.rows_written += typed.num_rows
+            yield from typed.to_batches()
+
+    def run(self) -> dict:
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+
+        start = time.time()
+        paths = self.manifest.source_files(self.table)
+        target = os.path.join(self.out_dir, self.table.name)
+        tmp_target = f"{target}.tmp"
+        shutil.rmtree(tmp_target, ignore_errors=True)
+        os.makedirs(tmp_target)
+
+        schema, partitioning = self.schema, None
+        if self.partition_column:
+            parts = PARTITION_GRANULARITIES[self.granularity]
+            partition_schema = pa.schema([(name, pa.int16()) for name in parts])
+            schema = pa.schema(list(self.schema) + list(partition_schema))
+            partitioning = ds.partitioning(partition_schema, flavor="hive")
+
+        batches = (batch for path in paths for batch in self._batches(path))
+        ds.write_dataset(
+            pa.RecordBatchReader.from_batches(schema, batches),
+            tmp_target,
+            format="parquet",
+            partitioning=partitioning,
+            file_options=ds.ParquetFileFormat().make_write_options(compression=CONVERT_COMPRESSION),
+            basename_template="part-{i}.parquet",
+            max_rows_per_file=CONVERT_MAX_ROWS_PER_FILE,
+            max_rows_per_group=CONVERT_ROWS_PER_GROUP,
+            existing_data_behavior="overwrite_or_ignore",
+        )
+        # Replace the previous output only once the new one is complete
+        shutil.rmtree(target, ignore_errors=True)
+        os.replace(tmp_target, target)
+
+        metrics = {
+            "table": self.table.name,
+            "files": len(paths),
+            "rows_read": self.rows_read,
+            "rows_written": self.rows_written,
+            "rows_rejected": self.rows_rejected,
+            "bytes_read": sum(os.path.getsize(p) for p in paths),
+            "bytes_written": sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(target) for f in files),
+            "seconds": round(time.time() - start, 3),
+        }
+        self._flush_rejects()
+        if self.rows_rejected:
+            logger.warning("%s: %d malformed rows quarantined to %s", self.table.name, self.rows_rejected,
+                           self.quarantine_path)
+        logger.info("Converted %s: %s", self.table.name, metrics)
+        return metrics
+
+
+def convert_tables(manifest: Manifest, out_dir: str, block_size: int = CONVERT_BLOCK_SIZE_BYTES,
+                   granularity: str = "month") -> list[dict]:
+    """Convert every table of the manifest to out_dir/<table>/ and return their metrics."""
+    return [TableConversion(manifest, table, out_dir, block_size, granularity).run() for table in manifest.tables]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--manifest", default=DEFAULT_MANIFEST_PATH)
+    parser.add_argument("--source-dir", help="folder with the source CSVs (default: from the manifest)")
+    parser.add_argument("--quarantine-dir", help="where malformed rows are written")
+    parser.add_argument("--out", required=True, help="folder for the Parquet datasets, one per table")
+    parser.add_argument("--tables", nargs="*", help="convert only these tables")
+    parser.add_argument("--block-size-mb", type=float, default=CONVERT_BLOCK_SIZE_BYTES / 1024 / 1024)
+    parser.add_argument("--granularity", choices=sorted(PARTITION_GRANULARITIES), default="month")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    manifest = load_manifest(args.manifest, args.tables, source_dir=args.source_dir,
+                             quarantine_dir=args.quarantine_dir)
+    for metrics in convert_tables(manifest, args.out, int(args.block_size_mb * 1024 * 1024), args.granularity):
+        print(json.dumps(metrics))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,370 @@
+"""
+Gold aggregate tables for the dashboard, refreshed after ingestion.
+
+Instead of aggregating the raw tables on every page view, the app can read a few rows of
+- gold_customer_summary: one row per customer with CASA/FD/Investments/Insurance/Loans
+  balances, total AUM, service requests by status, compliance alerts and digital score,
+- gold_customer_product_aum: AUM per customer and product type,
+- gold_rm_summary and gold_rm_product_aum: the same rolled up per RM.
+Compliance columns hold due dates rather than "due today" counts, so a row stays correct
+until its sources change; filter on NextComplianceDueDate when reading.
+
+Refreshes are incremental on Delta: the source tables have the change data feed enabled, the
+CustomerIDs changed since the versions used by the last refresh are read with table_changes,
+and only those customers (and their RMs) are recomputed and replaced with replaceWhere.
+Without previous state, after a change feed gap or when too many customers changed, all
+gold tables are rebuilt. The source versions used are kept in gold_state.json in state_dir.
+
+    python -m ingestion.gold --catalog "" [--full-refresh]
+"""
+
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from ingestion.incremental import _table_exists
+from ingestion.manifest import DEFAULT_MANIFEST_PATH, Manifest, load_manifest
+
+logger = logging.getLogger(__name__)
+
+GOLD_STATE_NAME = "gold_state.json"
+# Changed customers (or RMs) are replaced with a literal IN-list replaceWhere predicate, which
+# gets slow to plan when long; above this many keys the gold tables are rebuilt instead
+GOLD_MAX_INCREMENTAL_KEYS = int(os.getenv("GOLD_MAX_INCREMENTAL_KEYS", "2000"))
+SOURCE_TABLES = ["customer_dtls", "portfolio", "service_requests", "risk_compliance", "digital_engagement"]
+
+# Portfolio ProductType values (lower case) of each dashboard category; anything else is "Other"
+PRODUCT_CATEGORIES = {
+    "CASA": ["casa", "savings", "savings account", "current", "current account"],
+    "FD": ["fd", "fixed deposit", "term deposit", "rd", "recurring deposit"],
+    "Investments": ["investments", "investment", "mutual fund", "mutual funds", "equity", "bonds", "pms"],
+    "Insurance": ["insurance", "life insurance", "health insurance", "general insurance"],
+    "Loans": ["loans", "loan", "home loan", "personal loan", "car loan", "credit card"],
+}
+# Loans are liabilities, not assets under management
+AUM_CATEGORIES = ["CASA", "FD", "Investments", "Insurance"]
+
+
+def _category_sql(column: str) -> str:
+    cases = " ".join(
+        "WHEN lower(trim({})) IN ({}) THEN '{}'".format(column, ", ".join(f"'{v}'" for v in values), category)
+        for category, values in PRODUCT_CATEGORIES.items()
+    )
+    return f"CASE {cases} ELSE 'Other' END"
+
+
+def _category_sums_sql() -> str:
+    sums = [f"sum(CASE WHEN ProductCategory = '{c}' THEN Value ELSE 0 END) AS {c}" for c in PRODUCT_CATEGORIES]
+    aum = ", ".join(f"'{c}'" for c in AUM_CATEGORIES)
+    sums.append(f"sum(CASE WHEN ProductCategory IN ({aum}) THEN Value ELSE 0 END) AS TotalAUM")
+    return ",\n                ".join(sums)
+
+
+def customer_summary_sql(sources: dict, where) -> str:
+    """One row per customer; `where(column)` restricts the customers computed."""
+    balances = ", ".join(f"coalesce(pf.{c}, 0) AS {c}" for c in [*PRODUCT_CATEGORIES, "TotalAUM"])
+    return f"""
+        WITH pf AS (
+            SELECT CustomerID,
+                {_category_sums_sql()}
+            FROM (SELECT CustomerID, Value, {_category_sql('ProductType')} AS ProductCategory
+                  FROM {sources['portfolio']} WHERE {where('CustomerID')})
+            GROUP BY CustomerID
+        ),
+        sr_status AS (
+            SELECT CustomerID, coalesce(Status, 'Unknown') AS Status, count(*) AS n,
+                   count_if(ClosedDate IS NULL) AS n_open
+            FROM {sources['service_requests']} WHERE {where('CustomerID')}
+            GROUP BY CustomerID, coalesce(Status, 'Unknown')
+        ),
+        sr AS (
+            SELECT CustomerID, sum(n) AS TotalSRs, sum(n_open) AS OpenSRs,
+                   map_from_entries(collect_list(struct(Status, n))) AS SRsByStatus
+            FROM sr_status GROUP BY CustomerID
+        ),
+        risk AS (
+            SELECT CustomerID, max(RiskScore) AS RiskScore, min(KYCExpiry) AS KYCExpiry,
+                   count_if(coalesce(trim(Alert), '') NOT IN ('', 'None')) AS ComplianceAlerts,
+                   min(CASE WHEN coalesce(trim(Alert), '') NOT IN ('', 'None') THEN DueDate END)
+                       AS NextComplianceDueDate
+            FROM {sources['risk_compliance']} WHERE {where('CustomerID')}
+            GROUP BY CustomerID
+        ),
+        digital AS (
+            SELECT CustomerID, max(EngagementScore) AS DigitalScore
+            FROM {sources['digital_engagement']} WHERE {where('CustomerID')}
+            GROUP BY CustomerID
+        )
+        SELECT c.CustomerID, c.Name, c.RMID, c.Segment, c.RiskProfile, {balances},
+               coalesce(sr.TotalSRs, 0) AS TotalSRs, coalesce(sr.OpenSRs, 0) AS OpenSRs, sr.SRsByStatus,
+               coalesce(risk.ComplianceAlerts, 0) AS ComplianceAlerts, risk.NextComplianceDueDate,
+               risk.KYCExpiry, risk.RiskScore, digital.DigitalScore, current_timestamp() AS RefreshedAt
+        FROM {sources['customer_dtls']} c
+        LEFT JOIN pf ON pf.CustomerID = c.CustomerID
+        LEFT JOIN sr ON sr.CustomerID = c.CustomerID
+        LEFT JOIN risk ON risk.CustomerID = c.CustomerID
+        LEFT JOIN digital ON digital.CustomerID = c.CustomerID
+        WHERE {where('c.CustomerID')}
+    """
+
+
+def customer_product_aum_sql(sources: dict, where) -> str:
+    return f"""
+        SELECT p.CustomerID, c.RMID, p.ProductType, {_category_sql('p.ProductType')} AS ProductCategory,
+               sum(p.Value) AS Value, count(*) AS Holdings, max(p.AsOfDate) AS AsOfDate,
+               current_timestamp() AS RefreshedAt
+        FROM {sources['portfolio']} p
+        JOIN {sources['customer_dtls']} c ON c.CustomerID = p.CustomerID
+        WHERE {where('p.CustomerID')}
+        GROUP BY p.CustomerID, c.RMID, p.ProductType
+    """
+
+
+def rm_summary_sql(customer_summary: str, where) -> str:
+    sums = ", ".join(f"sum({c}) AS {c}" for c in [*PRODUCT_CATEGORIES, "TotalAUM"])
+    return f"""
+        WITH sr AS (
+            SELECT RMID, map_from_entries(collect_list(struct(Status, n))) AS SRsByStatus
+            FROM (SELECT RMID, Status, sum(n) AS n
+                  FROM {customer_summary} LATERAL VIEW explode(SRsByStatus) s AS Status, n
+                  WHERE RMID IS NOT NULL AND {where('RMID')}
+                  GROUP BY RMID, Status)
+            GROUP BY RMID
+        )
+        SELECT g.RMID, count(*) AS Customers, {sums},
+               sum(TotalSRs) AS TotalSRs, sum(OpenSRs) AS OpenSRs, first(sr.SRsByStatus) AS SRsByStatus,
+               sum(ComplianceAlerts) AS ComplianceAlerts, min(NextComplianceDueDate) AS NextComplianceDueDate,
+               avg(DigitalScore) AS AvgDigitalScore, current_timestamp() AS RefreshedAt
+        FROM {customer_summary} g
+        LEFT JOIN sr ON sr.RMID = g.RMID
+        WHERE g.RMID IS NOT NULL AND {where('g.RMID')}
+        GROUP BY g.RMID
+    """
+
+
+def rm_product_aum_sql(customer_product_aum: str, where) -> str:
+    return f"""
+        SELECT RMID, ProductType, ProductCategory, sum(Value) AS Value,
+               count(DISTINCT CustomerID) AS Customers, current_timestamp() AS RefreshedAt
+        FROM {customer_product_aum}
+        WHERE RMID IS NOT NULL AND {where('RMID')}
+        GROUP BY RMID, ProductType, ProductCategory
+    """
+
+
+def _name(manifest: Manifest, table: str) -> str:
+    return ".".join(part for part in (manifest.catalog, manifest.schema, table) if part)
+
+
+def _in_list(column: str, keys) -> str:
+    values = ", ".join(str(int(k)) if isinstance(k, int) else "'{}'".format(str(k).replace("'", "\\'"))
+                       for k in sorted(keys))
+    return f"{column} IN ({values})"
+
+
+def _everywhere(column: str) -> str:
+    return "true"
+
+
+def _where_in(view: str, key: str):
+    """Predicate builder restricting a column to the keys in a temp view."""
+    return lambda column: f"{column} IN (SELECT {key} FROM {view})"
+
+
+def _table_version(spark, full_name: str) -> int:
+    return spark.sql(f"DESCRIBE HISTORY {full_name} LIMIT 1").first()["version"]
+
+
+def ensure_change_data_feed(spark, full_name: str) -> None:
+    """Turn on the Delta change data feed of a table unless it is on already."""
+    properties = {row["key"]: row["value"] for row in spark.sql(f"SHOW TBLPROPERTIES {full_name}").collect()}
+    if properties.get("delta.enableChangeDataFeed", "false").lower() != "true":
+        spark.sql(f"ALTER TABLE {full_name} SET TBLPROPERTIES (delta.enableChangeDataFeed = true)")
+
+
+def changed_keys(spark, full_name: str, start_version: int, end_version: int) -> tuple[set, set]:
+    """CustomerIDs, and RMIDs where the table has them, of the rows changed in the version range."""
+    columns = [field.name for field in spark.table(full_name).schema.fields]
+    select = "CustomerID, RMID" if "RMID" in columns else "CustomerID, NULL AS RMID"
+    rows = spark.sql(
+        f"SELECT DISTINCT {select} FROM table_changes('{full_name}', {start_version}, {end_version})"
+    ).collect()
+    return ({r["CustomerID"] for r in rows if r["CustomerID"] is not None},
+            {r["RMID"] for r in rows if r["RMID"] is not None})
+
+
+class GoldState:
+    """Source table versions used by the last gold refresh."""
+
+    def __init__(self, path: str):
+        self.path = path
+        try:
+            with open(path) as f:
+                self.versions = json.load(f)["versions"]
+        except FileNotFoundError:
+            self.versions = {}
+
+    def save(self, versions: dict) -> None:
+        self.versions = versions
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"versions": versions, "refreshed_at": datetime.now(timezone.utc).isoformat()}, f, indent=1)
+        os.replace(tmp_path, self.path)
+
+
+class GoldRefresher:
+    """Builds the gold tables of a manifest's schema, from scratch or for changed customers only."""
+
+    def __init__(self, manifest: Manifest):
+        self.manifest = manifest
+        self.state = GoldState(os.path.join(manifest.state_dir, GOLD_STATE_NAME))
+        self.tables = {name: _name(manifest, name) for name in
+                       ["gold_customer_summary", "gold_customer_product_aum", "gold_rm_summary", "gold_rm_product_aum"]}
+
+    def _write(self, df, table: str, replace_where: str = None) -> None:
+        writer = df.write.format(self.manifest.format).mode("overwrite")
+        if replace_where:
+            writer = writer.option("replaceWhere", replace_where)
+        else:
+            writer = writer.option("overwriteSchema", "true")
+        writer.saveAsTable(self.tables[table])
+
+    def _keys_view(self, spark, name: str, column: str, type_: str, keys) -> str:
+        view = f"gold_{name}_{os.getpid()}_{threading.get_ident()}"
+        spark.createDataFrame([(k,) for k in keys], f"{column} {type_}").createOrReplaceTempView(view)
+        return view
+
+    def _build(self, spark, sources: dict, customers: set = None, rms: set = None) -> None:
+        """Rebuild every gold table, or replace the rows of `customers` and `rms` only."""
+        if customers is None:
+            self._write(spark.sql(customer_summary_sql(sources, _everywhere)), "gold_customer_summary")
+            self._write(spark.sql(customer_product_aum_sql(sources, _everywhere)), "gold_customer_product_aum")
+            self._write(spark.sql(rm_summary_sql(self.tables["gold_customer_summary"], _everywhere)),
+                        "gold_rm_summary")
+            self._write(spark.sql(rm_product_aum_sql(self.tables["gold_customer_product_aum"], _everywhere)),
+                        "gold_rm_product_aum")
+            return
+
+        views = []
+        try:
+            view = self._keys_view(spark, "customers", "CustomerID", "int", customers)
+            views.append(view)
+            of_customers = _where_in(view, "CustomerID")
+            # The RMs the customers had in the gold tables, read before they are rewritten, so an
+            # RM a customer was moved away from stops counting them
+            previous_rms = {
+                r["RMID"] for r in spark.sql(
+                    f"SELECT DISTINCT RMID FROM {self.tables['gold_customer_summary']} "
+                    f"WHERE RMID IS NOT NULL AND {of_customers('CustomerID')}"
+                ).collect()
+            }
+            self._write(spark.sql(customer_summary_sql(sources, of_customers)), "gold_customer_summary",
+                        _in_list("CustomerID", customers))
+            self._write(spark.sql(customer_product_aum_sql(sources, of_customers)), "gold_customer_product_aum",
+                        _in_list("CustomerID", customers))
+
+            # ... plus the RMs they have now
+            rms = set(rms) | previous_rms | {
+                r["RMID"] for r in spark.sql(
+                    f"SELECT DISTINCT RMID FROM {self.tables['gold_customer_summary']} "
+                    f"WHERE RMID IS NOT NULL AND {of_customers('CustomerID')}"
+                ).collect()
+            }
+            if not rms:
+                return
+            rm_view = self._keys_view(spark, "rms", "RMID", "string", rms)
+            views.append(rm_view)
+            of_rms = _where_in(rm_view, "RMID")
+            self._write(spark.sql(rm_summary_sql(self.tables["gold_customer_summary"], of_rms)), "gold_rm_summary",
+                        _in_list("RMID", rms))
+            self._write(spark.sql(rm_product_aum_sql(self.tables["gold_customer_product_aum"], of_rms)),
+                        "gold_rm_product_aum", _in_list("RMID", rms))
+        finally:
+            for view in views:
+                spark.catalog.dropTempView(view)
+
+    def _changes(self, spark, versions: dict):
+        """Customers and RMs changed since the last refresh, or None when a full rebuild is needed."""
+        if set(self.state.versions) != set(versions):
+            return None
+        customers, rms = set(), set()
+        for name, version in versions.items():
+            since = self.state.versions[name]
+            if version < since:
+                return None
+            if version == since:
+                continue
+            try:
+                c, r = changed_keys(spark, _name(self.manifest, name), since + 1, version)
+            except Exception as e:
+                # Change feed not available for the whole range, e.g. enabled later or vacuumed
+                logger.warning("gold: no change feed for %s versions %d-%d (%s), rebuilding", name, since + 1,
+                               version, e)
+                return None
+            customers |= c
+            rms |= r
+            if len(customers) > GOLD_MAX_INCREMENTAL_KEYS or len(rms) > GOLD_MAX_INCREMENTAL_KEYS:
+                return None
+        return customers, rms
+
+    def __call__(self, spark, full_refresh: bool = False) -> dict:
+        start = time.time()
+        is_delta = self.manifest.format == "delta"
+        sources, versions = {}, {}
+        for name in SOURCE_TABLES:
+            full_name = _name(self.manifest, name)
+            if is_delta:
+                ensure_change_data_feed(spark, full_name)
+                versions[name] = _table_version(spark, full_name)
+                # Read every source at one version, so the change feed and the aggregates agree
+                sources[name] = f"{full_name} VERSION AS OF {versions[name]}"
+            else:
+                sources[name] = full_name
+
+        changes = None
+        if is_delta and not full_refresh and all(_table_exists(spark, t) for t in self.tables.values()):
+            changes = self._changes(spark, versions)
+        if changes is None:
+            self._build(spark, sources)
+            result = {"mode": "full"}
+        elif not changes[0]:
+            result = {"mode": "unchanged", "customers": 0}
+        else:
+            self._build(spark, sources, *changes)
+            result = {"mode": "incremental", "customers": len(changes[0])}
+
+        if is_delta:
+            self.state.save(versions)
+        result["seconds"] = round(time.time() - start, 1)
+        logger.info("gold: %s", result)
+        return result
+
+
+def refresh_gold(spark, manifest: Manifest, full_refresh: bool = False) -> dict:
+    """Refresh the gold tables of `manifest` after ingestion; returns the mode used and the time taken."""
+    return GoldRefresher(manifest)(spark, full_refresh)
+
+
+def main():
+    from ingestion.pipeline import local_spark_session
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--manifest", default=DEFAULT_MANIFEST_PATH)
+    parser.add_argument("--catalog")
+    parser.add_argument("--schema")
+    parser.add_argument("--format", help="table format, e.g. delta or parquet")
+    parser.add_argument("--full-refresh", action="store_true", help="rebuild every gold table")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    manifest = load_manifest(args.manifest, catalog=args.catalog, schema=args.schema, format=args.format)
+    print(refresh_gold(local_spark_session(), manifest, args.full_refresh))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+Incremental loads: only new or changed source files are read, and their rows are upserted
+into the table by business key with MERGE instead of overwriting it.
+
+Processed files are tracked in a JSON file manifest (size, modification time and SHA-256
+per file) under the manifest's state_dir. A file whose size and modification time are
+unchanged is skipped without reading it; a touched file with the same checksum is skipped too.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from ingestion.changefeed import collect_changes, publish_table_changes, table_version
+from ingestion.manifest import Manifest, TableSpec
+from ingestion.reader import SOURCE_ORDER_COLUMNS, quarantine, read_source, split_malformed, table_columns
+from ingestion.report import bytes_written, profile_columns, source_bytes
+
+logger = logging.getLogger(__name__)
+
+CHECKSUM_CHUNK_BYTES = 8 * 1024 * 1024
+FILE_MANIFEST_NAME = "file_manifest.json"
+
+
+def file_checksum(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHECKSUM_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FileManifest:
+    """Thread-safe record of the source files already ingested, saved after every update."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path) as f:
+                self._files = json.load(f)
+        except FileNotFoundError:
+            self._files = {}
+
+    def changed_files(self, paths: list[str]) -> tuple[list[tuple[str, dict]], list[str]]:
+        """
+        Split `paths` into files to ingest, each with its new manifest entry, and unchanged
+        files to skip
+        """
+        changed, unchanged = [], []
+        for path in paths:
+            stat = os.stat(path)
+            with self._lock:
+                known = self._files.get(path)
+            if known and known["size"] == stat.st_size and known["mtime"] == stat.st_mtime:
+                unchanged.append(path)
+                continue
+            checksum = file_checksum(path)
+            if known and known["sha256"] == checksum:
+                # Touched but not modified: remember the new stat so the checksum is not recomputed
+                with self._lock:
+                    self._files[path] = {**known, "size": stat.st_size, "mtime": stat.st_mtime}
+                unchanged.append(path)
+                continue
+            changed.append((path, {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": checksum}))
+        return changed, unchanged
+
+    def record(self, entries: list[tuple[str, dict]]) -> None:
+        ingested_at = datetime.now(timezone.utc).isoformat()
+        with self._lock:
+            for path, entry in entries:
+                self._files[path] = {**entry, "ingested_at": ingested_at}
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self._files, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+
+def _table_exists(spark, full_name: str) -> bool:
+    try:
+        return spark.catalog.tableExists(full_name)
+    except Exception:
+        return False
+
+
+def latest_per_key(source, keys: list[str]):
+    """
+    One row per key of a read_source(with_source_order=True) DataFrame: the one from the most
+    recently modified file (then the last file by name, then the last row in it), without the
+    source order columns.
+    """
+    from pyspark.sql import Window
+    from pyspark.sql import functions as F
+
+    newest_first = Window.partitionBy(*keys).orderBy(*(F.col(c).desc() for c in SOURCE_ORDER_COLUMNS))
+    return (source.withColumn("__rank", F.row_number().over(newest_first))
+            .where("__rank = 1").drop("__rank", *SOURCE_ORDER_COLUMNS))
+
+
+def merge_into(spark, manifest: Manifest, table: TableSpec, source) -> dict:
+    """
+    Upsert `source`, read with its source order, into the table by its business keys. Matched
+    rows are only rewritten when a column differs, so unchanged rows count as skipped. Returns
+    rows inserted, updated and skipped and the bytes written.
+    """
+    full_name = manifest.full_name(table)
+    columns = [name for name, _, _ in table_columns(table)]
+    # A key may appear in several changed files; MERGE needs one source row per key, the newest
+    source = latest_per_key(source, table.keys)
+    view = f"incoming_{table.name}_{os.getpid()}_{threading.get_ident()}"
+    source.createOrReplaceTempView(view)
+    on = " AND ".join(f"t.`{k}` <=> s.`{k}`" for k in table.keys)
+    differs = " OR ".join(f"NOT (t.`{c}` <=> s.`{c}`)" for c in columns if c not in table.keys)
+    try:
+        spark.sql(f"""
+            MERGE INTO {full_name} t
+            USING {view} s
+            ON {on}
+            WHEN MATCHED AND ({differs or 'false'}) THEN UPDATE SET *
+            WHEN NOT MATCHED THEN INSERT *
+        """)
+    finally:
+        spark.catalog.dropTempView(view)
+    metrics = spark.sql(f"DESCRIBE HISTORY {full_name} LIMIT 1").first()["operationMetrics"]
+    source_rows = int(metrics.get("numSourceRows", 0))
+    inserted = int(metrics.get("numTargetRowsInserted", 0))
+    updated = int(metrics.get("numTargetRowsUpdated", 0))
+    return {"rows_inserted": inserted, "rows_updated": updated, "rows_skipped": source_rows - inserted - updated,
+            "bytes_written": int(metrics.get("numTargetBytesAdded") or metrics.get("numOutputBytes") or 0)}
+
+
+class IncrementalLoader:
+    """
+    load_fn for run_ingestion that ingests only new or changed files of each table and MERGEs
+    their rows into the table. A table that does not exist yet, has no keys or is not stored as
+    Delta is rewritten from all its files instead, when any of them changed.
+    """
+
+    def __init__(self, manifest: Manifest):
+        self.files = FileManifest(os.path.join(manifest.state_dir, FILE_MANIFEST_NAME))
+
+    def __call__(self, spark, manifest: Manifest, table: TableSpec) -> dict:
+        full_name = manifest.full_name(table)
+        exists = _table_exists(spark, full_name)
+        changed, unchanged = self.files.changed_files(manifest.source_files(table))
+        metrics = {"files_ingested": len(changed), "files_skipped": len(unchanged),
+                   "rows_inserted": 0, "rows_updated": 0, "rows_skipped": 0, "rows_rejected": 0}
+        if exists and not changed:
+            logger.info("%s: no new or changed files", table.name)
+            return metrics
+
+        can_merge = exists and table.keys and manifest.format == "delta"
+        paths = [path for path, _ in changed] if can_merge else manifest.source_files(table)
+        start = time.perf_counter()
+        df = read_source(spark, manifest, table, paths, with_source_order=bool(can_merge))
+        try:
+            valid, malformed = split_malformed(df, table_columns(table))
+            metrics["rows_read"] = df.count()
+            metrics["bytes_read"] = source_bytes(paths)
+            metrics["rows_rejected"] = quarantine(manifest, table, malformed)
+            metrics["column_profiles"] = profile_columns(valid, table_columns(table))
+            metrics["changes"] = collect_changes(table, valid, merged=bool(can_merge))
+            if can_merge:
+                metrics.update(merge_into(spark, manifest, table, valid))
+            else:
+                metrics["files_ingested"], metrics["files_skipped"] = len(paths), 0
+                metrics["rows_inserted"] = valid.count()
+                valid.write.format(manifest.format).mode("overwrite").saveAsTable(full_name)
+                metrics["bytes_written"] = bytes_written(spark, manifest, full_name)
+            # Read, quarantine, profile and write; the report's throughput is based on this
+            metrics["load_seconds"] = round(time.perf_counter() - start, 3)
+            metrics["changes"]["version"] = table_version(spark, manifest, full_name)
+            publish_table_changes(manifest, table, metrics["changes"])
+        finally:
+            try:
+                df.unpersist()
+            except Exception:
+                pass
+        # Only recorded once the table holds the rows and their changes are published, so a failed
+        # load is retried next run
+        self.files.record(changed)
+        return metrics
@@ -0,0 +1,232 @@
+"""
+Physical layout policy applied to the Delta tables after each load.
+
+The app reads "one RM's customers" or "one customer across tables", so the hot tables are
+clustered by CustomerID/RMID and date, which lets Delta skip files using their min/max
+statistics. A table's "layout" in the manifest can set
+- "cluster_by": liquid clustering columns (ALTER TABLE ... CLUSTER BY, then OPTIMIZE; OPTIMIZE
+  FULL when the clustering columns changed, so data already written is reclustered too), or
+- "zorder_by": Z-order columns (OPTIMIZE ... ZORDER BY) for runtimes without liquid clustering,
+- "filter_columns": other columns the app filters on.
+Every Delta table is compacted with OPTIMIZE. Column statistics are recomputed only for the
+clustering, Z-order and filter columns; other tables get the cheap table-level statistics.
+
+run_layout_benchmark loads the tables behind typical dashboard queries into a scratch schema
+as a load without the policy leaves them, then times the queries and reads the files and bytes
+their scans read from the executed plan, before and after applying the policy:
+    python -m ingestion.layout --catalog "" --benchmark
+"""
+
+import argparse
+import logging
+import os
+import time
+
+from ingestion.manifest import DEFAULT_MANIFEST_PATH, Manifest, TableSpec, load_manifest
+
+logger = logging.getLogger(__name__)
+
+LAYOUT_BENCHMARK_SCHEMA_SUFFIX = "_layout_bench"
+# Scan metrics of Spark's file scans, and the benchmark figure each one is added to
+SCAN_METRICS = {"numFiles": "files_read", "filesSize": "bytes_read"}
+
+
+def _columns_sql(columns: list[str]) -> str:
+    return ", ".join(f"`{c}`" for c in columns)
+
+
+def table_detail(spark, full_name: str) -> dict:
+    detail = spark.sql(f"DESCRIBE DETAIL {full_name}").first()
+    return {"num_files": detail["numFiles"], "size_bytes": detail["sizeInBytes"]}
+
+
+def clustering_columns(spark, full_name: str) -> list[str]:
+    """Current liquid clustering columns of a table, empty when it is not clustered."""
+    detail = spark.sql(f"DESCRIBE DETAIL {full_name}").first().asDict()
+    return list(detail.get("clusteringColumns") or [])
+
+
+def apply_layout(spark, manifest: Manifest, table: TableSpec) -> dict:
+    """Cluster or Z-order, compact and analyze one table. Returns its file count before and after."""
+    if manifest.format != "delta":
+        logger.info("%s: layout policy needs Delta, skipped for %s tables", table.name, manifest.format)
+        return {}
+    full_name = manifest.full_name(table)
+    layout = table.config.get("layout", {})
+    before = table_detail(spark, full_name)
+    start = time.time()
+
+    reclustered = False
+    if layout.get("cluster_by"):
+        if clustering_columns(spark, full_name) != layout["cluster_by"]:
+            # A plain OPTIMIZE only clusters new data; FULL rewrites what was written before
+            spark.sql(f"ALTER TABLE {full_name} CLUSTER BY ({_columns_sql(layout['cluster_by'])})")
+            spark.sql(f"OPTIMIZE {full_name} FULL")
+            reclustered = True
+        else:
+            spark.sql(f"OPTIMIZE {full_name}")
+    elif layout.get("zorder_by"):
+        spark.sql(f"OPTIMIZE {full_name} ZORDER BY ({_columns_sql(layout['zorder_by'])})")
+    else:
+        spark.sql(f"OPTIMIZE {full_name}")
+
+    stats_columns = list(dict.fromkeys(
+        layout.get("cluster_by", []) + layout.get("zorder_by", []) + layout.get("filter_columns", [])
+    ))
+    if stats_columns:
+        spark.sql(f"ANALYZE TABLE {full_name} COMPUTE STATISTICS FOR COLUMNS {_columns_sql(stats_columns)}")
+    else:
+        spark.sql(f"ANALYZE TABLE {full_name} COMPUTE STATISTICS NOSCAN")
+
+    after = table_detail(spark, full_name)
+    logger.info("%s: layout applied in %.1fs, %d -> %d files%s", table.name, time.time() - start,
+                before["num_files"], after["num_files"], " (reclustered)" if reclustered else "")
+    return {"files_before_layout": before["num_files"], "files_after_layout": after["num_files"],
+            "reclustered": reclustered}
+
+
+def dashboard_queries(spark, manifest: Manifest) -> list[tuple[str, str, str]]:
+    """(label, table, predicate) for the app's typical lookups, using an existing RM and customer."""
+    customers = manifest.full_name(manifest.table("customer_dtls"))
+    rm_id, customer_id = spark.sql(
+        f"SELECT RMID, CustomerID FROM {customers} WHERE RMID IS NOT NULL LIMIT 1"
+    ).first()
+    # The book as literals, so the only scan of each query is the one of the table measured
+    book = [row[0] for row in spark.sql(f"SELECT CustomerID FROM {customers} WHERE RMID = '{rm_id}'").collect()]
+    rm_book = f"CustomerID IN ({', '.join(str(c) for c in book)})"
+    return [
+        ("customer transactions", "transactions", f"CustomerID = {customer_id}"),
+        ("customer transactions, last 90 days", "transactions",
+         f"CustomerID = {customer_id} AND TransactionDate >= date_sub(current_date(), 90)"),
+        ("RM book transactions", "transactions", rm_book),
+        ("customer interactions", "interactions", f"CustomerID = {customer_id}"),
+        ("RM interactions due", "interactions", f"RMID = '{rm_id}' AND DueDate >= current_date()"),
+        ("customer portfolio", "portfolio", f"CustomerID = {customer_id}"),
+        ("RM book portfolio", "portfolio", rm_book),
+    ]
+
+
+def _plan_nodes(plan) -> list:
+    """Every node of an executed Spark plan, looking through adaptive execution and query stages."""
+    nodes, stack = [], [plan]
+    while stack:
+        node = stack.pop()
+        name = node.getClass().getSimpleName()
+        if name == "AdaptiveSparkPlanExec":
+            stack.append(node.executedPlan())
+        elif name.endswith("QueryStageExec"):
+            stack.append(node.plan())
+        else:
+            nodes.append(node)
+            children = node.children()
+            stack.extend(children.apply(i) for i in range(children.size()))
+    return nodes
+
+
+def scan_metrics(df) -> dict:
+    """
+    Files and bytes read by the file scans of an executed DataFrame, after data skipping. None
+    where the plan cannot be inspected, e.g. on Spark Connect; the Spark UI shows the same metrics.
+    """
+    totals = dict.fromkeys(SCAN_METRICS.values())
+    try:
+        nodes = _plan_nodes(df._jdf.queryExecution().executedPlan())
+    except Exception:
+        return totals
+    for node in nodes:
+        metrics = node.metrics()
+        for key, name in SCAN_METRICS.items():
+            if metrics.contains(key):
+                totals[name] = (totals[name] or 0) + metrics.apply(key).value()
+    return totals
+
+
+def measure_query(spark, full_name: str, predicate: str) -> dict:
+    """Run a filtered count; report its duration and the files and bytes it read out of the table's total."""
+    df = spark.sql(f"SELECT count(*) FROM {full_name} WHERE {predicate}")
+    start = time.perf_counter()
+    rows = df.collect()[0][0]
+    seconds = time.perf_counter() - start
+    total = table_detail(spark, full_name)
+    return {"rows": rows, "seconds": round(seconds, 3), **scan_metrics(df),
+            "files_total": total["num_files"], "bytes_total": total["size_bytes"]}
+
+
+def benchmark_manifest(manifest: Manifest, tables: list[str]) -> Manifest:
+    """The manifest's `tables` loaded into a scratch schema, with their own state and quarantine folders."""
+    state_dir = os.path.join(manifest.state_dir, "layout_benchmark")
+    return Manifest(manifest.catalog, f"{manifest.schema}{LAYOUT_BENCHMARK_SCHEMA_SUFFIX}", manifest.source_dir,
+                    manifest.format, [manifest.table(name) for name in tables],
+                    os.path.join(state_dir, "quarantine"), state_dir)
+
+
+def run_layout_benchmark(spark, manifest: Manifest) -> list[dict]:
+    """
+    Reload the tables the dashboard queries use into a scratch schema without the layout policy,
+    measure the queries, apply the policy to those tables and measure again. The loaded tables are
+    left alone (they already have the policy applied), and the scratch schema is dropped afterwards.
+    """
+    from ingestion.pipeline import run_ingestion
+
+    queries = dashboard_queries(spark, manifest)
+    bench = benchmark_manifest(manifest, sorted({t for _, t, _ in queries}))
+    schema_name = ".".join(part for part in (bench.catalog, bench.schema) if part)
+    spark.sql(f"CREATE SCHEMA IF NOT EXISTS {schema_name}")
+    try:
+        statuses = run_ingestion(spark, bench, full_refresh=True, apply_layouts=False)
+        failed = [s.table for s in statuses if s.state != "succeeded"]
+        if failed:
+            raise RuntimeError(f"Benchmark load failed for: {', '.join(failed)}")
+        before = [measure_query(spark, bench.full_name(bench.table(t)), p) for _, t, p in queries]
+        for table in bench.tables:
+            apply_layout(spark, bench, table)
+        after = [measure_query(spark, bench.full_name(bench.table(t)), p) for _, t, p in queries]
+    finally:
+        spark.sql(f"DROP SCHEMA IF EXISTS {schema_name} CASCADE")
+    return [
+        {"query": label, "table": table, "before": b, "after": a}
+        for (label, table, _), b, a in zip(queries, before, after)
+    ]
+
+
+def _read(measure: dict) -> str:
+    if measure["files_read"] is None:
+        return f"{'?':>7}/{measure['files_total']:<7} {'?':>8}"
+    return f"{measure['files_read']:>7}/{measure['files_total']:<7} {(measure['bytes_read'] or 0) / 1e6:>8.1f}"
+
+
+def format_benchmark(results: list[dict]) -> str:
+    lines = [
+        f"{'query':<38} {'files before':>15} {'MB read':>8} {'files after':>15} {'MB read':>8} "
+        f"{'s before':>9} {'s after':>8}"
+    ]
+    for r in results:
+        b, a = r["before"], r["after"]
+        lines.append(f"{r['query']:<38} {_read(b)} {_read(a)} {b['seconds']:>9.2f} {a['seconds']:>8.2f}")
+    return "\n".join(lines)
+
+
+def main():
+    from ingestion.pipeline import local_spark_session
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--manifest", default=DEFAULT_MANIFEST_PATH)
+    parser.add_argument("--catalog")
+    parser.add_argument("--schema")
+    parser.add_argument("--tables", nargs="*", help="apply the policy to these tables only")
+    parser.add_argument("--benchmark", action="store_true", help="measure dashboard queries before and after")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    spark = local_spark_session()
+    manifest = load_manifest(args.manifest, catalog=args.catalog, schema=args.schema)
+    if args.benchmark:
+        print(format_benchmark(run_layout_benchmark(spark, manifest)))
+    else:
+        for table in manifest.tables:
+            if not args.tables or table.name in args.tables:
+                print(table.name, apply_layout(spark, manifest, table))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Table manifest for the bharat_bank_rm ingestion: which source files load into which tables.
+
+The defaults in manifest.json point at the Unity Catalog volume and tables used on Databricks.
+Every top-level setting can be overridden when loading, e.g. to run against local files and a
+local Spark session with an empty catalog and the parquet format.
+"""
+
+import glob
+import json
+import os
+
+DEFAULT_MANIFEST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "manifest.json")
+
+
+class TableSpec:
+    """
+    One table of the manifest. `source` is a file name or a glob pattern relative to the source
+    folder, `keys` the business key columns used to upsert rows. Other settings are kept in `config`.
+    """
+
+    def __init__(self, name: str, source: str, keys: list[str] = None, **config):
+        self.name = name
+        self.source = source
+        self.keys = keys or []
+        self.config = config
+
+    def __repr__(self):
+        return f"TableSpec({self.name!r}, {self.source!r})"
+
+
+class Manifest:
+    def __init__(self, catalog: str, schema: str, source_dir: str, format: str, tables: list[TableSpec],
+                 quarantine_dir: str = None, state_dir: str = None):
+        self.catalog = catalog
+        self.schema = schema
+        self.source_dir = source_dir
+        self.format = format
+        self.tables = tables
+        self.quarantine_dir = quarantine_dir or os.path.join(source_dir, "_quarantine")
+        self.state_dir = state_dir or os.path.join(source_dir, "_ingestion_state")
+
+    def full_name(self, table: TableSpec) -> str:
+        """Table name as passed to saveAsTable: catalog.schema.table, or schema.table without a catalog."""
+        return ".".join(part for part in (self.catalog, self.schema, table.name) if part)
+
+    def source_path(self, table: TableSpec) -> str:
+        return os.path.join(self.source_dir, table.source)
+
+    def source_files(self, table: TableSpec) -> list[str]:
+        """The files matching the table's source pattern, or the source path itself if it has no wildcard."""
+        path = self.source_path(table)
+        if any(c in path for c in "*?["):
+            return sorted(glob.glob(path))
+        return [path]
+
+    def table(self, name: str) -> TableSpec:
+        for table in self.tables:
+            if table.name == name:
+                return table
+        raise KeyError(f"Table {name} is not in the manifest")
+
+
+def load_manifest(path: str = DEFAULT_MANIFEST_PATH, tables: list[str] = None, **overrides) -> Manifest:
+    """
+    Read the manifest at `path`. `tables` keeps only the named tables; keyword overrides
+    (catalog, schema, source_dir, format, quarantine_dir, state_dir) replace the settings of the file when not None.
+    """
+    with open(path) as f:
+        config = json.load(f)
+    config.update({key: value for key, value in overrides.items() if value is not None})
+    specs = [TableSpec(**table) for table in config["tables"]]
+    if tables:
+        unknown = set(tables) - {spec.name for spec in specs}
+        if unknown:
+            raise KeyError(f"Tables not in the manifest: {', '.join(sorted(unknown))}")
+        specs = [spec for spec in specs if spec.name in tables]
+    return Manifest(config["catalog"], config["schema"], config["source_dir"], config["format"], specs,
+                    config.get("quarantine_dir"), config.get("state_dir"))
@@ -0,0 +1,232 @@
+"""
+Loads the bharat_bank_rm source feeds listed in the manifest into tables.
+
+Each table is loaded on its own thread, at most `max_parallel` at a time, largest source
+file first, so a full refresh takes about as long as the largest table rather than the sum
+of all of them. A failed load is retried with backoff; every table ends with a status.
+
+On Databricks (see 00-ingestion.ipynb):
+    from ingestion.manifest import load_manifest
+    from ingestion.pipeline import run_ingestion
+    statuses = run_ingestion(spark, load_manifest())
+
+By default only new or changed source files are read and upserted by business key (see
+ingestion/incremental.py); full_refresh=True rewrites every table from all its files.
+
+Locally, against CSV files in a folder and a local Spark session (install delta-spark for MERGE,
+otherwise use --format parquet, which rewrites a table whenever one of its files changed):
+    python -m ingestion.pipeline --source-dir ./source_feed --catalog "" --format parquet
+"""
+
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ingestion.changefeed import collect_changes, publish_table_changes, table_version
+from ingestion.incremental import IncrementalLoader
+from ingestion.layout import apply_layout
+from ingestion.manifest import DEFAULT_MANIFEST_PATH, Manifest, TableSpec, load_manifest
+from ingestion.reader import quarantine, read_source, split_malformed, table_columns
+from ingestion.report import bytes_written, format_report, profile_columns, source_bytes, write_run_report
+from ingestion.schemas import SchemaMismatchError
+
+logger = logging.getLogger(__name__)
+
+INGEST_MAX_PARALLEL = int(os.getenv("INGEST_MAX_PARALLEL", "4"))
+INGEST_MAX_RETRIES = int(os.getenv("INGEST_MAX_RETRIES", "2"))
+INGEST_BACKOFF_BASE_SECONDS = float(os.getenv("INGEST_BACKOFF_BASE_SECONDS", "5"))
+INGEST_BACKOFF_MAX_SECONDS = 60
+# Errors a retry cannot fix
+NON_RETRYABLE_ERRORS = (SchemaMismatchError, KeyError)
+
+
+class TableLoadStatus:
+    """Progress of one table: pending, running, retrying, succeeded or failed."""
+
+    def __init__(self, table: str):
+        self.table = table
+        self.state = "pending"
+        self.attempts = 0
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+        self.metrics = {}
+
+    @property
+    def duration_seconds(self):
+        if self.started_at is None:
+            return None
+        return round((self.finished_at or time.time()) - self.started_at, 3)
+
+    def to_dict(self) -> dict:
+        return {
+            "table": self.table,
+            "state": self.state,
+            "attempts": self.attempts,
+            "duration_seconds": self.duration_seconds,
+            "error": self.error,
+            **self.metrics,
+        }
+
+
+def load_table(spark, manifest: Manifest, table: TableSpec) -> dict:
+    """Full reload: read all source CSVs of a table, quarantine malformed rows and overwrite the table."""
+    start = time.perf_counter()
+    df = read_source(spark, manifest, table)
+    try:
+        valid, malformed = split_malformed(df, table_columns(table))
+        metrics = {
+            "rows_read": df.count(),
+            "bytes_read": source_bytes(manifest.source_files(table)),
+            "rows_rejected": quarantine(manifest, table, malformed),
+            "column_profiles": profile_columns(valid, table_columns(table)),
+            "changes": collect_changes(table, valid),
+        }
+        metrics["rows_inserted"] = metrics["rows_read"] - metrics["rows_rejected"]
+        valid.write.format(manifest.format).mode("overwrite").saveAsTable(manifest.full_name(table))
+        metrics["load_seconds"] = round(time.perf_counter() - start, 3)
+        metrics["bytes_written"] = bytes_written(spark, manifest, manifest.full_name(table))
+        metrics["changes"]["version"] = table_version(spark, manifest, manifest.full_name(table))
+        publish_table_changes(manifest, table, metrics["changes"])
+    finally:
+        try:
+            df.unpersist()
+        except Exception:
+            pass
+    return metrics
+
+
+def _backoff_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff: uniform in [0, min(max, base * 2**attempt)]."""
+    return random.uniform(0, min(INGEST_BACKOFF_MAX_SECONDS, INGEST_BACKOFF_BASE_SECONDS * (2 ** attempt)))
+
+
+def _apply_layout(spark, manifest: Manifest, table: TableSpec, status: TableLoadStatus) -> None:
+    """Apply the table's layout policy after a load that wrote data; a failure here keeps the load."""
+    if status.metrics.get("files_ingested") == 0:
+        return
+    try:
+        status.metrics.update(apply_layout(spark, manifest, table))
+    except Exception as e:
+        status.metrics["layout_error"] = f"{type(e).__name__}: {e}"
+        logger.warning("Layout policy for %s failed: %s", table.name, status.metrics["layout_error"])
+
+
+def _load_with_retries(spark, manifest: Manifest, table: TableSpec, status: TableLoadStatus,
+                       max_retries: int, load_fn, apply_layouts: bool) -> None:
+    status.started_at = time.time()
+    while True:
+        status.attempts += 1
+        status.state = "running"
+        try:
+            status.metrics = load_fn(spark, manifest, table) or {}
+        except Exception as e:
+            status.error = f"{type(e).__name__}: {e}"
+            if status.attempts > max_retries or isinstance(e, NON_RETRYABLE_ERRORS):
+                status.state = "failed"
+                logger.error("Loading %s failed after %d attempts: %s", table.name, status.attempts, status.error)
+                break
+            status.state = "retrying"
+            delay = _backoff_delay(status.attempts - 1)
+            logger.warning("Loading %s failed (attempt %d), retrying in %.1fs: %s",
+                           table.name, status.attempts, delay, status.error)
+            time.sleep(delay)
+        else:
+            if apply_layouts:
+                _apply_layout(spark, manifest, table, status)
+            status.state = "succeeded"
+            status.error = None
+            logger.info("Loaded %s in %.1fs", table.name, time.time() - status.started_at)
+            break
+    status.finished_at = time.time()
+
+
+def run_ingestion(spark, manifest: Manifest, max_parallel: int = INGEST_MAX_PARALLEL,
+                  max_retries: int = INGEST_MAX_RETRIES, load_fn=None,
+                  full_refresh: bool = False, apply_layouts: bool = True) -> list[TableLoadStatus]:
+    """
+    Load every table of the manifest concurrently and return their statuses in manifest order.
+    A failing table does not stop the others. `load_fn(spark, manifest, table)` does the
+    actual load of one table; by default only new or changed files are ingested and merged
+    (IncrementalLoader), or every table is rewritten from all its files with `full_refresh`.
+    After a load that wrote data, the table's layout policy (clustering, compaction, statistics)
+    is applied unless `apply_layouts` is False.
+    """
+    if load_fn is None:
+        load_fn = load_table if full_refresh else IncrementalLoader(manifest)
+    if not manifest.catalog:
+        spark.sql(f"CREATE DATABASE IF NOT EXISTS {manifest.schema}")
+    statuses = {table.name: TableLoadStatus(table.name) for table in manifest.tables}
+    # Largest first, so the longest load starts right away instead of queueing behind small ones
+    ordered = sorted(manifest.tables, key=lambda t: source_bytes(manifest.source_files(t)), reverse=True)
+    with ThreadPoolExecutor(max_workers=max(1, max_parallel), thread_name_prefix="ingest") as pool:
+        for table in ordered:
+            pool.submit(_load_with_retries, spark, manifest, table, statuses[table.name], max_retries, load_fn,
+                        apply_layouts)
+    return [statuses[table.name] for table in manifest.tables]
+
+
+def format_statuses(statuses: list[TableLoadStatus]) -> str:
+    lines = [
+        f"{'table':<22} {'state':<10} {'attempts':>8} {'seconds':>9} {'files':>6} "
+        f"{'inserted':>9} {'updated':>9} {'skipped':>9} {'rejected':>9}  error"
+    ]
+    for s in statuses:
+        m = s.metrics
+        lines.append(
+            f"{s.table:<22} {s.state:<10} {s.attempts:>8} {s.duration_seconds or 0:>9.1f} "
+            f"{m.get('files_ingested', ''):>6} {m.get('rows_inserted', ''):>9} {m.get('rows_updated', ''):>9} "
+            f"{m.get('rows_skipped', ''):>9} {m.get('rows_rejected', ''):>9}  {s.error or ''}"
+        )
+    return "\n".join(lines)
+
+
+def local_spark_session(app_name: str = "bharat-bank-ingestion"):
+    """Local Spark session, with Delta Lake (and so MERGE) enabled when delta-spark is installed."""
+    from pyspark.sql import SparkSession
+
+    builder = SparkSession.builder.master("local[*]").appName(app_name)
+    try:
+        from delta import configure_spark_with_delta_pip
+    except ImportError:
+        return builder.getOrCreate()
+    builder = builder.config("spark.sql.extensions", "io.delta.sql.DeltaSparkSessionExtension").config(
+        "spark.sql.catalog.spark_catalog", "org.apache.spark.sql.delta.catalog.DeltaCatalog"
+    )
+    return configure_spark_with_delta_pip(builder).getOrCreate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--manifest", default=DEFAULT_MANIFEST_PATH)
+    parser.add_argument("--source-dir", help="folder with the source CSVs (default: from the manifest)")
+    parser.add_argument("--catalog", help='catalog of the target tables; "" for a local metastore')
+    parser.add_argument("--schema")
+    parser.add_argument("--format", help="table format, e.g. delta or parquet")
+    parser.add_argument("--quarantine-dir", help="where malformed rows are written")
+    parser.add_argument("--tables", nargs="*", help="load only these tables")
+    parser.add_argument("--max-parallel", type=int, default=INGEST_MAX_PARALLEL)
+    parser.add_argument("--max-retries", type=int, default=INGEST_MAX_RETRIES)
+    parser.add_argument("--full-refresh", action="store_true", help="rewrite every table from all its files")
+    parser.add_argument("--no-history", action="store_true", help="save the run report as JSON only")
+    parser.add_argument("--skip-layout", action="store_true", help="do not cluster, compact or analyze after loading")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(threadName)s %(message)s")
+
+    manifest = load_manifest(args.manifest, args.tables, catalog=args.catalog, schema=args.schema,
+                             source_dir=args.source_dir, format=args.format, quarantine_dir=args.quarantine_dir)
+    spark = local_spark_session()
+    statuses = run_ingestion(spark, manifest, args.max_parallel, args.max_retries,
+                             full_refresh=args.full_refresh, apply_layouts=not args.skip_layout)
+    print(format_statuses(statuses))
+    report = write_run_report(spark, manifest, statuses, not args.no_history)
+    print(format_report(report))
+    sys.exit(0 if all(s.state == "succeeded" for s in statuses) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Reads source CSVs with their registered schema and separates malformed rows.
+"""
+
+import csv
+import logging
+import os
+from datetime import datetime, timezone
+
+from ingestion.manifest import Manifest, TableSpec
+from ingestion.schemas import CORRUPT_RECORD_COLUMN, get_columns, spark_ddl, validate_header
+
+logger = logging.getLogger(__name__)
+
+# Added by read_source(with_source_order=True): where each row came from, newest file last
+SOURCE_MTIME_COLUMN = "__source_mtime"
+SOURCE_FILE_COLUMN = "__source_file"
+SOURCE_ROW_COLUMN = "__source_row"
+SOURCE_ORDER_COLUMNS = [SOURCE_MTIME_COLUMN, SOURCE_FILE_COLUMN, SOURCE_ROW_COLUMN]
+
+
+def table_columns(table: TableSpec) -> list[tuple[str, str, bool]]:
+    return get_columns(table.name, table.config.get("schema_version"))
+
+
+def read_source(spark, manifest: Manifest, table: TableSpec, paths: list[str] = None, with_source_order: bool = False):
+    """
+    Read the source CSVs of a table (default: all of them) with its registered schema, after
+    checking each file's header against it. Rows that do not parse into the declared types keep
+    their raw text in CORRUPT_RECORD_COLUMN. The result is cached where the cluster supports it,
+    so the files are parsed only once. With `with_source_order`, SOURCE_ORDER_COLUMNS hold each
+    row's file modification time, file path and an id that increases with its position in the file.
+    """
+    columns = table_columns(table)
+    paths = paths or manifest.source_files(table)
+    for path in paths:
+        header_line = spark.read.text(path).first()
+        validate_header(table.name, next(csv.reader([header_line[0] if header_line else ""])), columns)
+
+    df = spark.read.csv(
+        paths,
+        header=True,
+        schema=spark_ddl(columns, CORRUPT_RECORD_COLUMN),
+        mode="PERMISSIVE",
+        columnNameOfCorruptRecord=CORRUPT_RECORD_COLUMN,
+        dateFormat=table.config.get("date_format", "yyyy-MM-dd"),
+    )
+    if with_source_order:
+        from pyspark.sql import functions as F
+
+        # Taken before caching: file metadata is only available on the scan itself
+        df = df.select(
+            "*",
+            F.col("_metadata.file_modification_time").alias(SOURCE_MTIME_COLUMN),
+            F.col("_metadata.file_path").alias(SOURCE_FILE_COLUMN),
+            F.monotonically_increasing_id().alias(SOURCE_ROW_COLUMN),
+        )
+    try:
+        df = df.cache()
+    except Exception:
+        # Serverless compute does not support caching; the file is then read once per output
+        pass
+    return df
+
+
+def split_malformed(df, columns: list[tuple[str, str, bool]]):
+    """
+    Split a DataFrame from read_source into valid rows and malformed rows: rows Spark could not
+    parse, or with a null in a non-nullable column
+    """
+    from pyspark.sql import functions as F
+
+    is_malformed = F.col(CORRUPT_RECORD_COLUMN).isNotNull()
+    for name, _, nullable in columns:
+        if not nullable:
+            is_malformed = is_malformed | F.col(name).isNull()
+    return df.filter(~is_malformed).drop(CORRUPT_RECORD_COLUMN), df.filter(is_malformed)
+
+
+def quarantine(manifest: Manifest, table: TableSpec, malformed) -> int:
+    """Write malformed rows as JSON under quarantine_dir/<table>/<UTC timestamp>; returns how many."""
+    rejected = malformed.count()
+    if rejected:
+        run_stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        path = os.path.join(manifest.quarantine_dir, table.name, run_stamp)
+        malformed.write.mode("overwrite").json(path)
+        logger.warning("%s: %d malformed rows quarantined to %s", table.name, rejected, path)
+    return rejected
@@ -0,0 +1,210 @@
+"""
+Per-run ingestion report: volumes, throughput, rejected rows, schema drift and column profiles.
+
+The loaders add rows_read, bytes_read, bytes_written, column_profiles and load_seconds (the
+read-to-write time of the successful attempt) to each table's metrics; write_run_report
+combines them with the load statuses into one report per run, saved as JSON under
+state_dir/run_reports/ and appended to the ingestion_run_history table, so load time and
+data volume can be compared across runs. rows_per_second is rows_read over load_seconds, so
+retry backoff and the layout policy (OPTIMIZE, ANALYZE) do not dilute it; duration_seconds
+still includes them:
+
+    SELECT run_started_at, `table`, rows_read, load_seconds, duration_seconds, rows_per_second
+    FROM <catalog>.<schema>.ingestion_run_history ORDER BY run_started_at DESC
+"""
+
+import json
+import logging
+import os
+from datetime import datetime, timezone
+
+from ingestion.manifest import Manifest, TableSpec
+from ingestion.reader import table_columns
+from ingestion.schemas import SchemaMismatchError
+
+logger = logging.getLogger(__name__)
+
+INGEST_PROFILE_COLUMNS = os.getenv("INGEST_PROFILE_COLUMNS", "1") == "1"
+RUN_HISTORY_TABLE = "ingestion_run_history"
+RUN_REPORTS_DIR_NAME = "run_reports"
+RUN_HISTORY_DDL = (
+    "run_id string, run_started_at timestamp, `table` string, state string, attempts int, duration_seconds double, "
+    "files_ingested bigint, rows_read bigint, rows_written bigint, rows_rejected bigint, bytes_read bigint, "
+    "bytes_written bigint, rows_per_second double, schema_drift string, column_profiles string, error string, "
+    "load_seconds double"
+)
+
+
+def source_bytes(paths: list[str]) -> int:
+    total = 0
+    for path in paths:
+        try:
+            total += os.path.getsize(path)
+        except OSError:
+            pass
+    return total
+
+
+def profile_columns(df, columns: list[tuple[str, str, bool]]) -> dict:
+    """Null fraction, approximate distinct count, min and max of every column, in one pass over `df`."""
+    if not INGEST_PROFILE_COLUMNS:
+        return {}
+    from pyspark.sql import functions as F
+
+    aggregates = [F.count(F.lit(1)).alias("__rows")]
+    for i, (name, _, _) in enumerate(columns):
+        aggregates += [
+            F.count(F.col(name)).alias(f"c{i}_count"),
+            F.approx_count_distinct(F.col(name)).alias(f"c{i}_distinct"),
+            F.min(F.col(name)).alias(f"c{i}_min"),
+            F.max(F.col(name)).alias(f"c{i}_max"),
+        ]
+    row = df.agg(*aggregates).first()
+    rows = row["__rows"]
+    profiles = {}
+    for i, (name, _, _) in enumerate(columns):
+        profiles[name] = {
+            "null_fraction": round(1 - row[f"c{i}_count"] / rows, 4) if rows else None,
+            "approx_distinct": row[f"c{i}_distinct"],
+            "min": None if row[f"c{i}_min"] is None else str(row[f"c{i}_min"]),
+            "max": None if row[f"c{i}_max"] is None else str(row[f"c{i}_max"]),
+        }
+    return profiles
+
+
+def bytes_written(spark, manifest: Manifest, full_name: str):
+    """Bytes written by the last operation on a Delta table, None for other formats."""
+    if manifest.format != "delta":
+        return None
+    metrics = spark.sql(f"DESCRIBE HISTORY {full_name} LIMIT 1").first()["operationMetrics"]
+    return int(metrics.get("numOutputBytes") or metrics.get("numTargetBytesAdded") or 0)
+
+
+def schema_drift(spark, manifest: Manifest, table: TableSpec, columns: list[tuple[str, str, bool]]) -> list[str]:
+    """Differences between the loaded table and the registered schema, e.g. after a schema version change."""
+    try:
+        fields = {field.name: field.dataType.simpleString() for field in spark.table(manifest.full_name(table)).schema}
+    except Exception:
+        return []
+    drift = []
+    for name, type_, _ in columns:
+        if name not in fields:
+            drift.append(f"{name}: registered, missing from the table")
+        elif fields[name] != type_.replace(" ", ""):
+            drift.append(f"{name}: registered as {type_}, table has {fields[name]}")
+    registered = {name for name, _, _ in columns}
+    drift += [f"{name}: in the table, not registered" for name in fields if name not in registered]
+    return drift
+
+
+def table_report(spark, manifest: Manifest, status) -> dict:
+    table = manifest.table(status.table)
+    m = status.metrics
+    rows_read = m.get("rows_read", 0)
+    drift = schema_drift(spark, manifest, table, table_columns(table))
+    if status.error and status.error.startswith(SchemaMismatchError.__name__):
+        drift.insert(0, status.error)
+    duration = status.duration_seconds or 0
+    # Older loaders and failed loads have no load_seconds
+    load_seconds = m.get("load_seconds") or duration
+    return {
+        "table": status.table,
+        "state": status.state,
+        "attempts": status.attempts,
+        "duration_seconds": duration,
+        "load_seconds": m.get("load_seconds"),
+        "files_ingested": m.get("files_ingested"),
+        "rows_read": rows_read,
+        "rows_written": m.get("rows_inserted", 0) + m.get("rows_updated", 0),
+        "rows_rejected": m.get("rows_rejected", 0),
+        "bytes_read": m.get("bytes_read", 0),
+        "bytes_written": m.get("bytes_written"),
+        "rows_per_second": round(rows_read / load_seconds, 1) if load_seconds else None,
+        "schema_drift": drift,
+        "column_profiles": m.get("column_profiles", {}),
+        "error": status.error,
+    }
+
+
+def latest_report(manifest: Manifest):
+    """The most recent saved report, or None."""
+    directory = os.path.join(manifest.state_dir, RUN_REPORTS_DIR_NAME)
+    try:
+        names = sorted(name for name in os.listdir(directory) if name.endswith(".json"))
+    except FileNotFoundError:
+        return None
+    if not names:
+        return None
+    with open(os.path.join(directory, names[-1])) as f:
+        return json.load(f)
+
+
+def _append_history(spark, manifest: Manifest, report: dict) -> None:
+    started_at = datetime.fromisoformat(report["started_at"])
+    rows = [
+        {**t, "run_id": report["run_id"], "run_started_at": started_at,
+         "schema_drift": json.dumps(t["schema_drift"]), "column_profiles": json.dumps(t["column_profiles"])}
+        for t in report["tables"]
+    ]
+    columns = [column.split(" ")[0].strip("`") for column in RUN_HISTORY_DDL.split(", ")]
+    df = spark.createDataFrame([tuple(row.get(c) for c in columns) for row in rows], RUN_HISTORY_DDL)
+    name = ".".join(part for part in (manifest.catalog, manifest.schema, RUN_HISTORY_TABLE) if part)
+    # mergeSchema adds columns introduced since the table was created, such as load_seconds
+    df.write.format(manifest.format).mode("append").option("mergeSchema", "true").saveAsTable(name)
+
+
+def write_run_report(spark, manifest: Manifest, statuses: list, history_table: bool = True) -> dict:
+    """Build the report of a finished run, save it as JSON and append it to the run history table."""
+    started = [s.started_at for s in statuses if s.started_at]
+    finished = [s.finished_at for s in statuses if s.finished_at]
+    started_at = datetime.fromtimestamp(min(started) if started else 0, timezone.utc)
+    report = {
+        "run_id": started_at.strftime("%Y%m%dT%H%M%SZ"),
+        "started_at": started_at.isoformat(),
+        "duration_seconds": round(max(finished) - min(started), 3) if started and finished else None,
+        "previous_run_id": None,
+        "tables": [table_report(spark, manifest, s) for s in statuses],
+    }
+    previous = latest_report(manifest)
+    if previous:
+        report["previous_run_id"] = previous["run_id"]
+        before = {t["table"]: t for t in previous["tables"]}
+        for t in report["tables"]:
+            if t["table"] in before:
+                t["previous"] = {k: before[t["table"]].get(k)
+                                 for k in ("duration_seconds", "load_seconds", "rows_read", "bytes_read")}
+
+    path = os.path.join(manifest.state_dir, RUN_REPORTS_DIR_NAME, f"{report['run_id']}.json")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(report, f, indent=1, default=str)
+    logger.info("Run report written to %s", path)
+    if history_table:
+        try:
+            _append_history(spark, manifest, report)
+        except Exception as e:
+            # The JSON report is still there; a history table problem must not fail the run
+            logger.warning("Could not append to %s: %s", RUN_HISTORY_TABLE, e)
+    return report
+
+
+def _change(now, before) -> str:
+    if not now or not before:
+        return ""
+    return f"{(now / before - 1) * 100:+.0f}%"
+
+
+def format_report(report: dict) -> str:
+    lines = [
+        f"{'table':<22} {'rows read':>11} {'written':>11} {'rejected':>9} {'MB read':>9} {'seconds':>8} "
+        f"{'load s':>8} {'rows/s':>10} {'vs last':>8}  schema drift"
+    ]
+    for t in report["tables"]:
+        previous = t.get("previous", {})
+        lines.append(
+            f"{t['table']:<22} {t['rows_read']:>11} {t['rows_written']:>11} {t['rows_rejected']:>9} "
+            f"{t['bytes_read'] / 1e6:>9.1f} {t['duration_seconds']:>8.1f} "
+            f"{t.get('load_seconds') or 0:>8.1f} {t['rows_per_second'] or 0:>10.0f} "
+            f"{_change(t['duration_seconds'], previous.get('duration_seconds')):>8}  {'; '.join(t['schema_drift'])}"
+        )
+    return "\n".join(lines)
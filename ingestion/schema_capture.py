@@ -0,0 +1,117 @@
+"""
+Captures version 1 of the source feed schemas from the live data into ingestion/schemas.json.
+
+Column names and their order come from the header of each table's first source file. Types
+come from the table already loaded from that feed (the original notebook loaded every feed
+with inferSchema), and from inferSchema over the source file for columns the table does not
+have or when it does not exist yet. The manifest keys are not nullable, every other column is.
+Tables already in the file are left alone, so a captured version is never rewritten: add a
+new version by hand when a feed changes.
+
+Run it where the source volume is mounted (00-ingestion.ipynb does before loading) and commit
+the file:
+
+    python -m ingestion.schema_capture [--tables customer_dtls interactions]
+"""
+
+import argparse
+import csv
+import json
+import logging
+import os
+from datetime import datetime, timezone
+
+from ingestion.manifest import DEFAULT_MANIFEST_PATH, Manifest, TableSpec, load_manifest
+from ingestion.schemas import CAPTURED_SCHEMAS, CAPTURED_SCHEMAS_PATH, SCHEMAS, normalize_column
+
+logger = logging.getLogger(__name__)
+
+# Spark simpleString types mapped to the registry's type names; anything else is read as a string
+SPARK_TYPES = {"int": "int", "integer": "int", "smallint": "int", "tinyint": "int", "bigint": "bigint",
+               "long": "bigint", "double": "double", "float": "double", "boolean": "boolean", "date": "date",
+               "timestamp": "timestamp", "timestamp_ntz": "timestamp", "string": "string"}
+
+
+def registry_type(spark_type: str) -> str:
+    if spark_type.startswith("decimal"):
+        return spark_type.replace(" ", "")
+    return SPARK_TYPES.get(spark_type, "string")
+
+
+def _field_types(schema) -> dict:
+    return {normalize_column(field.name): registry_type(field.dataType.simpleString()) for field in schema}
+
+
+def capture_table(spark, manifest: Manifest, table: TableSpec) -> dict:
+    """Version 1 of `table` from its first source file and its current table, with where each part came from."""
+    path = manifest.source_files(table)[0]
+    header_line = spark.read.text(path).first()
+    header = next(csv.reader([header_line[0] if header_line else ""]), [])
+    if not header:
+        raise ValueError(f"{table.name}: {path} has no header row")
+
+    full_name = manifest.full_name(table)
+    try:
+        types = _field_types(spark.table(full_name).schema)
+        sources = [f"header of {path}", f"column types of {full_name}"]
+    except Exception:
+        types, sources = {}, [f"header of {path}"]
+    if any(normalize_column(name) not in types for name in header):
+        inferred = _field_types(spark.read.csv(path, header=True, inferSchema=True).schema)
+        types = {**inferred, **types}
+        sources.append(f"inferSchema over {path}")
+
+    keys = {normalize_column(key) for key in table.keys}
+    columns = [[name, types.get(normalize_column(name), "string"), normalize_column(name) not in keys]
+               for name in header]
+    return {"captured_from": sources, "captured_at": datetime.now(timezone.utc).isoformat(),
+            "versions": {"1": columns}}
+
+
+def capture_schemas(spark, manifest: Manifest, path: str = CAPTURED_SCHEMAS_PATH) -> list[str]:
+    """
+    Capture the tables of the manifest that have no schema in `path` yet, add them to the file and
+    register them for this process. Returns the names of the newly captured tables.
+    """
+    captured = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            captured = json.load(f)
+    new = [table for table in manifest.tables if table.name not in captured]
+    for table in new:
+        captured[table.name] = capture_table(spark, manifest, table)
+        logger.info("Captured the schema of %s from %s", table.name, ", ".join(captured[table.name]["captured_from"]))
+    if not new:
+        return []
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(dict(sorted(captured.items())), f, indent=1)
+        f.write("\n")
+    os.replace(tmp_path, path)
+    for table in new:
+        versions = {int(v): [tuple(c) for c in columns] for v, columns in captured[table.name]["versions"].items()}
+        CAPTURED_SCHEMAS[table.name] = SCHEMAS[table.name] = versions
+    return [table.name for table in new]
+
+
+def main():
+    from ingestion.pipeline import local_spark_session
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--manifest", default=DEFAULT_MANIFEST_PATH)
+    parser.add_argument("--source-dir", help="folder with the source CSVs (default: from the manifest)")
+    parser.add_argument("--catalog", help='catalog of the existing tables; "" for a local metastore')
+    parser.add_argument("--schema")
+    parser.add_argument("--tables", nargs="*", help="capture only these tables")
+    parser.add_argument("--out", default=CAPTURED_SCHEMAS_PATH)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    manifest = load_manifest(args.manifest, args.tables, catalog=args.catalog, schema=args.schema,
+                             source_dir=args.source_dir)
+    print(json.dumps(capture_schemas(local_spark_session(), manifest, args.out)))
+
+
+if __name__ == "__main__":
+    main()
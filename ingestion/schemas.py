@@ -0,0 +1,212 @@
+"""
+Versioned column schemas of the bharat_bank_rm source feeds.
+
+Each table maps schema versions to its columns as (name, type, nullable), in source file
+order. Types are Spark SQL type names, so a schema can be passed straight to the CSV reader
+as a DDL string, which avoids the extra pass and the run-to-run drift of inferSchema.
+Add a new version instead of editing one that has been loaded, and pin a table to a version
+with "schema_version" in the manifest.
+
+The schemas of the live feeds are captured from the data, not written by hand: version 1 of
+each table comes from the header of its source file and the column types of the table already
+loaded from it (see ingestion/schema_capture.py), and is kept in schemas.json next to this
+file. BUILTIN_SCHEMAS describes the feeds written by ingestion/synthetic.py, with money as
+decimals and dates as dates; only a few of its names (CustomerID, Name, DOB, PAN, Aadhaar,
+Segment, Branch, RelationshipStartDate, ProductType, Value, RiskScore, KYCExpiry, Alert and
+the digital_engagement columns) are known to match the live tables. It is used for a table
+until that table's schema has been captured. INGEST_CAPTURED_SCHEMAS="" ignores schemas.json,
+e.g. to load synthetic feeds.
+"""
+
+import json
+import os
+import re
+
+CORRUPT_RECORD_COLUMN = "_corrupt_record"
+MONEY = "decimal(18,2)"
+CAPTURED_SCHEMAS_PATH = os.getenv(
+    "INGEST_CAPTURED_SCHEMAS", os.path.join(os.path.dirname(os.path.abspath(__file__)), "schemas.json")
+)
+
+BUILTIN_SCHEMAS = {
+    "campaigns": {
+        1: [
+            ("CampaignID", "string", False),
+            ("CampaignName", "string", True),
+            ("ProductType", "string", True),
+            ("TargetSegment", "string", True),
+            ("Channel", "string", True),
+            ("StartDate", "date", True),
+            ("EndDate", "date", True),
+            ("Budget", MONEY, True),
+            ("Status", "string", True),
+        ],
+    },
+    "customer_dtls": {
+        1: [
+            ("CustomerID", "int", False),
+            ("Name", "string", True),
+            ("DOB", "date", True),
+            ("Gender", "string", True),
+            ("PAN", "string", True),
+            ("Aadhaar", "string", True),
+            ("Segment", "string", True),
+            ("Branch", "string", True),
+            ("City", "string", True),
+            ("RMID", "string", True),
+            ("RelationshipStartDate", "date", True),
+            ("RiskProfile", "string", True),
+        ],
+    },
+    "digital_engagement": {
+        1: [
+            ("CustomerID", "int", False),
+            ("MonthlyLogins", "int", True),
+            ("LastLoginDate", "date", True),
+            ("Device", "string", True),
+            ("PreferredChannel", "string", True),
+            ("EngagementScore", "int", True),
+        ],
+    },
+    "interactions": {
+        1: [
+            ("InteractionID", "string", False),
+            ("CustomerID", "int", False),
+            ("RMID", "string", True),
+            ("InteractionDate", "date", True),
+            ("Type", "string", True),
+            ("Subject", "string", True),
+            ("Status", "string", True),
+            ("NextAction", "string", True),
+            ("DueDate", "date", True),
+        ],
+    },
+    "portfolio": {
+        1: [
+            ("CustomerID", "int", False),
+            ("ProductType", "string", False),
+            ("ProductSubType", "string", True),
+            ("Value", MONEY, True),
+            ("AsOfDate", "date", True),
+        ],
+    },
+    "risk_compliance": {
+        1: [
+            ("CustomerID", "int", False),
+            ("RiskScore", "int", True),
+            ("KYCExpiry", "date", True),
+            ("Alert", "string", True),
+            ("AlertSeverity", "string", True),
+            ("DueDate", "date", True),
+        ],
+    },
+    "rm_performance": {
+        1: [
+            ("RMID", "string", False),
+            ("RMName", "string", True),
+            ("Branch", "string", True),
+            ("Region", "string", True),
+            ("ClientsAssigned", "int", True),
+            ("AUMTarget", MONEY, True),
+            ("CurrentAUM", MONEY, True),
+            ("Month", "date", False),
+        ],
+    },
+    "service_requests": {
+        1: [
+            ("SRNo", "string", False),
+            ("CustomerID", "int", False),
+            ("Type", "string", True),
+            ("Priority", "string", True),
+            ("Status", "string", True),
+            ("CreatedDate", "date", True),
+            ("SLADays", "int", True),
+            ("AssignedTo", "string", True),
+            ("ClosedDate", "date", True),
+        ],
+    },
+    "transactions": {
+        1: [
+            ("TransactionID", "string", False),
+            ("CustomerID", "int", False),
+            ("TransactionDate", "date", False),
+            ("ProductType", "string", True),
+            ("TransactionType", "string", True),
+            ("Amount", MONEY, True),
+            ("Channel", "string", True),
+        ],
+    },
+}
+
+
+def load_captured_schemas(path: str = CAPTURED_SCHEMAS_PATH) -> dict:
+    """The schemas in a file written by ingestion.schema_capture, as {table: {version: columns}}."""
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        captured = json.load(f)
+    return {
+        table: {int(version): [tuple(column) for column in columns] for version, columns in entry["versions"].items()}
+        for table, entry in captured.items()
+    }
+
+
+# A captured table replaces its built-in versions, which only guessed at the live feed
+CAPTURED_SCHEMAS = load_captured_schemas()
+SCHEMAS = {**BUILTIN_SCHEMAS, **CAPTURED_SCHEMAS}
+
+
+class SchemaMismatchError(ValueError):
+    """The header of a source file does not match the registered schema."""
+
+
+def latest_version(table: str, registry: dict = None) -> int:
+    return max((SCHEMAS if registry is None else registry)[table])
+
+
+def get_columns(table: str, version: int = None, registry: dict = None) -> list[tuple[str, str, bool]]:
+    """Columns of `table` at `version` (default: the latest) as (name, type, nullable), from SCHEMAS by default."""
+    versions = (SCHEMAS if registry is None else registry)[table]
+    version = max(versions) if version is None else version
+    if version not in versions:
+        raise KeyError(f"No schema version {version} for {table}; known versions: {sorted(versions)}")
+    return versions[version]
+
+
+def spark_ddl(columns: list[tuple[str, str, bool]], corrupt_record_column: str = None) -> str:
+    """DDL string for DataFrameReader.schema; the corrupt record column collects malformed rows."""
+    fields = [f"`{name}` {type_}" for name, type_, _ in columns]
+    if corrupt_record_column:
+        fields.append(f"`{corrupt_record_column}` string")
+    return ", ".join(fields)
+
+
+def arrow_schema(columns: list[tuple[str, str, bool]]):
+    """The same columns as a pyarrow schema, for reading and writing the feeds without Spark."""
+    import pyarrow as pa
+
+    simple_types = {"string": pa.string(), "int": pa.int32(), "bigint": pa.int64(), "double": pa.float64(),
+                    "boolean": pa.bool_(), "date": pa.date32(), "timestamp": pa.timestamp("us")}
+    fields = []
+    for name, type_, nullable in columns:
+        decimal = re.fullmatch(r"decimal\((\d+),\s*(\d+)\)", type_)
+        arrow_type = pa.decimal128(int(decimal[1]), int(decimal[2])) if decimal else simple_types[type_]
+        fields.append(pa.field(name, arrow_type, nullable))
+    return pa.schema(fields)
+
+
+def normalize_column(name: str) -> str:
+    # "SR No", "sr_no" and "SRNo" name the same column
+    return re.sub(r"[^0-9a-z]", "", name.lower())
+
+
+def validate_header(table: str, header: list[str], columns: list[tuple[str, str, bool]]) -> None:
+    """Raise SchemaMismatchError unless the file's header names the registered columns in order."""
+    expected = [name for name, _, _ in columns]
+    if [normalize_column(h) for h in header] != [normalize_column(name) for name in expected]:
+        missing = [n for n in expected if normalize_column(n) not in {normalize_column(h) for h in header}]
+        extra = [h for h in header if normalize_column(h) not in {normalize_column(n) for n in expected}]
+        detail = f"missing {missing}, unexpected {extra}" if missing or extra else "columns are out of order"
+        if table not in CAPTURED_SCHEMAS:
+            detail += "; this table's schema was never captured from its feed, run python -m ingestion.schema_capture"
+        raise SchemaMismatchError(f"{table}: header does not match the registered schema ({detail})")
@@ -0,0 +1,488 @@
+"""
+Synthetic bharat_bank_rm source feeds at any scale, for performance testing.
+
+All nine tables are generated with vectorized NumPy and written with pyarrow, in chunks of
+customers so memory stays flat however many rows are produced. The data is referentially
+consistent (every CustomerID, RMID and branch exists in its parent table) and skewed the way a
+real book is: customer segments drive lognormal AUM, a heavy-tailed activity level drives
+transaction counts, RM books differ in size, and service request types follow a long-tailed mix.
+
+CSV files match the built-in schemas (BUILTIN_SCHEMAS in ingestion/schemas.py), so the csv folder
+can be used as --source-dir for the pipeline or the converter with INGEST_CAPTURED_SCHEMAS="";
+Parquet files are written with the same schema:
+
+    python -m ingestion.synthetic --out ./synthetic --customers 50000 --transactions-per-customer 400
+
+The same seed and end date always produce the same data, whatever SYNTHETIC_CHUNK_ROWS is:
+each block of SYNTHETIC_SEED_BLOCK_CUSTOMERS customers draws every table from its own generator,
+spawned from the seed, and a chunk is a whole number of blocks.
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+from datetime import date
+
+import numpy as np
+
+from ingestion.schemas import BUILTIN_SCHEMAS, arrow_schema, get_columns
+
+logger = logging.getLogger(__name__)
+
+# Rows generated per chunk of the largest table; bounds memory
+SYNTHETIC_CHUNK_ROWS = int(os.getenv("SYNTHETIC_CHUNK_ROWS", "2000000"))
+# Customers per seeded block; changing it changes the data, unlike SYNTHETIC_CHUNK_ROWS
+SYNTHETIC_SEED_BLOCK_CUSTOMERS = 1000
+
+SEGMENTS = ["Mass", "Affluent", "HNI", "Ultra HNI"]
+SEGMENT_SHARES = [0.70, 0.22, 0.07, 0.01]
+# Median total AUM (INR) and relative transaction activity of each segment
+SEGMENT_MEDIAN_AUM = np.array([1.5e5, 1.5e6, 1.2e7, 1.2e8])
+SEGMENT_ACTIVITY = np.array([0.8, 1.3, 2.0, 3.0])
+SEGMENT_TXN_MEDIAN_AMOUNT = np.array([5e3, 2.5e4, 1e5, 5e5])
+RISK_PROFILES = ["Conservative", "Moderate", "Aggressive"]
+SEGMENT_RISK_PROFILE_SHARES = np.array([[0.5, 0.4, 0.1], [0.35, 0.45, 0.2], [0.25, 0.45, 0.3], [0.2, 0.4, 0.4]])
+
+PRODUCTS = ["CASA", "FD", "Investments", "Insurance", "Loans"]
+PRODUCT_SUBTYPES = [
+    ["Savings Account", "Current Account"],
+    ["Fixed Deposit", "Recurring Deposit"],
+    ["Mutual Fund", "Equity", "Bonds", "PMS"],
+    ["Life Insurance", "Health Insurance"],
+    ["Home Loan", "Personal Loan", "Car Loan"],
+]
+# Probability that a customer of each segment (rows) holds each product (columns)
+SEGMENT_HOLDING_PROBABILITY = np.array([
+    [1.0, 0.35, 0.20, 0.25, 0.20],
+    [1.0, 0.50, 0.50, 0.40, 0.30],
+    [1.0, 0.60, 0.80, 0.50, 0.30],
+    [1.0, 0.60, 0.95, 0.60, 0.25],
+])
+PRODUCT_AUM_SHARE = np.array([0.15, 0.30, 0.45, 0.10, 0.30])
+
+BRANCHES = [
+    ("Mumbai Central", "Mumbai", "West"), ("Andheri", "Mumbai", "West"), ("Pune Camp", "Pune", "West"),
+    ("Connaught Place", "New Delhi", "North"), ("Gurgaon", "Gurugram", "North"), ("Lucknow", "Lucknow", "North"),
+    ("Koramangala", "Bengaluru", "South"), ("T Nagar", "Chennai", "South"), ("Banjara Hills", "Hyderabad", "South"),
+    ("Park Street", "Kolkata", "East"), ("Bhubaneswar", "Bhubaneswar", "East"), ("Guwahati", "Guwahati", "East"),
+]
+FIRST_NAMES = ["Aarav", "Vivaan", "Aditya", "Rajesh", "Amit", "Vikram", "Rohan", "Arjun", "Karan", "Sanjay",
+               "Priya", "Neha", "Ananya", "Sanya", "Kavya", "Pooja", "Shivani", "Meera", "Divya", "Isha"]
+LAST_NAMES = ["Sharma", "Patel", "Singh", "Gupta", "Joshi", "Kumar", "Verma", "Mehta", "Reddy", "Iyer",
+              "Nair", "Das", "Banerjee", "Rao", "Chopra", "Malhotra", "Kapoor", "Agarwal", "Bose", "Pillai"]
+
+TXN_TYPES = ["Credit", "Debit", "SIP", "Premium", "EMI", "Interest"]
+TXN_TYPE_SHARES = [0.35, 0.35, 0.12, 0.05, 0.10, 0.03]
+CHANNELS = ["Mobile App", "Net Banking", "Branch", "ATM", "UPI", "Phone Banking"]
+CHANNEL_SHARES = [0.30, 0.15, 0.10, 0.10, 0.32, 0.03]
+INTERACTION_TYPES = ["Call", "Meeting", "Email", "WhatsApp", "Video Call"]
+INTERACTION_TYPE_SHARES = [0.35, 0.20, 0.20, 0.20, 0.05]
+INTERACTION_SUBJECTS = ["Portfolio Review", "KYC Renewal", "Investment Proposal", "Loan Inquiry", "FD Renewal",
+                        "Insurance Review", "Complaint Follow-up", "Product Pitch"]
+INTERACTION_STATUSES = ["Completed", "Pending", "Follow-up", "In Progress", "Cancelled"]
+INTERACTION_STATUS_SHARES = [0.60, 0.15, 0.15, 0.08, 0.02]
+NEXT_ACTIONS = ["FD Renewal", "Document Collection", "Presentation", "Credit Check", "Send Proposal", "None"]
+SR_TYPES = ["Cheque Book", "Statement Request", "Address Change", "Debit Card Block", "Fund Transfer Issue",
+            "KYC Update", "Nominee Update", "Grievance", "Loan Closure"]
+SR_ASSIGNED_TO = ["Operations", "Operations", "KYC Team", "Card Ops", "Payments Ops", "KYC Team", "Account Ops",
+                  "Customer Care", "Loan Ops"]
+SR_PRIORITIES = ["Low", "Medium", "High", "Urgent"]
+SR_PRIORITY_SHARES = [0.30, 0.45, 0.20, 0.05]
+SR_PRIORITY_SLA_DAYS = np.array([5, 3, 1, 1])
+SR_STATUSES = ["Completed", "Closed", "In Progress", "Pending", "Pending Approval", "Under Review"]
+SR_STATUS_SHARES = [0.55, 0.04, 0.15, 0.12, 0.08, 0.06]
+ALERTS = ["KYC Renewal", "AML Review", "PEP Screening", "Large Cash Transaction", "Dormant Account"]
+ALERT_SHARES = [0.45, 0.20, 0.05, 0.20, 0.10]
+ALERT_RATE = 0.15
+SEVERITIES = ["Low", "Medium", "High"]
+DEVICES = ["Android", "iOS", "Web"]
+DEVICE_SHARES = [0.55, 0.25, 0.20]
+PREFERRED_CHANNELS = ["Mobile App", "Net Banking", "Branch", "Phone Banking", "WhatsApp"]
+PREFERRED_CHANNEL_SHARES = [0.45, 0.20, 0.20, 0.05, 0.10]
+CAMPAIGN_STATUSES = ["Planned", "Active", "Completed"]
+
+
+def _shares(shares) -> np.ndarray:
+    p = np.asarray(shares, dtype=float)
+    return p / p.sum()
+
+
+def _pick(rng, values: list, n: int, shares=None):
+    """`n` values drawn from `values` (with `shares`), as a pyarrow string array."""
+    p = None if shares is None else _shares(shares)
+    return _take(values, rng.choice(len(values), size=n, p=p))
+
+
+def _take(values: list, indices: np.ndarray, mask: np.ndarray = None):
+    """values[indices] as a pyarrow string array; masked positions are null."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    return pc.take(pa.array(values, pa.string()), pa.array(indices, mask=mask))
+
+
+def _ids(prefix: str, numbers: np.ndarray, width: int):
+    """Zero-padded string IDs such as TXN0000000042, built without Python loops."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    return pc.binary_join_element_wise(prefix, pc.utf8_lpad(pa.array(numbers).cast(pa.string()), width, "0"), "")
+
+
+def _money(amounts: np.ndarray):
+    """decimal(18,2) array of rupee amounts, built from integer paise without going through Python."""
+    import pyarrow as pa
+
+    paise = np.round(amounts * 100).astype(np.int64)
+    # Decimal128 values are 16-byte little-endian two's complement integers
+    words = np.empty((len(paise), 2), dtype=np.int64)
+    words[:, 0] = paise
+    words[:, 1] = np.where(paise < 0, -1, 0)
+    return pa.Array.from_buffers(pa.decimal128(18, 2), len(paise), [None, pa.py_buffer(words)])
+
+
+def _dates(days: np.ndarray, mask: np.ndarray = None):
+    import pyarrow as pa
+
+    return pa.array(days.astype("datetime64[D]"), mask=mask)
+
+
+def _codes(rng, n: int, pattern: str):
+    """Random codes following `pattern`: A is an upper-case letter, 9 a digit (e.g. PAN: AAAAA9999A)."""
+    import pyarrow as pa
+
+    chars = np.empty((n, len(pattern)), dtype=np.uint8)
+    for i, kind in enumerate(pattern):
+        low, high = (ord("A"), ord("Z") + 1) if kind == "A" else (ord("0"), ord("9") + 1)
+        chars[:, i] = rng.integers(low, high, size=n, dtype=np.uint8)
+    return pa.array(chars.view(f"S{len(pattern)}").ravel()).cast(pa.string())
+
+
+def _table(name: str, arrays: list):
+    import pyarrow as pa
+
+    return pa.Table.from_arrays(arrays, schema=arrow_schema(get_columns(name, registry=BUILTIN_SCHEMAS)))
+
+
+class TableWriter:
+    """Appends chunks of one table to out_dir/csv/<table>.csv and/or out_dir/parquet/<table>.parquet."""
+
+    def __init__(self, out_dir: str, name: str, formats: list[str]):
+        import pyarrow.csv as pa_csv
+        import pyarrow.parquet as pq
+
+        self.name = name
+        self.rows = 0
+        self.writers = []
+        schema = arrow_schema(get_columns(name, registry=BUILTIN_SCHEMAS))
+        if "csv" in formats:
+            os.makedirs(os.path.join(out_dir, "csv"), exist_ok=True)
+            self.writers.append(pa_csv.CSVWriter(os.path.join(out_dir, "csv", f"{name}.csv"), schema))
+        if "parquet" in formats:
+            os.makedirs(os.path.join(out_dir, "parquet"), exist_ok=True)
+            self.writers.append(
+                pq.ParquetWriter(os.path.join(out_dir, "parquet", f"{name}.parquet"), schema, compression="zstd")
+            )
+
+    def write(self, table) -> None:
+        for writer in self.writers:
+            writer.write_table(table)
+        self.rows += table.num_rows
+
+    def close(self) -> None:
+        for writer in self.writers:
+            writer.close()
+
+
+class SyntheticBank:
+    """
+    Per-customer attributes drawn up front (segment, RM, activity); the tables are then generated
+    chunk by chunk of customers. Counts per customer are the means of Poisson draws.
+    """
+
+    def __init__(self, customers: int = 50_000, transactions_per_customer: float = 400,
+                 interactions_per_customer: float = 8, service_requests_per_customer: float = 3,
+                 customers_per_rm: int = 500, campaigns: int = 40, months: int = 12, end_date: date = None,
+                 seed: int = 7):
+        self.customers = customers
+        self.transactions_per_customer = transactions_per_customer
+        self.interactions_per_customer = interactions_per_customer
+        self.service_requests_per_customer = service_requests_per_customer
+        self.campaigns = campaigns
+        self.months = months
+        self.end = np.datetime64(end_date or date.today(), "D")
+        self.start = self.end - np.timedelta64(months * 30, "D")
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+
+        rng = self.rng
+        self.rms = max(1, customers // customers_per_rm)
+        self.rm_branch = rng.integers(0, len(BRANCHES), size=self.rms)
+        # Some RMs carry much bigger books than others
+        rm_weights = _shares(rng.gamma(4.0, size=self.rms))
+        self.customer_rm = rng.choice(self.rms, size=customers, p=rm_weights)
+        self.segment = rng.choice(len(SEGMENTS), size=customers, p=_shares(SEGMENT_SHARES))
+        # Heavy-tailed activity with mean 1 within each segment
+        self.activity = rng.gamma(0.6, 1 / 0.6, size=customers) * SEGMENT_ACTIVITY[self.segment]
+        self.activity /= self.activity.mean()
+        self.customer_aum = np.zeros(customers)
+        self.next_interaction = 0
+        self.next_sr = 0
+        self.next_transaction = 0
+
+    def chunks(self):
+        """
+        Customer index ranges sized so the largest table gets about SYNTHETIC_CHUNK_ROWS rows per
+        chunk, rounded down to whole seeded blocks (at least one).
+        """
+        per_customer = max(self.transactions_per_customer, self.interactions_per_customer,
+                           self.service_requests_per_customer, 1)
+        blocks = max(1, int(SYNTHETIC_CHUNK_ROWS // per_customer) // SYNTHETIC_SEED_BLOCK_CUSTOMERS)
+        size = blocks * SYNTHETIC_SEED_BLOCK_CUSTOMERS
+        for start in range(0, self.customers, size):
+            yield np.arange(start, min(start + size, self.customers))
+
+    def _seed_rng(self, name: str, block: int = 0) -> None:
+        """Point self.rng at the generator of one table and block, spawned from the seed."""
+        table = list(BUILTIN_SCHEMAS).index(name)
+        self.rng = np.random.default_rng(np.random.SeedSequence(self.seed, spawn_key=(table, block)))
+
+    def _generate_chunk(self, name: str, idx: np.ndarray):
+        import pyarrow as pa
+
+        parts = []
+        for start in range(0, len(idx), SYNTHETIC_SEED_BLOCK_CUSTOMERS):
+            block = idx[start:start + SYNTHETIC_SEED_BLOCK_CUSTOMERS]
+            self._seed_rng(name, int(block[0]) // SYNTHETIC_SEED_BLOCK_CUSTOMERS)
+            parts.append(getattr(self, name)(block))
+        return pa.concat_tables(parts)
+
+    def _days_in_window(self, n: int) -> np.ndarray:
+        return self.start + self.rng.integers(0, (self.end - self.start).astype(int) + 1, size=n)
+
+    def customer_dtls(self, idx: np.ndarray):
+        rng, n = self.rng, len(idx)
+        branch = self.rm_branch[self.customer_rm[idx]]
+        names = _take([f"{f} {l}" for f in FIRST_NAMES for l in LAST_NAMES],
+                      rng.integers(0, len(FIRST_NAMES) * len(LAST_NAMES), size=n))
+        risk_profile = (rng.random(n)[:, None] > SEGMENT_RISK_PROFILE_SHARES[self.segment[idx]].cumsum(1)).sum(1)
+        return _table("customer_dtls", [
+            (idx + 1).astype(np.int32),
+            names,
+            _dates(self.end - rng.integers(21 * 365, 80 * 365, size=n)),
+            _pick(rng, ["M", "F"], n),
+            _codes(rng, n, "AAAAA9999A"),
+            _codes(rng, n, "999999999999"),
+            _take(SEGMENTS, self.segment[idx]),
+            _take([b[0] for b in BRANCHES], branch),
+            _take([b[1] for b in BRANCHES], branch),
+            _ids("RM", self.customer_rm[idx] + 1, 6),
+            _dates(self.end - rng.integers(30, 20 * 365, size=n)),
+            _take(RISK_PROFILES, np.minimum(risk_profile, len(RISK_PROFILES) - 1)),
+        ])
+
+    def portfolio(self, idx: np.ndarray):
+        rng = self.rng
+        holds = rng.random((len(idx), len(PRODUCTS))) < SEGMENT_HOLDING_PROBABILITY[self.segment[idx]]
+        row, product = np.nonzero(holds)
+        customer = idx[row]
+        n_subtypes = np.array([len(s) for s in PRODUCT_SUBTYPES])
+        offsets = np.concatenate([[0], n_subtypes.cumsum()[:-1]])
+        subtype = offsets[product] + (rng.random(len(row)) * n_subtypes[product]).astype(int)
+        median = SEGMENT_MEDIAN_AUM[self.segment[customer]] * PRODUCT_AUM_SHARE[product]
+        value = np.round(rng.lognormal(np.log(median), 1.0), 2)
+        is_asset = product != PRODUCTS.index("Loans")
+        self.customer_aum += np.bincount(customer[is_asset], weights=value[is_asset], minlength=self.customers)
+        return _table("portfolio", [
+            (customer + 1).astype(np.int32),
+            _take(PRODUCTS, product),
+            _take([s for subtypes in PRODUCT_SUBTYPES for s in subtypes], subtype),
+            _money(value),
+            _dates(np.full(len(row), self.end)),
+        ])
+
+    def transactions(self, idx: np.ndarray):
+        rng = self.rng
+        counts = rng.poisson(self.activity[idx] * self.transactions_per_customer)
+        customer = np.repeat(idx, counts)
+        n = len(customer)
+        numbers = self.next_transaction + np.arange(1, n + 1)
+        self.next_transaction += n
+        amount = rng.lognormal(np.log(SEGMENT_TXN_MEDIAN_AMOUNT[self.segment[customer]]), 1.2)
+        return _table("transactions", [
+            _ids("TXN", numbers, 12),
+            (customer + 1).astype(np.int32),
+            _dates(self._days_in_window(n)),
+            _pick(rng, PRODUCTS, n, [0.55, 0.10, 0.20, 0.05, 0.10]),
+            _pick(rng, TXN_TYPES, n, TXN_TYPE_SHARES),
+            _money(amount),
+            _pick(rng, CHANNELS, n, CHANNEL_SHARES),
+        ])
+
+    def interactions(self, idx: np.ndarray):
+        rng = self.rng
+        # Wealthier customers see their RM more often
+        counts = rng.poisson(self.interactions_per_customer * (1 + self.segment[idx]) / 1.4)
+        customer = np.repeat(idx, counts)
+        n = len(customer)
+        numbers = self.next_interaction + np.arange(1, n + 1)
+        self.next_interaction += n
+        day = self._days_in_window(n)
+        return _table("interactions", [
+            _ids("INT", numbers, 10),
+            (customer + 1).astype(np.int32),
+            _ids("RM", self.customer_rm[customer] + 1, 6),
+            _dates(day),
+            _pick(rng, INTERACTION_TYPES, n, INTERACTION_TYPE_SHARES),
+            _pick(rng, INTERACTION_SUBJECTS, n),
+            _pick(rng, INTERACTION_STATUSES, n, INTERACTION_STATUS_SHARES),
+            _pick(rng, NEXT_ACTIONS, n),
+            _dates(day + rng.integers(1, 22, size=n)),
+        ])
+
+    def service_requests(self, idx: np.ndarray):
+        rng = self.rng
+        counts = rng.poisson(self.service_requests_per_customer, size=len(idx))
+        customer = np.repeat(idx, counts)
+        n = len(customer)
+        numbers = self.next_sr + np.arange(1, n + 1)
+        self.next_sr += n
+        # Long-tailed mix: the first types are by far the most common
+        sr_type = rng.choice(len(SR_TYPES), size=n, p=_shares(1 / np.arange(1, len(SR_TYPES) + 1) ** 1.1))
+        priority = rng.choice(len(SR_PRIORITIES), size=n, p=_shares(SR_PRIORITY_SHARES))
+        status = rng.choice(len(SR_STATUSES), size=n, p=_shares(SR_STATUS_SHARES))
+        sla = SR_PRIORITY_SLA_DAYS[priority]
+        created = self._days_in_window(n)
+        is_open = status >= SR_STATUSES.index("In Progress")
+        return _table("service_requests", [
+            _ids("SR", numbers, 10),
+            (customer + 1).astype(np.int32),
+            _take(SR_TYPES, sr_type),
+            _take(SR_PRIORITIES, priority),
+            _take(SR_STATUSES, status),
+            _dates(created),
+            sla.astype(np.int32),
+            _take(SR_ASSIGNED_TO, sr_type),
+            _dates(created + rng.integers(0, 2 * sla + 1), mask=is_open),
+        ])
+
+    def risk_compliance(self, idx: np.ndarray):
+        rng, n = self.rng, len(idx)
+        no_alert = rng.random(n) >= ALERT_RATE
+        return _table("risk_compliance", [
+            (idx + 1).astype(np.int32),
+            np.clip(rng.beta(2, 5, size=n) * 100, 1, 100).astype(np.int32),
+            _dates(self.end + rng.integers(-60, 730, size=n)),
+            _take(ALERTS, rng.choice(len(ALERTS), size=n, p=_shares(ALERT_SHARES)), mask=no_alert),
+            _take(SEVERITIES, rng.choice(len(SEVERITIES), size=n, p=[0.5, 0.35, 0.15]), mask=no_alert),
+            _dates(self.end + rng.integers(0, 61, size=n), mask=no_alert),
+        ])
+
+    def digital_engagement(self, idx: np.ndarray):
+        rng, n = self.rng, len(idx)
+        logins = rng.negative_binomial(2, 2 / (2 + 12 * self.activity[idx]))
+        score = np.clip(logins * 2.5 + rng.normal(20, 10, size=n), 0, 100)
+        return _table("digital_engagement", [
+            (idx + 1).astype(np.int32),
+            logins.astype(np.int32),
+            _dates(self.end - np.minimum(rng.geometric(1 / (1 + 30 / (1 + logins))), 365)),
+            _pick(rng, DEVICES, n, DEVICE_SHARES),
+            _pick(rng, PREFERRED_CHANNELS, n, PREFERRED_CHANNEL_SHARES),
+            score.astype(np.int32),
+        ])
+
+    def campaigns_table(self):
+        rng, n = self.rng, self.campaigns
+        product = rng.integers(0, len(PRODUCTS), size=n)
+        start = self.start + rng.integers(0, self.months * 30 + 90, size=n)
+        end = start + rng.integers(14, 120, size=n)
+        status = np.where(start > self.end, 0, np.where(end >= self.end, 1, 2))
+        return _table("campaigns", [
+            _ids("CMP", np.arange(1, n + 1), 4),
+            _take([f"{p} Drive" for p in PRODUCTS], product),
+            _take(PRODUCTS, product),
+            _pick(rng, SEGMENTS, n),
+            _pick(rng, CHANNELS, n),
+            _dates(start),
+            _dates(end),
+            _money(np.round(rng.lognormal(np.log(5e5), 0.8, size=n), -3)),
+            _take(CAMPAIGN_STATUSES, status),
+        ])
+
+    def rm_performance(self):
+        """Monthly rows per RM; needs the portfolio to have been generated for CurrentAUM."""
+        rng = self.rng
+        rm_aum = np.bincount(self.customer_rm, weights=self.customer_aum, minlength=self.rms)
+        clients = np.bincount(self.customer_rm, minlength=self.rms)
+        month_starts = (self.end.astype("datetime64[M]") - np.arange(self.months)[::-1]).astype("datetime64[D]")
+        rm = np.repeat(np.arange(self.rms), self.months)
+        month = np.tile(np.arange(self.months), self.rms)
+        # The book grows towards today's AUM over the months
+        growth = 0.85 + 0.15 * (month + 1) / self.months * rng.normal(1, 0.02, size=len(rm))
+        branch = self.rm_branch[rm]
+        return _table("rm_performance", [
+            _ids("RM", rm + 1, 6),
+            _take([f"{f} {l}" for f in FIRST_NAMES for l in LAST_NAMES], rm % (len(FIRST_NAMES) * len(LAST_NAMES))),
+            _take([b[0] for b in BRANCHES], branch),
+            _take([b[2] for b in BRANCHES], branch),
+            clients[rm].astype(np.int32),
+            _money(np.round(rm_aum[rm] * rng.uniform(1.0, 1.25, size=self.rms)[rm], -3)),
+            _money(rm_aum[rm] * growth),
+            _dates(month_starts[month]),
+        ])
+
+    def generate(self, out_dir: str, formats: list[str]) -> dict:
+        """Write all nine tables to out_dir; returns rows and seconds per table."""
+        per_customer = ["customer_dtls", "portfolio", "transactions", "interactions", "service_requests",
+                        "risk_compliance", "digital_engagement"]
+        writers = {name: TableWriter(out_dir, name, formats) for name in BUILTIN_SCHEMAS}
+        seconds = dict.fromkeys(BUILTIN_SCHEMAS, 0.0)
+        try:
+            for idx in self.chunks():
+                for name in per_customer:
+                    start = time.perf_counter()
+                    writers[name].write(self._generate_chunk(name, idx))
+                    seconds[name] += time.perf_counter() - start
+                logger.info("Generated customers up to %d of %d", idx[-1] + 1, self.customers)
+            for name, make in [("campaigns", self.campaigns_table), ("rm_performance", self.rm_performance)]:
+                start = time.perf_counter()
+                self._seed_rng(name)
+                writers[name].write(make())
+                seconds[name] += time.perf_counter() - start
+        finally:
+            for writer in writers.values():
+                writer.close()
+        return {name: {"rows": writers[name].rows, "seconds": round(seconds[name], 2)} for name in BUILTIN_SCHEMAS}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", required=True, help="output folder; files go to <out>/csv and <out>/parquet")
+    parser.add_argument("--customers", type=int, default=50_000)
+    parser.add_argument("--transactions-per-customer", type=float, default=400)
+    parser.add_argument("--interactions-per-customer", type=float, default=8)
+    parser.add_argument("--service-requests-per-customer", type=float, default=3)
+    parser.add_argument("--customers-per-rm", type=int, default=500)
+    parser.add_argument("--campaigns", type=int, default=40)
+    parser.add_argument("--months", type=int, default=12, help="length of the history")
+    parser.add_argument("--end-date", type=date.fromisoformat, help="last day of the history (default: today)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--format", nargs="+", choices=["csv", "parquet"], default=["csv", "parquet"])
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    bank = SyntheticBank(args.customers, args.transactions_per_customer, args.interactions_per_customer,
+                         args.service_requests_per_customer, args.customers_per_rm, args.campaigns, args.months,
+                         args.end_date, args.seed)
+    start = time.perf_counter()
+    report = bank.generate(args.out, args.format)
+    total_rows = sum(r["rows"] for r in report.values())
+    elapsed = time.perf_counter() - start
+    print(json.dumps(report, indent=1))
+    print(f"{total_rows} rows in {elapsed:.1f}s ({total_rows / elapsed:,.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -18,6 +18,10 @@ from databricks.sdk import WorkspaceClient #for Genie
 import logging
 import os
 from model_serving_utils import query_endpoint, is_endpoint_supported
+from request_coalescing import coalesce
+from usage_accounting import add_bytes, set_current_user, track
+from quick_actions import QUICK_ACTIONS, QuickActionStore
+from local_snapshot import get_snapshot
 
 # Page configuration
 st.set_page_config(
@@ -44,17 +48,31 @@ load_css()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Ensure environment variable is set correctly
+# "warehouse" queries the SQL warehouse; "snapshot" answers queries from local Arrow files (see local_snapshot.py)
+DATA_BACKEND = os.getenv('DATA_BACKEND', 'warehouse')
+
+# Ensure environment variable is set correctly; the snapshot backend runs without the assistant
 SERVING_ENDPOINT = os.getenv('SERVING_ENDPOINT')
-assert SERVING_ENDPOINT, \
+assert SERVING_ENDPOINT or DATA_BACKEND == 'snapshot', \
     ("Unable to determine serving endpoint to use for chatbot app. If developing locally, "
      "set the SERVING_ENDPOINT environment variable to the name of your serving endpoint. If "
      "deploying to a Databricks app, include a serving endpoint resource named "
      "'serving_endpoint' with CAN_QUERY permissions, as described in "
      "https://docs.databricks.com/aws/en/generative-ai/agent-framework/chat-app#deploy-the-databricks-app")
 
-# Check if the endpoint is supported
-endpoint_supported = is_endpoint_supported(SERVING_ENDPOINT)
+# Checked on first use rather than at import, so the app starts when the workspace API is unreachable
+@st.cache_data(ttl=300, show_spinner=False)
+def get_endpoint_supported(endpoint_name):
+    """is_endpoint_supported for the endpoint, or None when it cannot be checked."""
+    try:
+        return is_endpoint_supported(endpoint_name)
+    except Exception:
+        logger.exception("Could not check serving endpoint %s", endpoint_name)
+        return None
+
+def assistant_available():
+    """The assistant needs a serving endpoint; it is off with the snapshot backend and when the check fails."""
+    return DATA_BACKEND != 'snapshot' and get_endpoint_supported(SERVING_ENDPOINT) is not None
 
 
 def get_user_info():
@@ -66,6 +84,8 @@ def get_user_info():
     )
 
 user_info = get_user_info()
+# Attribute the LLM, Genie and warehouse calls of this script run to the signed-in user
+set_current_user(user_info.get("user_email") or user_info.get("user_id"))
 
 ##### Agent #####
 
@@ -102,35 +122,50 @@ def initialize_session_state():
         ]
 ###########################################################################################
 
-# Ensure environment variable is set correctly
-assert os.getenv('DATABRICKS_WAREHOUSE_ID'), "DATABRICKS_WAREHOUSE_ID must be set in app.yaml."
+snapshot = get_snapshot() if DATA_BACKEND == 'snapshot' else None
 
-# Databricks config
-cfg = Config()
+if snapshot is None:
+    # Ensure environment variable is set correctly
+    assert os.getenv('DATABRICKS_WAREHOUSE_ID'), "DATABRICKS_WAREHOUSE_ID must be set in app.yaml."
+
+    # Databricks config
+    cfg = Config()
 
 # Query the SQL warehouse with Service Principal credentials
 def sql_query_with_service_principal(query: str) -> pd.DataFrame:
-    """Execute a SQL query and return the result as a pandas DataFrame."""
-    with sql.connect(
-        server_hostname=cfg.host,
-        http_path=f"/sql/1.0/warehouses/{cfg.warehouse_id}",
-        credentials_provider=lambda: cfg.authenticate  # Uses SP credentials from the environment variables
-    ) as connection:
-        with connection.cursor() as cursor:
-            cursor.execute(query)
-            return cursor.fetchall_arrow().to_pandas()
+    """Execute a SQL query and return the result as a pandas DataFrame.
+    Identical queries running concurrently in other sessions share one warehouse call."""
+    if snapshot is not None:
+        return snapshot.query(query)
+    def run_query():
+        with sql.connect(
+            server_hostname=cfg.host,
+            http_path=f"/sql/1.0/warehouses/{cfg.warehouse_id}",
+            credentials_provider=lambda: cfg.authenticate  # Uses SP credentials from the environment variables
+        ) as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(query)
+                result = cursor.fetchall_arrow()
+                add_bytes(result.nbytes)
+                return result.to_pandas()
+    with track("warehouse_sql"):
+        return coalesce("sql", cfg.warehouse_id, query, "service_principal", run_query)
 
 # Query the SQL warehouse with the user credentials
 def sql_query_with_user_token(query: str, user_token: str) -> pd.DataFrame:
     """Execute a SQL query and return the result as a pandas DataFrame."""
-    with sql.connect(
+    if snapshot is not None:
+        return snapshot.query(query)
+    with track("warehouse_sql_obo"), sql.connect(
         server_hostname=cfg.host,
         http_path=f"/sql/1.0/warehouses/{cfg.warehouse_id}",
         access_token=user_token  # Pass the user token into the SQL connect to query on behalf of user
     ) as connection:
         with connection.cursor() as cursor:
             cursor.execute(query)
-            return cursor.fetchall_arrow().to_pandas()
+            result = cursor.fetchall_arrow()
+            add_bytes(result.nbytes)
+            return result.to_pandas()
 
 # Extract user access token from the request headers
 user_token = st.context.headers.get('X-Forwarded-Access-Token')
@@ -358,9 +393,17 @@ I specialize in:
 
 Try asking: "What are the KYC requirements?" or "Recommend products for high-net-worth clients"""
 
+def get_fallback_agent_message(messages):
+    """Canned Agent-isstant reply shown while the serving endpoint is unavailable."""
+    st.warning("⚠️ The assistant endpoint is not responding right now. Showing standard guidance instead.")
+    return {"role": "assistant", "content": get_agent_response(messages[-1]["content"])}
+
 # Main app function
 def main():
     initialize_session_state()
+    # Start precomputing this RM's quick-action answers before they open the Agent-isstant tab
+    if assistant_available():
+        get_quick_action_store().register(st.session_state.current_rm['employee_id'], st.session_state.current_rm)
     
     # Header
     st.markdown("""
@@ -1101,10 +1144,17 @@ def render_ask_genie():
                 st.code(message["code"], language="sql", wrap_lines=True)
 
 
+    # Genie calls are coalesced per user, so RMs asking the same question at the same
+    # time share one Genie round trip without sharing each other's conversations
+    genie_scope = f"user:{user_info.get('user_email')}"
+
     def get_query_result(statement_id):
         # For simplicity, let's say data fits in one chunk, query.manifest.total_chunk_count = 1
 
-        result = w.statement_execution.get_statement(statement_id)
+        result = coalesce(
+            "genie_statement", genie_space_id, statement_id, genie_scope,
+            lambda: w.statement_execution.get_statement(statement_id),
+        )
         return pd.DataFrame(
             result.result.data_array, columns=[i.name for i in result.manifest.schema.columns]
         )
@@ -1128,14 +1178,21 @@ def render_ask_genie():
 
         st.chat_message("user").markdown(prompt)
 
-        with st.chat_message("assistant"):
+        with st.chat_message("assistant"), track("genie"):
             if st.session_state.get("conversation_id"):
-                conversation = w.genie.create_message_and_wait(
-                    genie_space_id, st.session_state.conversation_id, prompt
+                conversation = coalesce(
+                    "genie_message", genie_space_id,
+                    {"conversation_id": st.session_state.conversation_id, "prompt": prompt}, genie_scope,
+                    lambda: w.genie.create_message_and_wait(
+                        genie_space_id, st.session_state.conversation_id, prompt
+                    ),
                 )
                 process_genie_response(conversation)
             else:
-                conversation = w.genie.start_conversation_and_wait(genie_space_id, prompt)
+                conversation = coalesce(
+                    "genie_start", genie_space_id, prompt, genie_scope,
+                    lambda: w.genie.start_conversation_and_wait(genie_space_id, prompt),
+                )
                 process_genie_response(conversation)
 
         #st.rerun()
@@ -1143,7 +1200,15 @@ def render_ask_genie():
 def render_agent_assistant():
     st.markdown('<div class="tab-header">🤖 Agent-isstant - Your Banking Expert</div>', unsafe_allow_html=True)
 
+    if not assistant_available():
+        reason = ("it is not used with the local snapshot data backend" if DATA_BACKEND == 'snapshot'
+                  else f"the serving endpoint `{SERVING_ENDPOINT}` could not be reached")
+        st.info(f"ℹ️ The assistant is unavailable: {reason}. The quick actions below show standard guidance.")
+        render_expert_guidance()
+        return
+
     # Check if endpoint is supported and show appropriate UI
+    endpoint_supported = get_endpoint_supported(SERVING_ENDPOINT)
     #if not endpoint_supported:
     if endpoint_supported:
         st.error("⚠️ Unsupported Endpoint Type")
@@ -1178,12 +1243,13 @@ def render_agent_assistant():
             st.markdown(prompt)
 
         # Display assistant response in chat message container
-        with st.chat_message("assistant"):
+        with st.chat_message("assistant"), track("agent_chat"):
             # Query the Databricks serving endpoint
             assistant_response = query_endpoint(
                 endpoint_name=SERVING_ENDPOINT,
                 messages=st.session_state.messages,
                 max_tokens=400,
+                fallback=get_fallback_agent_message,
             )["content"]
             st.markdown(assistant_response)
 
@@ -1213,29 +1279,50 @@ def render_agent_assistant():
     #     st.rerun()
     
     # Quick action buttons
+    render_expert_guidance()
+
+def generate_quick_action_answer(rm_profile, prompt):
+    """Background generation of a personalized quick-action answer for one RM."""
+    with track("quick_action_precompute", user=rm_profile.get("employee_id")):
+        return query_endpoint(
+            endpoint_name=SERVING_ENDPOINT,
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=400,
+        )["content"]
+
+@st.cache_resource
+def get_quick_action_store():
+    return QuickActionStore(generate_quick_action_answer)
+
+@st.fragment
+def render_expert_guidance():
+    # Runs as a fragment, so clicking a quick action only reruns this section and the
+    # answer comes from the precomputed store instead of a full script rerun
+    rm = st.session_state.current_rm
+    store = get_quick_action_store()
+
     st.subheader("⚡ Expert Guidance")
-    col1, col2, col3 = st.columns(3)
-    
-    with col1:
-        if st.button("⚖️ Compliance Check"):
-            response = get_agent_response("compliance status and requirements")
-            st.session_state.agent_messages.append({"role": "user", "content": "Check compliance status"})
-            st.session_state.agent_messages.append({"role": "assistant", "content": response})
-            st.rerun()
-    
-    with col2:
-        if st.button("💡 Product Recommendations"):
-            response = get_agent_response("recommend products for clients")
-            st.session_state.agent_messages.append({"role": "user", "content": "Recommend products for my clients"})
-            st.session_state.agent_messages.append({"role": "assistant", "content": response})
-            st.rerun()
-    
-    with col3:
-        if st.button("📋 Process Guidance"):
-            response = get_agent_response("process guidance for account opening")
-            st.session_state.agent_messages.append({"role": "user", "content": "Guide me through processes"})
-            st.session_state.agent_messages.append({"role": "assistant", "content": response})
-            st.rerun()
+    cols = st.columns(len(QUICK_ACTIONS))
+    clicked = None
+    for col, (action, spec) in zip(cols, QUICK_ACTIONS.items()):
+        with col:
+            if st.button(spec["label"]):
+                clicked = action
+
+    if clicked:
+        spec = QUICK_ACTIONS[clicked]
+        response = store.get(rm['employee_id'], clicked)
+        if response is None:
+            response = get_agent_response(spec["canned_query"])
+            st.caption("Your personalized guidance is still being prepared; showing standard guidance.")
+        st.session_state.messages = st.session_state.get("messages", []) + [
+            {"role": "user", "content": spec["user_message"]},
+            {"role": "assistant", "content": response},
+        ]
+        with st.chat_message("user"):
+            st.markdown(spec["user_message"])
+        with st.chat_message("assistant"):
+            st.markdown(response)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,260 @@
+"""
+Load test for the Agent-isstant chat path (render_agent_assistant) against a local stub endpoint.
+
+N virtual users each hold their own conversation and send a series of prompts, either
+- through the helper functions (mode "helpers": model_serving_utils.query_endpoint, as
+  render_agent_assistant calls it),
+- as streamed invocations (mode "stream": "stream": true requests read chunk by chunk, which
+  also reports the time to the first token), or
+- through the full Streamlit script (mode "apptest": streamlit.testing.v1.AppTest, one
+  AppTest session per virtual user, so each prompt pays for a full script rerun).
+
+The first prompt of each conversation is tagged with the user's index, so no two users send
+identical message lists and the app's request coalescing cannot merge them into one endpoint
+call. The report covers throughput, latency percentiles, CPU and memory per session, and the
+number of invocations the stub actually served next to the number the users completed.
+The apptest mode runs app.py end to end with DATA_BACKEND=snapshot, so no warehouse is
+needed: it uses --snapshot-dir, or a small generated snapshot when none is given.
+
+Run from the app folder:
+    python -m loadtest.run_load_test --users 20 --requests 5 --latency-ms 800
+    python -m loadtest.run_load_test --mode stream --users 20 --token-delay-ms 20
+"""
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from loadtest.stub_endpoint import StubConfig, start_stub
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROMPTS = [
+    "What is the profile of Tiya Sood?",
+    "What should I sell to her based on her profile?",
+    "Which of my clients have KYC expiring this month?",
+    "Summarise the compliance alerts for my portfolio.",
+    "Recommend products for high-net-worth clients.",
+]
+
+
+def _percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round((len(ordered) - 1) * q / 100)))]
+
+
+def _prompt(user_idx: int, i: int) -> str:
+    prompt = PROMPTS[(user_idx + i) % len(PROMPTS)]
+    return f"[user {user_idx}] {prompt}" if i == 0 else prompt
+
+
+def _run_helpers_user(user_idx: int, n_requests: int, think_time: float, results: dict):
+    from model_serving_utils import query_endpoint
+
+    messages, latencies, errors = [], [], 0
+    cpu_start = time.thread_time()
+    for i in range(n_requests):
+        messages.append({"role": "user", "content": _prompt(user_idx, i)})
+        start = time.perf_counter()
+        try:
+            reply = query_endpoint(endpoint_name=os.environ["SERVING_ENDPOINT"], messages=list(messages), max_tokens=400)
+            messages.append({"role": "assistant", "content": reply["content"]})
+            latencies.append(time.perf_counter() - start)
+        except Exception:
+            errors += 1
+        time.sleep(think_time)
+    results[user_idx] = {"latencies": latencies, "errors": errors, "cpu_seconds": time.thread_time() - cpu_start}
+
+
+def _run_stream_user(user_idx: int, n_requests: int, think_time: float, results: dict):
+    import requests
+
+    url = f"{os.environ['DATABRICKS_HOST']}/serving-endpoints/{os.environ['SERVING_ENDPOINT']}/invocations"
+    headers = {"Authorization": f"Bearer {os.environ['DATABRICKS_TOKEN']}"}
+    messages, latencies, first_token, errors = [], [], [], 0
+    cpu_start = time.thread_time()
+    for i in range(n_requests):
+        messages.append({"role": "user", "content": _prompt(user_idx, i)})
+        start = time.perf_counter()
+        try:
+            parts, first = [], None
+            with requests.post(url, headers=headers, json={"messages": messages, "max_tokens": 400, "stream": True},
+                               stream=True, timeout=120) as response:
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    if not line.startswith(b"data: ") or line == b"data: [DONE]":
+                        continue
+                    if first is None:
+                        first = time.perf_counter() - start
+                    parts.append(json.loads(line[len(b"data: "):])["choices"][0]["delta"].get("content", ""))
+            messages.append({"role": "assistant", "content": "".join(parts)})
+            latencies.append(time.perf_counter() - start)
+            first_token.append(first if first is not None else latencies[-1])
+        except Exception:
+            errors += 1
+        time.sleep(think_time)
+    results[user_idx] = {"latencies": latencies, "first_token": first_token, "errors": errors,
+                         "cpu_seconds": time.thread_time() - cpu_start}
+
+
+def _write_stub_snapshot(directory: str) -> None:
+    # The only table app.py reads at module level; the other pages use built-in sample data
+    import pyarrow as pa
+
+    table = pa.table({
+        "CustomerID": [f"CUST{i:04d}" for i in range(1, 51)],
+        "Name": [f"Client {i}" for i in range(1, 51)],
+        "ProductType": [["CASA", "FD", "Investments", "Insurance", "Loans"][i % 5] for i in range(50)],
+        "AUM": [float(100000 * (i + 1)) for i in range(50)],
+    })
+    with pa.ipc.new_file(os.path.join(directory, "customer_product_value.arrow"), table.schema) as writer:
+        writer.write_table(table)
+
+
+def _run_apptest_user(user_idx: int, n_requests: int, think_time: float, results: dict):
+    from streamlit.testing.v1 import AppTest
+
+    latencies, errors = [], 0
+    at = AppTest.from_file(os.path.join(APP_DIR, "app.py"), default_timeout=120)
+    at.run()
+    at.sidebar.radio[0].set_value("🤖 Agent-isstant").run()
+    for i in range(n_requests):
+        start = time.perf_counter()
+        at.chat_input[0].set_value(_prompt(user_idx, i)).run()
+        if at.exception:
+            errors += 1
+        else:
+            latencies.append(time.perf_counter() - start)
+        time.sleep(think_time)
+    # AppTest runs the script on its own thread, so per-session CPU comes from the process totals
+    results[user_idx] = {"latencies": latencies, "errors": errors, "cpu_seconds": None}
+
+
+USER_RUNNERS = {"helpers": _run_helpers_user, "stream": _run_stream_user, "apptest": _run_apptest_user}
+
+
+def run_load_test(users: int, requests_per_user: int, mode: str = "helpers", think_time: float = 0.0,
+                  stub_config: StubConfig = None, snapshot_dir: str = None) -> dict:
+    """Start the stub endpoint, drive `users` concurrent virtual users and return the report."""
+    stub_config = stub_config or StubConfig()
+    server = start_stub(stub_config)
+    os.environ["DATABRICKS_HOST"] = f"http://127.0.0.1:{server.server_address[1]}"
+    os.environ.setdefault("DATABRICKS_TOKEN", "stub-token")
+    os.environ.setdefault("SERVING_ENDPOINT", "stub-endpoint")
+    if APP_DIR not in sys.path:
+        sys.path.insert(0, APP_DIR)
+    generated_snapshot = None
+    if mode == "apptest":
+        if snapshot_dir is None:
+            snapshot_dir = generated_snapshot = tempfile.mkdtemp(prefix="loadtest-snapshot-")
+            _write_stub_snapshot(snapshot_dir)
+        os.environ["DATA_BACKEND"] = "snapshot"
+        os.environ["SNAPSHOT_DIR"] = snapshot_dir
+
+    target = USER_RUNNERS[mode]
+    results = {}
+    threads = [
+        threading.Thread(target=target, args=(i, requests_per_user, think_time, results), name=f"vu-{i}")
+        for i in range(users)
+    ]
+
+    tracemalloc.start()
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - wall_start
+    cpu_total = time.process_time() - cpu_start
+    _, peak_traced = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    server.shutdown()
+    if generated_snapshot:
+        shutil.rmtree(generated_snapshot, ignore_errors=True)
+
+    latencies = [l for r in results.values() for l in r["latencies"]]
+    first_token = [l for r in results.values() for l in r.get("first_token", [])]
+    thread_cpu = [r["cpu_seconds"] for r in results.values() if r["cpu_seconds"] is not None]
+    completed = len(latencies)
+    report = {
+        "mode": mode,
+        "users": users,
+        "requests_per_user": requests_per_user,
+        "completed": completed,
+        # Lower than completed + errors when identical requests were coalesced
+        "stub_invocations": stub_config.served,
+        "errors": sum(r["errors"] for r in results.values()),
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(completed / wall, 2) if wall else 0.0,
+        "latency_ms": {
+            "mean": round(statistics.fmean(latencies) * 1000, 1) if latencies else 0.0,
+            "p50": round(_percentile(latencies, 50) * 1000, 1),
+            "p90": round(_percentile(latencies, 90) * 1000, 1),
+            "p95": round(_percentile(latencies, 95) * 1000, 1),
+            "p99": round(_percentile(latencies, 99) * 1000, 1),
+        },
+        "cpu_ms_per_session": round(
+            (statistics.fmean(thread_cpu) if thread_cpu else cpu_total / max(users, 1)) * 1000, 1
+        ),
+        "process_cpu_seconds": round(cpu_total, 3),
+        "peak_traced_kb_per_session": round(peak_traced / 1024 / max(users, 1), 1),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+    if first_token:
+        report["first_token_ms"] = {
+            "p50": round(_percentile(first_token, 50) * 1000, 1),
+            "p95": round(_percentile(first_token, 95) * 1000, 1),
+        }
+    return report
+
+
+def _print_report(report: dict):
+    lat = report["latency_ms"]
+    print(f"Mode: {report['mode']} | users: {report['users']} x {report['requests_per_user']} requests")
+    print(f"Completed: {report['completed']} | errors: {report['errors']} | stub invocations: "
+          f"{report['stub_invocations']} | wall: {report['wall_seconds']}s")
+    print(f"Throughput: {report['throughput_rps']} req/s")
+    print(f"Latency ms: mean {lat['mean']} | p50 {lat['p50']} | p90 {lat['p90']} | p95 {lat['p95']} | p99 {lat['p99']}")
+    if "first_token_ms" in report:
+        print(f"First token ms: p50 {report['first_token_ms']['p50']} | p95 {report['first_token_ms']['p95']}")
+    print(f"CPU per session: {report['cpu_ms_per_session']} ms (process total {report['process_cpu_seconds']}s)")
+    print(f"Memory per session: {report['peak_traced_kb_per_session']} KB peak traced | max RSS {report['max_rss_mb']} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=5, help="prompts per virtual user")
+    parser.add_argument("--mode", choices=sorted(USER_RUNNERS), default="helpers")
+    parser.add_argument("--think-time", type=float, default=0.0, help="seconds between prompts")
+    parser.add_argument("--latency-ms", type=float, default=500.0)
+    parser.add_argument("--jitter-ms", type=float, default=100.0)
+    parser.add_argument("--schema", choices=["messages", "choices"], default="messages")
+    parser.add_argument("--reply-tokens", type=int, default=120)
+    parser.add_argument("--token-delay-ms", type=float, default=5.0, help="delay between streamed chunks")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--snapshot-dir", help="snapshot folder for the apptest mode (default: a generated one)")
+    parser.add_argument("--json", dest="json_path", help="also write the report to this file")
+    args = parser.parse_args()
+
+    config = StubConfig(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, schema=args.schema,
+                        reply_tokens=args.reply_tokens, token_delay_ms=args.token_delay_ms, error_rate=args.error_rate)
+    report = run_load_test(args.users, args.requests, args.mode, args.think_time, config, args.snapshot_dir)
+    _print_report(report)
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Local stub of a Databricks model serving endpoint for load testing the chat path.
+
+It answers the two calls the app makes through model_serving_utils:
+- GET  /api/2.0/serving-endpoints/<name>              (endpoint task type lookup)
+- POST /serving-endpoints/<name>/invocations          (chat query)
+
+Invocations reply with either the agent schema ({"messages": [...]}) or the chat
+completions schema ({"choices": [...]}), after a configurable latency. Requests sent
+with "stream": true get server-sent chat completion chunks instead.
+
+Run standalone with:
+    python -m loadtest.stub_endpoint --port 8765 --latency-ms 800 --schema choices
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# model_serving_utils raises on the chat task types listed in is_endpoint_supported,
+# so the stub reports the agent task type the deployed endpoint uses.
+DEFAULT_TASK = "agent/v1/responses"
+
+
+class StubConfig:
+    def __init__(self, latency_ms=500.0, jitter_ms=100.0, schema="messages", reply_tokens=120,
+                 token_delay_ms=5.0, error_rate=0.0, task=DEFAULT_TASK):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.schema = schema
+        self.reply_tokens = reply_tokens
+        self.token_delay_ms = token_delay_ms
+        self.error_rate = error_rate
+        self.task = task
+        # Invocations answered, so a load test can compare them with the requests its users sent
+        self.served = 0
+        self._served_lock = threading.Lock()
+
+    def count_invocation(self) -> None:
+        with self._served_lock:
+            self.served += 1
+
+    def sample_latency(self) -> float:
+        return max(0.0, random.gauss(self.latency_ms, self.jitter_ms)) / 1000
+
+
+def _reply_text(messages, n_tokens: int) -> str:
+    last = messages[-1]["content"] if messages else ""
+    words = ["Based", "on", "the", "client", "profile,", "consider", "a", "SIP", "top-up", "and", "term", "cover."]
+    body = " ".join(words[i % len(words)] for i in range(n_tokens))
+    return f"[stub] {body} (re: {last[:40]})"
+
+
+def _usage(messages, reply: str) -> dict:
+    prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in messages)
+    completion_tokens = len(reply.split())
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    config: StubConfig = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.startswith("/api/2.0/serving-endpoints/"):
+            name = self.path.rsplit("/", 1)[-1]
+            self._send_json(200, {"name": name, "task": self.config.task, "state": {"ready": "READY"}})
+        else:
+            self._send_json(404, {"error_code": "NOT_FOUND"})
+
+    def do_POST(self):
+        if not (self.path.startswith("/serving-endpoints/") and self.path.endswith("/invocations")):
+            self._send_json(404, {"error_code": "NOT_FOUND"})
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        messages = payload.get("messages") or payload.get("input") or []
+        self.config.count_invocation()
+
+        time.sleep(self.config.sample_latency())
+        if random.random() < self.config.error_rate:
+            self._send_json(503, {"error_code": "TEMPORARILY_UNAVAILABLE", "message": "stub injected failure"})
+            return
+
+        reply = _reply_text(messages, self.config.reply_tokens)
+        if payload.get("stream"):
+            self._stream(reply)
+            return
+        message = {"role": "assistant", "content": reply}
+        if self.config.schema == "choices":
+            response = {"id": str(uuid.uuid4()), "object": "chat.completion",
+                        "choices": [{"index": 0, "message": message, "finish_reason": "stop"}]}
+        else:
+            response = {"messages": [message]}
+        response["usage"] = _usage(messages, reply)
+        self._send_json(200, response)
+
+    def _stream(self, reply: str):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        chunk_id = str(uuid.uuid4())
+        for token in reply.split(" "):
+            chunk = {"id": chunk_id, "object": "chat.completion.chunk",
+                     "choices": [{"index": 0, "delta": {"role": "assistant", "content": token + " "}}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            time.sleep(self.config.token_delay_ms / 1000)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+
+def start_stub(config: StubConfig, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """Start the stub on a background thread and return the server (server.server_address has the bound port)."""
+    handler = type("StubHandler", (_Handler,), {"config": config})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="stub-endpoint", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=500.0)
+    parser.add_argument("--jitter-ms", type=float, default=100.0)
+    parser.add_argument("--schema", choices=["messages", "choices"], default="messages")
+    parser.add_argument("--reply-tokens", type=int, default=120)
+    parser.add_argument("--token-delay-ms", type=float, default=5.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--task", default=DEFAULT_TASK)
+    args = parser.parse_args()
+
+    config = StubConfig(args.latency_ms, args.jitter_ms, args.schema, args.reply_tokens,
+                        args.token_delay_ms, args.error_rate, args.task)
+    server = start_stub(config, args.host, args.port)
+    print(f"Stub serving endpoint listening on http://{args.host}:{server.server_address[1]}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Local snapshot mode: the app answers its SQL queries from Arrow files instead of a warehouse.
+
+For development, demos and warehouse outages. `export` copies every table of the
+bharat_bank_rm schema into an uncompressed Arrow IPC file per table, streaming record
+batches from the warehouse so no table has to fit in memory:
+
+    python local_snapshot.py export --out snapshot/
+
+With DATA_BACKEND=snapshot (and SNAPSHOT_DIR, default "snapshot") the app memory-maps those
+files and runs its queries on them with DuckDB. Mapping is lazy and zero-copy, so opening a
+snapshot takes milliseconds whatever its size, and every app process reading the same files
+shares one copy in the page cache. Parquet files in the folder are read too, but into memory.
+
+Fully qualified names (catalog.schema.table) in queries are mapped to the snapshot tables.
+There is no per-user access control on a snapshot: user-token queries see every row.
+"""
+
+import argparse
+import json
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime, timezone
+
+import pandas as pd
+import pyarrow as pa
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "snapshot")
+SNAPSHOT_CATALOG = "demo_soumyashree_patra"
+SNAPSHOT_SCHEMA = "bharat_bank_rm"
+SNAPSHOT_METADATA_NAME = "snapshot.json"
+EXPORT_BATCH_ROWS = 100_000
+
+
+class SnapshotBackend:
+    """Memory-mapped Arrow tables of one snapshot folder, queried with DuckDB."""
+
+    def __init__(self, directory: str):
+        import duckdb  # only needed in snapshot mode
+
+        self._duckdb = duckdb
+        self.directory = directory
+        metadata_path = os.path.join(directory, SNAPSHOT_METADATA_NAME)
+        metadata = {}
+        if os.path.exists(metadata_path):
+            with open(metadata_path) as f:
+                metadata = json.load(f)
+        catalog = re.escape(metadata.get("catalog", SNAPSHOT_CATALOG))
+        schema = re.escape(metadata.get("schema", SNAPSHOT_SCHEMA))
+        # `catalog`.`schema`.table and schema.table both name the snapshot table
+        self._qualifier = re.compile(rf"(?:`?{catalog}`?\.)?`?{schema}`?\.", re.IGNORECASE)
+
+        start = time.perf_counter()
+        self.tables = {}
+        for file_name in sorted(os.listdir(directory)):
+            name, extension = os.path.splitext(file_name)
+            path = os.path.join(directory, file_name)
+            if extension == ".arrow":
+                self.tables[name] = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+            elif extension == ".parquet":
+                import pyarrow.parquet as pq
+
+                self.tables[name] = pq.read_table(path, memory_map=True)
+        if not self.tables:
+            raise FileNotFoundError(f"No .arrow or .parquet tables in snapshot folder {directory!r}")
+        logger.info("Opened snapshot %s (%d tables) in %.1f ms", directory, len(self.tables),
+                    (time.perf_counter() - start) * 1000)
+        self._local = threading.local()
+
+    def _connection(self):
+        # DuckDB connections are not shared between threads; registering a table is zero-copy
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = self._local.con = self._duckdb.connect()
+            for name, table in self.tables.items():
+                con.register(name, table)
+        return con
+
+    def query(self, query: str) -> pd.DataFrame:
+        return self._connection().execute(self._qualifier.sub("", query)).fetch_arrow_table().to_pandas()
+
+
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+
+def get_snapshot(directory: str = SNAPSHOT_DIR) -> SnapshotBackend:
+    """The process-wide backend of a snapshot folder, opened on first use."""
+    directory = os.path.abspath(directory)
+    with _snapshots_lock:
+        if directory not in _snapshots:
+            _snapshots[directory] = SnapshotBackend(directory)
+        return _snapshots[directory]
+
+
+def export_snapshot(connection, out_dir: str, catalog: str = SNAPSHOT_CATALOG, schema: str = SNAPSHOT_SCHEMA,
+                    tables: list[str] = None) -> dict:
+    """
+    Write each table of `catalog.schema` (default: all of them) to out_dir/<table>.arrow using a
+    DB-API connection whose cursors support fetchmany_arrow, e.g. databricks.sql. Returns rows per table.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    with connection.cursor() as cursor:
+        if tables is None:
+            cursor.execute(f"SHOW TABLES IN {catalog}.{schema}")
+            tables = [row.tableName for row in cursor.fetchall() if not row.isTemporary]
+        rows = {}
+        for table in tables:
+            start = time.perf_counter()
+            cursor.execute(f"SELECT * FROM {catalog}.{schema}.{table}")
+            path = os.path.join(out_dir, f"{table}.arrow")
+            tmp_path = f"{path}.tmp"
+            writer, rows[table] = None, 0
+            try:
+                while True:
+                    batch = cursor.fetchmany_arrow(EXPORT_BATCH_ROWS)
+                    if writer is None:
+                        # Uncompressed, so the file can be memory-mapped without decoding
+                        writer = pa.ipc.new_file(tmp_path, batch.schema)
+                    if batch.num_rows == 0:
+                        break
+                    writer.write_table(batch)
+                    rows[table] += batch.num_rows
+            finally:
+                if writer is not None:
+                    writer.close()
+            os.replace(tmp_path, path)
+            logger.info("Exported %s: %d rows in %.1fs", table, rows[table], time.perf_counter() - start)
+
+    metadata = {"catalog": catalog, "schema": schema, "exported_at": datetime.now(timezone.utc).isoformat(),
+                "tables": rows}
+    with open(os.path.join(out_dir, SNAPSHOT_METADATA_NAME), "w") as f:
+        json.dump(metadata, f, indent=1)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export = subparsers.add_parser("export", help="copy the warehouse tables into a snapshot folder")
+    export.add_argument("--out", default=SNAPSHOT_DIR)
+    export.add_argument("--catalog", default=SNAPSHOT_CATALOG)
+    export.add_argument("--schema", default=SNAPSHOT_SCHEMA)
+    export.add_argument("--tables", nargs="*", help="export only these tables")
+    query = subparsers.add_parser("query", help="run a query on a snapshot folder")
+    query.add_argument("sql")
+    query.add_argument("--dir", default=SNAPSHOT_DIR)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    if args.command == "query":
+        print(get_snapshot(args.dir).query(args.sql).to_string())
+        return
+
+    from databricks import sql
+    from databricks.sdk.core import Config
+
+    cfg = Config()
+    with sql.connect(
+        server_hostname=cfg.host,
+        http_path=f"/sql/1.0/warehouses/{cfg.warehouse_id}",
+        credentials_provider=lambda: cfg.authenticate,
+    ) as connection:
+        rows = export_snapshot(connection, args.out, args.catalog, args.schema, args.tables)
+    print(json.dumps(rows, indent=1))
+
+
+if __name__ == "__main__":
+    main()
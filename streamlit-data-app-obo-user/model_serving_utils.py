@@ -1,6 +1,34 @@
+import contextvars
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
 from mlflow.deployments import get_deploy_client
 from databricks.sdk import WorkspaceClient
 
+from request_coalescing import coalesce
+from usage_accounting import add_bytes, add_usage, merge_usage, run_isolated
+
+logger = logging.getLogger(__name__)
+
+# Resilience settings for calls to the serving endpoint. They can be overridden
+# through the app environment (app.yaml) without a code change.
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+MAX_RETRIES = int(os.getenv("SERVING_MAX_RETRIES", "4"))
+BACKOFF_BASE_SECONDS = float(os.getenv("SERVING_BACKOFF_BASE_SECONDS", "0.5"))
+BACKOFF_MAX_SECONDS = float(os.getenv("SERVING_BACKOFF_MAX_SECONDS", "8"))
+HEDGE_ENABLED = os.getenv("SERVING_HEDGE_ENABLED", "false").lower() == "true"
+HEDGE_PERCENTILE = float(os.getenv("SERVING_HEDGE_PERCENTILE", "95"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("SERVING_BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("SERVING_BREAKER_RESET_SECONDS", "30"))
+RESPONSE_CACHE_SIZE = 256
+
 def _get_endpoint_task_type(endpoint_name: str) -> str:
     """Get the task type of a serving endpoint."""
     w = WorkspaceClient()
@@ -35,6 +63,8 @@ def _query_endpoint(endpoint_name: str, input: list[dict[str, str]], max_output_
         #inputs={'messages': messages, "max_tokens": max_tokens},
         inputs={'messages': input, "max_tokens": max_output_tokens},
     )
+    add_usage(res.get("usage"))
+    add_bytes(len(json.dumps(res, default=str)))
     if "messages" in res:
         return res["messages"]
     elif "choices" in res:
@@ -44,16 +74,204 @@ def _query_endpoint(endpoint_name: str, input: list[dict[str, str]], max_output_
                     "2) Databricks agent serving endpoints that implement the conversational agent schema documented "
                     "in https://docs.databricks.com/aws/en/generative-ai/agent-framework/author-agent")
 
-def query_endpoint(endpoint_name, messages, max_tokens):
+class EndpointUnavailableError(Exception):
+    """Raised when the serving endpoint keeps failing or its circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Fails fast while an endpoint is unhealthy.
+    After `failure_threshold` consecutive failures the breaker opens and rejects calls
+    for `reset_timeout` seconds, then lets a single probe call through (half-open).
+    """
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, reset_timeout: float = BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._probe_in_flight = False
+            if self.state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                if self.state != "open":
+                    logger.warning("Circuit breaker opened after %d failures", self._failures)
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+
+class _LatencyTracker:
+    """Keeps a window of recent successful call latencies to derive the hedging delay."""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self._samples = deque(maxlen=window)
+        self._min_samples = min_samples
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q: float):
+        with self._lock:
+            if len(self._samples) < self._min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+_latencies: dict[str, _LatencyTracker] = {}
+_state_lock = threading.Lock()
+_hedge_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="serving-hedge")
+_response_cache: OrderedDict = OrderedDict()
+
+
+def _endpoint_state(endpoint_name: str) -> tuple[CircuitBreaker, _LatencyTracker]:
+    with _state_lock:
+        if endpoint_name not in _breakers:
+            _breakers[endpoint_name] = CircuitBreaker()
+            _latencies[endpoint_name] = _LatencyTracker()
+        return _breakers[endpoint_name], _latencies[endpoint_name]
+
+
+def _status_code(exc: Exception):
+    response = getattr(exc, "response", None)
+    status = getattr(response, "status_code", None)
+    if status is None and hasattr(exc, "get_http_status_code"):
+        # MlflowException carries the HTTP status of the failed REST call
+        status = exc.get_http_status_code()
+    return status
+
+
+def _is_retryable(exc: Exception) -> bool:
+    if isinstance(exc, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    return _status_code(exc) in RETRYABLE_STATUS_CODES
+
+
+def _backoff_delay(attempt: int, exc: Exception) -> float:
+    """Full-jitter exponential backoff, honouring Retry-After on 429 responses."""
+    retry_after = getattr(getattr(exc, "response", None), "headers", {}).get("Retry-After")
+    if retry_after and str(retry_after).isdigit():
+        return min(float(retry_after), BACKOFF_MAX_SECONDS)
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+def _call_hedged(fn, delay: float):
+    """Run `fn`, and if it has not finished after `delay` seconds start a second identical call; first success wins."""
+    # Each attempt runs in a copy of the caller's context with its own usage record; only the
+    # winner's usage is added to the caller's record, so a hedged request is counted once
+    primary = _hedge_executor.submit(contextvars.copy_context().run, run_isolated, fn)
+    done, _ = wait([primary], timeout=delay)
+    if done:
+        result, usage = primary.result()
+        merge_usage(usage)
+        return result
+    pending = {primary, _hedge_executor.submit(contextvars.copy_context().run, run_isolated, fn)}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                result, usage = future.result()
+                merge_usage(usage)
+                return result
+            error = future.exception()
+    raise error
+
+
+def call_with_resilience(endpoint_name: str, fn):
+    """
+    Call `fn` (a request against `endpoint_name`) with jittered exponential backoff on
+    429/5xx and connection errors, optional p95 hedging, and a per-endpoint circuit breaker.
+    Raises EndpointUnavailableError when the endpoint is unhealthy.
+    """
+    breaker, latencies = _endpoint_state(endpoint_name)
+    for attempt in range(MAX_RETRIES + 1):
+        if not breaker.allow_request():
+            raise EndpointUnavailableError(f"Serving endpoint '{endpoint_name}' is unavailable (circuit open)")
+        hedge_delay = latencies.percentile(HEDGE_PERCENTILE) if HEDGE_ENABLED else None
+        start = time.monotonic()
+        try:
+            result = _call_hedged(fn, hedge_delay) if hedge_delay is not None else fn()
+        except Exception as e:
+            if not _is_retryable(e):
+                # The endpoint answered, so it is healthy; the request itself is bad
+                breaker.record_success()
+                raise
+            breaker.record_failure()
+            if attempt == MAX_RETRIES:
+                raise EndpointUnavailableError(f"Serving endpoint '{endpoint_name}' failed after {attempt + 1} attempts") from e
+            delay = _backoff_delay(attempt, e)
+            logger.warning("Serving endpoint call failed (%s), retrying in %.2fs", e, delay)
+            time.sleep(delay)
+        else:
+            latencies.record(time.monotonic() - start)
+            breaker.record_success()
+            return result
+
+
+def _payload_key(endpoint_name: str, messages, max_tokens) -> str:
+    return json.dumps([endpoint_name, messages, max_tokens], sort_keys=True, default=str)
+
+
+def query_endpoint(endpoint_name, messages, max_tokens, fallback=None, scope="service_principal"):
     """
     Query a chat-completions or agent serving endpoint
     If querying an agent serving endpoint that returns multiple messages, this method
-    returns the last message
+    returns the last message.
+    While the endpoint is unavailable, the last good response to the same conversation is
+    returned if there is one, otherwise `fallback(messages)` if given.
+    Identical concurrent queries under the same permission `scope` share one in-flight call
     ."""
-    return _query_endpoint(endpoint_name, messages, max_tokens)[-1]
-
-import requests
-import os
+    key = _payload_key(endpoint_name, messages, max_tokens)
+    try:
+        response = coalesce(
+            "serving", endpoint_name, {"messages": messages, "max_tokens": max_tokens}, scope,
+            lambda: call_with_resilience(
+                endpoint_name, lambda: _query_endpoint(endpoint_name, messages, max_tokens)[-1]
+            ),
+        )
+    except EndpointUnavailableError as e:
+        with _state_lock:
+            cached = _response_cache.get(key)
+        if cached is not None:
+            logger.warning("%s; serving cached response", e)
+            return dict(cached)
+        if fallback is not None:
+            logger.warning("%s; serving fallback response", e)
+            return fallback(messages)
+        raise
+    with _state_lock:
+        _response_cache[key] = response
+        _response_cache.move_to_end(key)
+        while len(_response_cache) > RESPONSE_CACHE_SIZE:
+            _response_cache.popitem(last=False)
+    return dict(response)
 
 def query_endpoint1(endpoint_name, messages, max_tokens=400):
     url = f"https://{os.getenv('DATABRICKS_HOST')}/serving-endpoints/{endpoint_name}/invocations"
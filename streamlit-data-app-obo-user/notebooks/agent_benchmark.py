@@ -0,0 +1,227 @@
+"""
+Offline benchmark of the tool-calling agent loop, with no workspace or network.
+
+The agent code is taken from the `%%writefile agent.py` cell of agent_driver.py, so the
+benchmark always measures the current source. A scripted fake chat-completions stream
+replaces the LLM and a fake UC function client replaces the tools, so everything measured
+is the agent's own overhead: message prep (prep_msgs_for_cc_llm), tool specs, event
+aggregation, tool output handling and MLflow tracing.
+
+Each scenario varies the number of registered tools, the number of LLM iterations per
+request and the length of the conversation history, and reports CPU time and allocated
+memory per iteration, i.e. per LLM call the agent actually made (the loop's max_iter can
+stop a scenario before it reaches its scripted number of iterations).
+
+    python agent_benchmark.py                       # run and print the table
+    python agent_benchmark.py --save baseline.json  # keep results for later comparison
+    python agent_benchmark.py --compare baseline.json --threshold 0.2
+"""
+
+import argparse
+import importlib.util
+import itertools
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+NOTEBOOK_DIR = os.path.dirname(os.path.abspath(__file__))
+DRIVER_NOTEBOOK = os.path.join(NOTEBOOK_DIR, "agent_driver.py")
+
+TOOL_COUNTS = [1, 4, 16]
+ITERATIONS = [1, 3, 8]
+HISTORY_LENGTHS = [0, 20, 100]
+
+
+def load_agent_module():
+    """Import the agent from the %%writefile cell of agent_driver.py in offline mode."""
+    with open(DRIVER_NOTEBOOK) as f:
+        source = f.read()
+    start = source.index("# MAGIC %%writefile agent.py\n")
+    end = source.index("\n\n# COMMAND ----------", start)
+    lines = source[start:end].split("\n")[1:]
+    code = "\n".join(line[len("# MAGIC "):] if line.startswith("# MAGIC ") else "" for line in lines)
+
+    path = os.path.join(tempfile.mkdtemp(prefix="agent_benchmark_"), "agent.py")
+    with open(path, "w") as f:
+        f.write(code + "\n")
+    os.environ["AGENT_OFFLINE"] = "1"
+    spec = importlib.util.spec_from_file_location("agent", path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["agent"] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeChunk:
+    def __init__(self, data: dict):
+        self.data = data
+
+    def to_dict(self) -> dict:
+        return self.data
+
+
+class FakeChatCompletions:
+    """
+    Scripted chat-completions stream: the first `iterations - 1` LLM calls each request one
+    tool call (cycling over the tools), the last one streams a text answer in small deltas.
+    """
+
+    def __init__(self, tool_names: list[str], iterations: int, answer_chunks: int = 60):
+        self.tool_names = tool_names
+        self.iterations = iterations
+        self.answer_chunks = answer_chunks
+        self.calls = 0
+
+    def create(self, model, messages, tools=None, stream=True, **kwargs):
+        self.calls += 1
+        n_tool_outputs = sum(1 for m in messages if m.get("role") == "tool")
+        turn = n_tool_outputs
+        if turn < self.iterations - 1:
+            name = self.tool_names[turn % len(self.tool_names)]
+            arguments = json.dumps({"customer_name": f"Client {turn}", "question": "portfolio summary"})
+            tool_call = {"index": 0, "id": f"call_{turn}", "type": "function",
+                         "function": {"name": name, "arguments": arguments}}
+            return [FakeChunk({"id": f"chatcmpl-{turn}", "object": "chat.completion.chunk",
+                               "choices": [{"index": 0, "delta": {"role": "assistant", "tool_calls": [tool_call]}}]})]
+        return [
+            FakeChunk({"id": f"chatcmpl-{turn}", "object": "chat.completion.chunk",
+                       "choices": [{"index": 0, "delta": {"role": "assistant", "content": f"token{i} "}}]})
+            for i in range(self.answer_chunks)
+        ]
+
+
+class FakeUCFunctionClient:
+    """Returns a UC table result with `rows` rows for every function call."""
+
+    def __init__(self, rows: int = 20):
+        self.rows = rows
+
+    def execute_function(self, function_name, parameters):
+        table = {
+            "is_truncated": False,
+            "columns": ["CustomerID", "Name", "ProductType", "Value"],
+            "rows": [[i, f"Client {i}", "Mutual Fund", 1000.0 * i] for i in range(self.rows)],
+        }
+        return SimpleNamespace(error=None, value=json.dumps(table))
+
+
+def make_tool_spec(i: int) -> dict:
+    return {
+        "type": "function",
+        "function": {
+            "name": f"demo_catalog__bench_schema__tool_{i}",
+            "description": f"Benchmark tool {i} that looks up customer information.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "customer_name": {"type": "string", "description": "Customer name"},
+                    "question": {"type": "string", "description": "Question to answer"},
+                },
+                "required": ["customer_name"],
+            },
+        },
+    }
+
+
+def make_history(length: int) -> list[dict]:
+    history = []
+    for i in range(length):
+        role = "user" if i % 2 == 0 else "assistant"
+        history.append({"role": role, "content": f"Earlier message {i} about the client's portfolio and KYC status."})
+    return history
+
+
+def run_scenario(agent_module, n_tools: int, iterations: int, history_length: int, repeats: int) -> dict:
+    agent_module.uc_function_client = FakeUCFunctionClient()
+    tools = [agent_module.create_tool_info(make_tool_spec(i)) for i in range(n_tools)]
+    llm = FakeChatCompletions([t.name for t in tools], iterations)
+    agent = agent_module.ToolCallingAgent(
+        llm_endpoint="fake-llm",
+        tools=tools,
+        model_serving_client=SimpleNamespace(chat=SimpleNamespace(completions=llm)),
+    )
+    request = agent_module.ResponsesAgentRequest(
+        input=make_history(history_length) + [{"role": "user", "content": "What should I sell to Client 0?"}]
+    )
+
+    agent.predict(request)  # warm up
+    cpu_per_iteration, peak_kb_per_iteration = [], []
+    for _ in range(repeats):
+        llm.calls = 0
+        tracemalloc.start()
+        cpu_start = time.process_time()
+        agent.predict(request)
+        cpu = time.process_time() - cpu_start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        cpu_per_iteration.append(cpu / llm.calls)
+        peak_kb_per_iteration.append(peak / 1024 / llm.calls)
+
+    return {
+        "scenario": f"tools={n_tools} iterations={iterations} history={history_length}",
+        "llm_calls": llm.calls,
+        "cpu_ms_per_iteration": round(statistics.median(cpu_per_iteration) * 1000, 3),
+        "alloc_peak_kb_per_iteration": round(statistics.median(peak_kb_per_iteration), 1),
+    }
+
+
+def run_benchmarks(repeats: int = 5, tracing: bool = False) -> list[dict]:
+    agent_module = load_agent_module()
+    if not tracing:
+        agent_module.mlflow.tracing.disable()
+        # The agent tags the current trace, which logs a warning on every request when there is none
+        logging.getLogger("mlflow.tracing.fluent").setLevel(logging.ERROR)
+    return [
+        run_scenario(agent_module, n_tools, iterations, history_length, repeats)
+        for n_tools, iterations, history_length in itertools.product(TOOL_COUNTS, ITERATIONS, HISTORY_LENGTHS)
+    ]
+
+
+def compare(results: list[dict], baseline: list[dict], threshold: float) -> list[str]:
+    """Scenarios whose CPU time per iteration grew by more than `threshold` (e.g. 0.2 = 20%)."""
+    baseline_by_scenario = {r["scenario"]: r for r in baseline}
+    regressions = []
+    for result in results:
+        before = baseline_by_scenario.get(result["scenario"])
+        if before and before["cpu_ms_per_iteration"] > 0:
+            change = result["cpu_ms_per_iteration"] / before["cpu_ms_per_iteration"] - 1
+            if change > threshold:
+                regressions.append(
+                    f"{result['scenario']}: {before['cpu_ms_per_iteration']} -> {result['cpu_ms_per_iteration']} ms (+{change:.0%})"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--tracing", action="store_true", help="keep MLflow tracing enabled while measuring")
+    parser.add_argument("--save", help="write results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed CPU time growth before flagging")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.repeats, args.tracing)
+    print(f"{'scenario':<40} {'LLM calls':>9} {'cpu ms/iter':>12} {'peak KB/iter':>13}")
+    for r in results:
+        print(f"{r['scenario']:<40} {r['llm_calls']:>9} {r['cpu_ms_per_iteration']:>12} {r['alloc_peak_kb_per_iteration']:>13}")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for line in regressions:
+            print("REGRESSION", line)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -18,7 +18,7 @@
 
 # COMMAND ----------
 
-# MAGIC %pip install -U -qqqq backoff databricks-openai uv databricks-agents mlflow-skinny[databricks]
+# MAGIC %pip install -U -qqqq backoff numpy databricks-openai uv databricks-agents mlflow-skinny[databricks]
 # MAGIC dbutils.library.restartPython()
 
 # COMMAND ----------
@@ -31,24 +31,41 @@
 # COMMAND ----------
 
 # MAGIC %%writefile agent.py
+# MAGIC import ast
+# MAGIC import asyncio
+# MAGIC import contextvars
+# MAGIC import csv
+# MAGIC import hashlib
+# MAGIC import io
 # MAGIC import json
-# MAGIC from typing import Any, Callable, Generator, Optional
+# MAGIC import os
+# MAGIC import queue
+# MAGIC import re
+# MAGIC import statistics
+# MAGIC import threading
+# MAGIC import time
+# MAGIC from collections import Counter, OrderedDict
+# MAGIC from concurrent.futures import CancelledError, Executor, ThreadPoolExecutor
+# MAGIC from concurrent.futures import TimeoutError as FutureTimeoutError
+# MAGIC from typing import Any, AsyncGenerator, Callable, Generator, Optional
 # MAGIC from uuid import uuid4
 # MAGIC import warnings
 # MAGIC
 # MAGIC import backoff
+# MAGIC import httpx
 # MAGIC import mlflow
+# MAGIC import numpy as np
 # MAGIC import openai
 # MAGIC from databricks.sdk import WorkspaceClient
 # MAGIC from databricks_openai import UCFunctionToolkit, VectorSearchRetrieverTool
-# MAGIC from mlflow.entities import SpanType
+# MAGIC from mlflow.entities import SpanEvent, SpanType
 # MAGIC from mlflow.pyfunc import ResponsesAgent
 # MAGIC from mlflow.types.responses import (
 # MAGIC     ResponsesAgentRequest,
 # MAGIC     ResponsesAgentResponse,
 # MAGIC     ResponsesAgentStreamEvent,
 # MAGIC )
-# MAGIC from openai import OpenAI
+# MAGIC from openai import AsyncOpenAI, OpenAI
 # MAGIC from pydantic import BaseModel
 # MAGIC from unitycatalog.ai.core.base import get_uc_function_client
 # MAGIC
@@ -57,9 +74,78 @@
 # MAGIC ############################################
 # MAGIC LLM_ENDPOINT_NAME = "databricks-claude-sonnet-4"
 # MAGIC
+# MAGIC # Set AGENT_OFFLINE=1 to import this module without a Databricks workspace (offline benchmarks):
+# MAGIC # UC tools are not loaded and no AGENT is created
+# MAGIC AGENT_OFFLINE = os.getenv("AGENT_OFFLINE", "0") == "1"
+# MAGIC
 # MAGIC SYSTEM_PROMPT = """You are an expert Relationship Manager at an Indian bank, and know your customers well. Provide them with the right guidance
 # MAGIC """
 # MAGIC
+# MAGIC # Tool calls requested in the same LLM turn run concurrently on a bounded pool, which is
+# MAGIC # replaced when a call on it misses its deadline (see ToolPool)
+# MAGIC MAX_PARALLEL_TOOLS = 4
+# MAGIC
+# MAGIC # Wall-clock limits: a tool that misses its deadline returns a structured "timed_out" output to
+# MAGIC # the LLM, and a request that exhausts its latency budget ends the loop with what it has
+# MAGIC TOOL_TIMEOUT_SECONDS = 60
+# MAGIC TOOL_TIMEOUTS_SECONDS = {
+# MAGIC     "demo_soumyashree_patra.bharat_bank_rm._lookup_customer_info": 20,
+# MAGIC     "demo_soumyashree_patra.bharat_bank_rm._genie_wrapper": 45,
+# MAGIC     "demo_soumyashree_patra.test_genie_integration._genie_query": 45,
+# MAGIC }
+# MAGIC REQUEST_LATENCY_BUDGET_SECONDS = 120
+# MAGIC
+# MAGIC # A tool call repeated with identical arguments within one request is answered from that request's
+# MAGIC # earlier result; after this many LLM turns in a row that only repeat earlier calls, the loop stops
+# MAGIC LOOP_MAX_STALLED_TURNS = 2
+# MAGIC REPEATED_CALL_NOTE = "[Repeated call: this tool was already called with the same arguments in this request. Same result:]\n"
+# MAGIC
+# MAGIC # Results of idempotent UC tools are cached per caller for this many seconds. Tools that are
+# MAGIC # not listed (or are mapped to None) are never cached, e.g. tools with side effects, and
+# MAGIC # nothing is cached for requests without a user_id in their context.
+# MAGIC TOOL_CACHE_TTL_SECONDS = {
+# MAGIC     "demo_soumyashree_patra.bharat_bank_rm._lookup_customer_info": 900,
+# MAGIC     "demo_soumyashree_patra.bharat_bank_rm._genie_wrapper": 300,
+# MAGIC     "demo_soumyashree_patra.test_genie_integration._genie_query": 300,
+# MAGIC }
+# MAGIC TOOL_CACHE_MAX_ENTRIES = 1024
+# MAGIC
+# MAGIC # Tool outputs above their token budget are compacted (schema, aggregates, first rows) before
+# MAGIC # they enter the LLM context; the full output stays retrievable through fetch_tool_result.
+# MAGIC DEFAULT_TOOL_OUTPUT_TOKEN_BUDGET = 1500
+# MAGIC TOOL_OUTPUT_TOKEN_BUDGETS = {
+# MAGIC     "demo_soumyashree_patra.bharat_bank_rm._lookup_customer_info": 800,
+# MAGIC     "demo_soumyashree_patra.bharat_bank_rm._genie_wrapper": 2000,
+# MAGIC     "demo_soumyashree_patra.test_genie_integration._genie_query": 2000,
+# MAGIC }
+# MAGIC CHARS_PER_TOKEN = 4
+# MAGIC TOOL_OUTPUT_HEAD_ROWS = 10
+# MAGIC TOOL_OUTPUT_STORE_SIZE = 256
+# MAGIC
+# MAGIC # Serve with the asyncio-native agent, which keeps many conversations in flight per worker
+# MAGIC USE_ASYNC_AGENT = False
+# MAGIC ASYNC_TOOL_WORKERS = 32
+# MAGIC
+# MAGIC # predict_batch runs this many requests at once; predictions are cached on disk by input hash,
+# MAGIC # so re-running an evaluation only calls the LLM for new or changed examples. The hash also
+# MAGIC # covers this module's source, the settings whose names start with FINGERPRINT_SETTING_PREFIXES
+# MAGIC # and the indexed documents, so any change to the agent invalidates the cached predictions.
+# MAGIC BATCH_MAX_CONCURRENCY = 8
+# MAGIC PREDICTION_CACHE_DIR = os.getenv("AGENT_PREDICTION_CACHE_DIR", ".agent_prediction_cache")
+# MAGIC FINGERPRINT_SETTING_PREFIXES = (
+# MAGIC     "LLM_", "MAX_", "TOOL_", "LOOP_", "REQUEST_", "REPEATED_", "DEFAULT_TOOL_", "CHARS_PER_TOKEN", "PREFETCH_",
+# MAGIC     "LOCAL_DOCS_", "USE_ASYNC_",
+# MAGIC )
+# MAGIC
+# MAGIC # Customer names or IDs found in the user's message start _lookup_customer_info speculatively,
+# MAGIC # in parallel with the first LLM call; the result is served if the LLM then asks for that lookup.
+# MAGIC # The name index is read from a CSV (CustomerID,Name) or from customer_master through a warehouse.
+# MAGIC PREFETCH_TOOL_UDF = "demo_soumyashree_patra.bharat_bank_rm._lookup_customer_info"
+# MAGIC PREFETCH_MAX_CUSTOMERS = 2
+# MAGIC CUSTOMER_NAMES_CSV = os.getenv("AGENT_CUSTOMER_NAMES_CSV")
+# MAGIC CUSTOMER_NAMES_WAREHOUSE_ID = os.getenv("AGENT_CUSTOMER_NAMES_WAREHOUSE_ID")
+# MAGIC CUSTOMER_NAMES_QUERY = "SELECT CustomerID, Name FROM demo_soumyashree_patra.bharat_bank_rm.customer_master"
+# MAGIC
 # MAGIC
 # MAGIC ###############################################################################
 # MAGIC ## Define tools for your agent, enabling it to retrieve data or take actions
@@ -73,11 +159,21 @@
 # MAGIC     - "name" (str): The name of the tool.
 # MAGIC     - "spec" (dict): JSON description of the tool (matches OpenAI Responses format)
 # MAGIC     - "exec_fn" (Callable): Function that implements the tool logic
+# MAGIC     - "cache_ttl_seconds" (float, optional): How long results may be reused; None disables caching
+# MAGIC     - "output_token_budget" (int, optional): Outputs above this many tokens are compacted; None keeps them whole
+# MAGIC     - "timeout_seconds" (float): Wall-clock deadline for one call of the tool
 # MAGIC     """
 # MAGIC
 # MAGIC     name: str
 # MAGIC     spec: dict
 # MAGIC     exec_fn: Callable
+# MAGIC     cache_ttl_seconds: Optional[float] = None
+# MAGIC     output_token_budget: Optional[int] = DEFAULT_TOOL_OUTPUT_TOKEN_BUDGET
+# MAGIC     timeout_seconds: float = TOOL_TIMEOUT_SECONDS
+# MAGIC
+# MAGIC
+# MAGIC class ToolError(str):
+# MAGIC     """Error text returned by a tool; passed to the LLM like any result but never cached."""
 # MAGIC
 # MAGIC
 # MAGIC def create_tool_info(tool_spec, exec_fn_param: Optional[Callable] = None):
@@ -90,10 +186,17 @@
 # MAGIC     def exec_fn(**kwargs):
 # MAGIC         function_result = uc_function_client.execute_function(udf_name, kwargs)
 # MAGIC         if function_result.error is not None:
-# MAGIC             return function_result.error
+# MAGIC             return ToolError(function_result.error)
 # MAGIC         else:
 # MAGIC             return function_result.value
-# MAGIC     return ToolInfo(name=tool_name, spec=tool_spec, exec_fn=exec_fn_param or exec_fn)
+# MAGIC     return ToolInfo(
+# MAGIC         name=tool_name,
+# MAGIC         spec=tool_spec,
+# MAGIC         exec_fn=exec_fn_param or exec_fn,
+# MAGIC         cache_ttl_seconds=TOOL_CACHE_TTL_SECONDS.get(udf_name),
+# MAGIC         output_token_budget=TOOL_OUTPUT_TOKEN_BUDGETS.get(udf_name, DEFAULT_TOOL_OUTPUT_TOKEN_BUDGET),
+# MAGIC         timeout_seconds=TOOL_TIMEOUTS_SECONDS.get(udf_name, TOOL_TIMEOUT_SECONDS),
+# MAGIC     )
 # MAGIC
 # MAGIC
 # MAGIC TOOL_INFOS = []
@@ -102,10 +205,12 @@
 # MAGIC # TODO: Add additional tools
 # MAGIC UC_TOOL_NAMES = ["demo_soumyashree_patra.test_genie_integration._genie_query", "demo_soumyashree_patra.bharat_bank_rm._lookup_customer_info", "demo_soumyashree_patra.bharat_bank_rm._genie_wrapper"]
 # MAGIC
-# MAGIC uc_toolkit = UCFunctionToolkit(function_names=UC_TOOL_NAMES)
-# MAGIC uc_function_client = get_uc_function_client()
-# MAGIC for tool_spec in uc_toolkit.tools:
-# MAGIC     TOOL_INFOS.append(create_tool_info(tool_spec))
+# MAGIC uc_function_client = None
+# MAGIC if not AGENT_OFFLINE:
+# MAGIC     uc_toolkit = UCFunctionToolkit(function_names=UC_TOOL_NAMES)
+# MAGIC     uc_function_client = get_uc_function_client()
+# MAGIC     for tool_spec in uc_toolkit.tools:
+# MAGIC         TOOL_INFOS.append(create_tool_info(tool_spec))
 # MAGIC
 # MAGIC
 # MAGIC # Use Databricks vector search indexes as tools
@@ -126,20 +231,744 @@
 # MAGIC     TOOL_INFOS.append(create_tool_info(vs_tool.tool, vs_tool.execute))
 # MAGIC
 # MAGIC
+# MAGIC # Product sheets and SOPs in this folder (.md/.txt) are searchable in-process with BM25, without
+# MAGIC # a Genie or vector search round trip. The index lives in LOCAL_DOCS_INDEX_DIR as memory-mapped
+# MAGIC # NumPy arrays and only files whose size or modification time changed are re-read. The folder is
+# MAGIC # checked at most every LOCAL_DOCS_REFRESH_SECONDS, on a background thread, so a search never waits
+# MAGIC # for a rebuild: it uses the current index until the new one is swapped in.
+# MAGIC LOCAL_DOCS_DIR = os.getenv("AGENT_LOCAL_DOCS_DIR")
+# MAGIC LOCAL_DOCS_INDEX_DIR = os.getenv("AGENT_LOCAL_DOCS_INDEX_DIR")
+# MAGIC LOCAL_DOCS_EXTENSIONS = (".md", ".txt")
+# MAGIC LOCAL_DOCS_CHUNK_WORDS = 200
+# MAGIC LOCAL_DOCS_REFRESH_SECONDS = 60
+# MAGIC LOCAL_DOCS_TOP_K = 5
+# MAGIC
+# MAGIC
+# MAGIC class LocalDocumentIndex:
+# MAGIC     """
+# MAGIC     BM25 index over the text files in `docs_dir`, split into chunks of about `chunk_words` words.
+# MAGIC     Postings are stored per term as two flat arrays (chunk ids and term frequencies) with term
+# MAGIC     offsets, so a query only touches the postings of its own terms.
+# MAGIC     """
+# MAGIC
+# MAGIC     K1 = 1.5
+# MAGIC     B = 0.75
+# MAGIC     _TOKEN_RE = re.compile(r"\w+")
+# MAGIC
+# MAGIC     def __init__(self, docs_dir: str, index_dir: Optional[str] = None, chunk_words: int = LOCAL_DOCS_CHUNK_WORDS,
+# MAGIC                  refresh_seconds: float = LOCAL_DOCS_REFRESH_SECONDS):
+# MAGIC         self.docs_dir = docs_dir
+# MAGIC         self.index_dir = index_dir or os.path.join(docs_dir, ".bm25_index")
+# MAGIC         self.chunk_words = chunk_words
+# MAGIC         self.refresh_seconds = refresh_seconds
+# MAGIC         self._lock = threading.Lock()
+# MAGIC         # Held by the background refresh thread, so at most one runs at a time
+# MAGIC         self._refreshing = threading.Lock()
+# MAGIC         self._last_checked = 0.0
+# MAGIC         os.makedirs(self.index_dir, exist_ok=True)
+# MAGIC         self._files = self._read_json("files.json", {})
+# MAGIC         self._index = self._load_arrays()
+# MAGIC         self.refresh()
+# MAGIC
+# MAGIC     @classmethod
+# MAGIC     def tokenize(cls, text: str) -> list[str]:
+# MAGIC         return cls._TOKEN_RE.findall(text.lower())
+# MAGIC
+# MAGIC     def _read_json(self, name: str, default):
+# MAGIC         try:
+# MAGIC             with open(os.path.join(self.index_dir, name)) as f:
+# MAGIC                 return json.load(f)
+# MAGIC         except (OSError, ValueError):
+# MAGIC             return default
+# MAGIC
+# MAGIC     def _write_json(self, name: str, value) -> None:
+# MAGIC         path = os.path.join(self.index_dir, name)
+# MAGIC         with open(f"{path}.tmp", "w") as f:
+# MAGIC             json.dump(value, f)
+# MAGIC         os.replace(f"{path}.tmp", path)
+# MAGIC
+# MAGIC     def _load_arrays(self) -> Optional[dict]:
+# MAGIC         vocab = self._read_json("vocab.json", None)
+# MAGIC         chunks = self._read_json("chunks.json", None)
+# MAGIC         if vocab is None or chunks is None:
+# MAGIC             return None
+# MAGIC         try:
+# MAGIC             arrays = {
+# MAGIC                 name: np.load(os.path.join(self.index_dir, f"{name}.npy"), mmap_mode="r")
+# MAGIC                 for name in ("term_offsets", "postings_chunk", "postings_tf", "idf", "chunk_norm")
+# MAGIC             }
+# MAGIC         except (OSError, ValueError):
+# MAGIC             return None
+# MAGIC         return {"vocab": vocab, "chunks": chunks, **arrays}
+# MAGIC
+# MAGIC     def _chunk_file(self, path: str) -> list[dict]:
+# MAGIC         with open(path, encoding="utf-8", errors="replace") as f:
+# MAGIC             paragraphs = [p.strip() for p in re.split(r"\n\s*\n", f.read()) if p.strip()]
+# MAGIC         chunks, current, n_words = [], [], 0
+# MAGIC         for paragraph in paragraphs:
+# MAGIC             current.append(paragraph)
+# MAGIC             n_words += len(paragraph.split())
+# MAGIC             if n_words >= self.chunk_words:
+# MAGIC                 chunks.append("\n\n".join(current))
+# MAGIC                 current, n_words = [], 0
+# MAGIC         if current:
+# MAGIC             chunks.append("\n\n".join(current))
+# MAGIC         return [{"text": text, "terms": dict(Counter(self.tokenize(text)))} for text in chunks]
+# MAGIC
+# MAGIC     def refresh(self) -> dict:
+# MAGIC         """Re-read new or changed files, drop deleted ones and rebuild the postings if anything changed."""
+# MAGIC         with self._lock:
+# MAGIC             self._last_checked = time.monotonic()
+# MAGIC             seen, changed = set(), {"added": 0, "updated": 0, "removed": 0}
+# MAGIC             for root, dirs, files in os.walk(self.docs_dir):
+# MAGIC                 dirs[:] = [d for d in dirs if not d.startswith(".")]
+# MAGIC                 for name in files:
+# MAGIC                     if not name.lower().endswith(LOCAL_DOCS_EXTENSIONS):
+# MAGIC                         continue
+# MAGIC                     path = os.path.join(root, name)
+# MAGIC                     rel_path = os.path.relpath(path, self.docs_dir)
+# MAGIC                     stat = os.stat(path)
+# MAGIC                     seen.add(rel_path)
+# MAGIC                     entry = self._files.get(rel_path)
+# MAGIC                     if entry and entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+# MAGIC                         continue
+# MAGIC                     changed["updated" if entry else "added"] += 1
+# MAGIC                     self._files[rel_path] = {
+# MAGIC                         "mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "chunks": self._chunk_file(path)
+# MAGIC                     }
+# MAGIC             for rel_path in set(self._files) - seen:
+# MAGIC                 del self._files[rel_path]
+# MAGIC                 changed["removed"] += 1
+# MAGIC             if any(changed.values()) or self._index is None:
+# MAGIC                 self._write_json("files.json", self._files)
+# MAGIC                 self._build()
+# MAGIC             return changed
+# MAGIC
+# MAGIC     def _build(self) -> None:
+# MAGIC         chunks = [
+# MAGIC             {"source": rel_path, "text": chunk["text"], "terms": chunk["terms"]}
+# MAGIC             for rel_path, entry in sorted(self._files.items())
+# MAGIC             for chunk in entry["chunks"]
+# MAGIC         ]
+# MAGIC         vocab: dict[str, int] = {}
+# MAGIC         for chunk in chunks:
+# MAGIC             for term in chunk["terms"]:
+# MAGIC                 vocab.setdefault(term, len(vocab))
+# MAGIC
+# MAGIC         # Group (term, chunk, tf) triples by term to get per-term posting lists
+# MAGIC         triples = [(vocab[t], i, tf) for i, chunk in enumerate(chunks) for t, tf in chunk["terms"].items()]
+# MAGIC         postings = np.array(triples, dtype=np.float64).reshape(-1, 3)
+# MAGIC         postings = postings[np.argsort(postings[:, 0], kind="stable")]
+# MAGIC         doc_freq = np.bincount(postings[:, 0].astype(np.int64), minlength=len(vocab))
+# MAGIC         chunk_len = np.array([sum(c["terms"].values()) for c in chunks], dtype=np.float64)
+# MAGIC         avg_len = chunk_len.mean() if len(chunks) else 1.0
+# MAGIC
+# MAGIC         arrays = {
+# MAGIC             "term_offsets": np.concatenate([[0], np.cumsum(doc_freq)]).astype(np.int64),
+# MAGIC             "postings_chunk": postings[:, 1].astype(np.int32),
+# MAGIC             "postings_tf": postings[:, 2].astype(np.float32),
+# MAGIC             "idf": np.log1p((len(chunks) - doc_freq + 0.5) / (doc_freq + 0.5)).astype(np.float32),
+# MAGIC             # Length normalisation of the BM25 denominator, precomputed per chunk
+# MAGIC             "chunk_norm": (self.K1 * (1 - self.B + self.B * chunk_len / max(avg_len, 1.0))).astype(np.float32),
+# MAGIC         }
+# MAGIC         for name, array in arrays.items():
+# MAGIC             with open(os.path.join(self.index_dir, f"{name}.npy.tmp"), "wb") as f:
+# MAGIC                 np.save(f, array)
+# MAGIC             os.replace(os.path.join(self.index_dir, f"{name}.npy.tmp"), os.path.join(self.index_dir, f"{name}.npy"))
+# MAGIC         self._write_json("vocab.json", vocab)
+# MAGIC         self._write_json("chunks.json", [{"source": c["source"], "text": c["text"]} for c in chunks])
+# MAGIC         self._index = self._load_arrays()
+# MAGIC
+# MAGIC     def version(self) -> str:
+# MAGIC         """Hash of the indexed files (path, size and modification time), for the agent fingerprint."""
+# MAGIC         with self._lock:
+# MAGIC             files = sorted((rel_path, entry["size"], entry["mtime_ns"]) for rel_path, entry in self._files.items())
+# MAGIC         return hashlib.sha256(json.dumps(files).encode("utf-8")).hexdigest()
+# MAGIC
+# MAGIC     def refresh_in_background(self) -> bool:
+# MAGIC         """Start a refresh on a background thread unless one is running; returns whether it started."""
+# MAGIC         if not self._refreshing.acquire(blocking=False):
+# MAGIC             return False
+# MAGIC         self._last_checked = time.monotonic()
+# MAGIC
+# MAGIC         def run():
+# MAGIC             try:
+# MAGIC                 self.refresh()
+# MAGIC             except Exception as e:
+# MAGIC                 print(f"Refreshing the document index of {self.docs_dir} failed: {e}")
+# MAGIC             finally:
+# MAGIC                 self._refreshing.release()
+# MAGIC
+# MAGIC         threading.Thread(target=run, name="local-docs-refresh", daemon=True).start()
+# MAGIC         return True
+# MAGIC
+# MAGIC     def search(self, query: str, top_k: int = LOCAL_DOCS_TOP_K) -> list[dict]:
+# MAGIC         if time.monotonic() - self._last_checked >= self.refresh_seconds:
+# MAGIC             self.refresh_in_background()
+# MAGIC         # One read of the reference: a refresh swaps in a whole new index, never edits this one
+# MAGIC         index = self._index
+# MAGIC         if not index or not index["chunks"]:
+# MAGIC             return []
+# MAGIC         scores = np.zeros(len(index["chunks"]), dtype=np.float32)
+# MAGIC         for term in set(self.tokenize(query)):
+# MAGIC             term_id = index["vocab"].get(term)
+# MAGIC             if term_id is None:
+# MAGIC                 continue
+# MAGIC             start, end = index["term_offsets"][term_id], index["term_offsets"][term_id + 1]
+# MAGIC             chunk_ids, tf = index["postings_chunk"][start:end], index["postings_tf"][start:end]
+# MAGIC             scores[chunk_ids] += index["idf"][term_id] * tf * (self.K1 + 1) / (tf + index["chunk_norm"][chunk_ids])
+# MAGIC         top_k = min(top_k, int(np.count_nonzero(scores)))
+# MAGIC         if top_k == 0:
+# MAGIC             return []
+# MAGIC         top = np.argpartition(-scores, top_k - 1)[:top_k]
+# MAGIC         top = top[np.argsort(-scores[top])]
+# MAGIC         return [
+# MAGIC             {"source": index["chunks"][i]["source"], "score": round(float(scores[i]), 3), "text": index["chunks"][i]["text"]}
+# MAGIC             for i in top
+# MAGIC         ]
+# MAGIC
+# MAGIC
+# MAGIC def create_local_docs_tool(index: LocalDocumentIndex) -> ToolInfo:
+# MAGIC     spec = {
+# MAGIC         "type": "function",
+# MAGIC         "function": {
+# MAGIC             "name": "search_product_documents",
+# MAGIC             "description": "Search the bank's product sheets and standard operating procedures (SOPs). "
+# MAGIC                            "Use for product features, eligibility, charges, compliance and process questions.",
+# MAGIC             "parameters": {
+# MAGIC                 "type": "object",
+# MAGIC                 "properties": {
+# MAGIC                     "query": {"type": "string", "description": "What to look for, in keywords or a short question"},
+# MAGIC                     "top_k": {"type": "integer", "description": "Number of passages to return (default 5)"},
+# MAGIC                 },
+# MAGIC                 "required": ["query"],
+# MAGIC             },
+# MAGIC         },
+# MAGIC     }
+# MAGIC
+# MAGIC     def search(query: str, top_k: int = LOCAL_DOCS_TOP_K):
+# MAGIC         return json.dumps(index.search(query, top_k))
+# MAGIC
+# MAGIC     return create_tool_info(spec, search)
+# MAGIC
+# MAGIC
+# MAGIC LOCAL_DOCS_INDEX = None
+# MAGIC if LOCAL_DOCS_DIR and os.path.isdir(LOCAL_DOCS_DIR):
+# MAGIC     LOCAL_DOCS_INDEX = LocalDocumentIndex(LOCAL_DOCS_DIR, LOCAL_DOCS_INDEX_DIR)
+# MAGIC     TOOL_INFOS.append(create_local_docs_tool(LOCAL_DOCS_INDEX))
+# MAGIC
+# MAGIC
+# MAGIC
+# MAGIC class ToolResultCache:
+# MAGIC     """
+# MAGIC     Thread-safe LRU cache of tool results with a per-entry TTL, keyed by
+# MAGIC     (tool name, canonicalized arguments, caller identity)
+# MAGIC     """
+# MAGIC
+# MAGIC     def __init__(self, max_entries: int = TOOL_CACHE_MAX_ENTRIES):
+# MAGIC         self.max_entries = max_entries
+# MAGIC         self._entries: OrderedDict = OrderedDict()
+# MAGIC         self._lock = threading.Lock()
+# MAGIC
+# MAGIC     @staticmethod
+# MAGIC     def make_key(tool_name: str, args: dict, caller: Optional[str]) -> tuple:
+# MAGIC         canonical_args = json.dumps(
+# MAGIC             {k: " ".join(v.split()) if isinstance(v, str) else v for k, v in args.items()},
+# MAGIC             sort_keys=True,
+# MAGIC             default=str,
+# MAGIC         )
+# MAGIC         return tool_name, canonical_args, caller
+# MAGIC
+# MAGIC     def get(self, key: tuple) -> tuple[bool, Any]:
+# MAGIC         with self._lock:
+# MAGIC             entry = self._entries.get(key)
+# MAGIC             if entry is None:
+# MAGIC                 return False, None
+# MAGIC             value, expires_at = entry
+# MAGIC             if time.monotonic() >= expires_at:
+# MAGIC                 del self._entries[key]
+# MAGIC                 return False, None
+# MAGIC             self._entries.move_to_end(key)
+# MAGIC             return True, value
+# MAGIC
+# MAGIC     def put(self, key: tuple, value: Any, ttl_seconds: float) -> None:
+# MAGIC         with self._lock:
+# MAGIC             self._entries[key] = (value, time.monotonic() + ttl_seconds)
+# MAGIC             self._entries.move_to_end(key)
+# MAGIC             while len(self._entries) > self.max_entries:
+# MAGIC                 self._entries.popitem(last=False)
+# MAGIC
+# MAGIC
+# MAGIC class ToolOutputCompactor:
+# MAGIC     """
+# MAGIC     Shrinks large tool outputs to a token budget before they are added to the message history.
+# MAGIC     Tabular outputs (UC table results, JSON records, CSV, or the row list embedded in a Genie
+# MAGIC     answer) become schema + row count + per-column aggregates + the first rows; other text keeps
+# MAGIC     its head and tail. Full outputs are kept in a bounded in-memory store under a result id.
+# MAGIC     """
+# MAGIC
+# MAGIC     _PY_LITERAL_FIXES = [
+# MAGIC         (re.compile(r"datetime\.date\((\d+), (\d+), (\d+)\)"), lambda m: repr(f"{int(m[1]):04d}-{int(m[2]):02d}-{int(m[3]):02d}")),
+# MAGIC         (re.compile(r"datetime\.datetime\(([\d, ]+)\)"), lambda m: repr("-".join(m[1].split(", ")[:3]))),
+# MAGIC         (re.compile(r"Decimal\('([^']*)'\)"), lambda m: m[1]),
+# MAGIC     ]
+# MAGIC
+# MAGIC     def __init__(self, max_results: int = TOOL_OUTPUT_STORE_SIZE):
+# MAGIC         self.max_results = max_results
+# MAGIC         self._results: OrderedDict = OrderedDict()
+# MAGIC         self._lock = threading.Lock()
+# MAGIC
+# MAGIC     def get(self, result_id: str) -> Optional[str]:
+# MAGIC         with self._lock:
+# MAGIC             return self._results.get(result_id)
+# MAGIC
+# MAGIC     def _store(self, output: str) -> str:
+# MAGIC         result_id = f"tr_{uuid4().hex[:12]}"
+# MAGIC         with self._lock:
+# MAGIC             self._results[result_id] = output
+# MAGIC             while len(self._results) > self.max_results:
+# MAGIC                 self._results.popitem(last=False)
+# MAGIC         return result_id
+# MAGIC
+# MAGIC     def compact(self, output: str, token_budget: Optional[int]) -> str:
+# MAGIC         if token_budget is None or len(output) <= token_budget * CHARS_PER_TOKEN:
+# MAGIC             return output
+# MAGIC         budget_chars = token_budget * CHARS_PER_TOKEN
+# MAGIC         result_id = self._store(output)
+# MAGIC         footer = (
+# MAGIC             f"\n[Compacted from {len(output)} characters. Full result id: {result_id}; "
+# MAGIC             f"call fetch_tool_result to read more of it.]"
+# MAGIC         )
+# MAGIC         prefix, rows, suffix = self._extract_rows(output)
+# MAGIC         if rows:
+# MAGIC             summary = self._summarize_rows(rows, budget_chars - len(footer) - min(len(prefix), budget_chars // 4))
+# MAGIC             body = self._truncate(prefix, budget_chars // 4) + summary + self._truncate(suffix, 200)
+# MAGIC         else:
+# MAGIC             body = self._truncate(output, budget_chars - len(footer))
+# MAGIC         return self._truncate(body, budget_chars - len(footer)) + footer
+# MAGIC
+# MAGIC     @staticmethod
+# MAGIC     def _truncate(text: str, limit: int) -> str:
+# MAGIC         if len(text) <= limit:
+# MAGIC             return text
+# MAGIC         head = max(0, int(limit * 0.7))
+# MAGIC         tail = max(0, limit - head - 40)
+# MAGIC         return f"{text[:head]}\n... [{len(text) - head - tail} characters omitted] ...\n{text[len(text) - tail:] if tail else ''}"
+# MAGIC
+# MAGIC     def _extract_rows(self, output: str) -> tuple[str, list[dict], str]:
+# MAGIC         """Finds tabular data in a tool output; returns (text before, rows, text after)."""
+# MAGIC         try:
+# MAGIC             parsed = json.loads(output)
+# MAGIC         except ValueError:
+# MAGIC             parsed = None
+# MAGIC         if isinstance(parsed, dict) and "columns" in parsed and "rows" in parsed:
+# MAGIC             rows = [dict(zip(parsed["columns"], row)) for row in parsed["rows"]]
+# MAGIC             if len(rows) == 1 and len(parsed["columns"]) == 1 and isinstance(rows[0][parsed["columns"][0]], str):
+# MAGIC                 # Single text cell (e.g. a Genie answer) - look for rows inside the text
+# MAGIC                 return self._extract_rows(rows[0][parsed["columns"][0]])
+# MAGIC             return "", rows, ""
+# MAGIC         if isinstance(parsed, list) and parsed and all(isinstance(r, dict) for r in parsed):
+# MAGIC             return "", parsed, ""
+# MAGIC
+# MAGIC         match = re.search(r"SQL Query Result: (\[.*\])", output, flags=re.DOTALL)
+# MAGIC         if match:
+# MAGIC             literal = match.group(1)
+# MAGIC             for pattern, replacement in self._PY_LITERAL_FIXES:
+# MAGIC                 literal = pattern.sub(replacement, literal)
+# MAGIC             try:
+# MAGIC                 rows = ast.literal_eval(literal)
+# MAGIC             except (ValueError, SyntaxError):
+# MAGIC                 rows = None
+# MAGIC             if isinstance(rows, list) and rows and all(isinstance(r, dict) for r in rows):
+# MAGIC                 return output[: match.start(1)], rows, output[match.end(1):]
+# MAGIC
+# MAGIC         lines = output.strip().splitlines()
+# MAGIC         if len(lines) > 2 and "," in lines[0] and len({line.count(",") for line in lines[:5]}) == 1:
+# MAGIC             return "", list(csv.DictReader(io.StringIO(output.strip()))), ""
+# MAGIC         return output, [], ""
+# MAGIC
+# MAGIC     @staticmethod
+# MAGIC     def _summarize_rows(rows: list[dict], budget_chars: int) -> str:
+# MAGIC         columns = list(rows[0].keys())
+# MAGIC         lines = [f"Rows: {len(rows)}", "Columns:"]
+# MAGIC         for column in columns:
+# MAGIC             values = [r.get(column) for r in rows if r.get(column) not in (None, "")]
+# MAGIC             numbers = []
+# MAGIC             for v in values:
+# MAGIC                 try:
+# MAGIC                     numbers.append(float(v))
+# MAGIC                 except (TypeError, ValueError):
+# MAGIC                     break
+# MAGIC             if values and len(numbers) == len(values):
+# MAGIC                 lines.append(
+# MAGIC                     f"- {column} (numeric): min {min(numbers):g}, max {max(numbers):g}, "
+# MAGIC                     f"mean {statistics.fmean(numbers):g}, sum {sum(numbers):g}"
+# MAGIC                 )
+# MAGIC             else:
+# MAGIC                 distinct = {str(v) for v in values}
+# MAGIC                 sample = ", ".join(sorted(distinct)[:3])
+# MAGIC                 lines.append(f"- {column} (text): {len(distinct)} distinct, e.g. {sample}")
+# MAGIC         summary = "\n".join(lines)
+# MAGIC
+# MAGIC         n_rows = min(TOOL_OUTPUT_HEAD_ROWS, len(rows))
+# MAGIC         while True:
+# MAGIC             buffer = io.StringIO()
+# MAGIC             writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction="ignore")
+# MAGIC             writer.writeheader()
+# MAGIC             writer.writerows(rows[:n_rows])
+# MAGIC             head = f"\nFirst {n_rows} rows:\n{buffer.getvalue()}"
+# MAGIC             if n_rows <= 1 or len(summary) + len(head) <= budget_chars:
+# MAGIC                 return summary + head
+# MAGIC             n_rows //= 2
+# MAGIC
+# MAGIC
+# MAGIC def agent_code_version() -> str:
+# MAGIC     """
+# MAGIC     Hash of this module's source and of its behaviour settings, including the ones read from the
+# MAGIC     environment (loop limits, tool timeouts, token budgets, prefetch and document settings)
+# MAGIC     """
+# MAGIC     digest = hashlib.sha256()
+# MAGIC     try:
+# MAGIC         with open(__file__, "rb") as f:
+# MAGIC             digest.update(f.read())
+# MAGIC     except (NameError, OSError):
+# MAGIC         # Defined in a notebook rather than imported from agent.py; the settings still count
+# MAGIC         pass
+# MAGIC     settings = {}
+# MAGIC     for name, value in sorted(globals().items()):
+# MAGIC         if not name.startswith(FINGERPRINT_SETTING_PREFIXES):
+# MAGIC             continue
+# MAGIC         try:
+# MAGIC             # Objects such as TOOL_INFOS have no stable text form and are covered elsewhere
+# MAGIC             settings[name] = json.dumps(value, sort_keys=True)
+# MAGIC         except TypeError:
+# MAGIC             continue
+# MAGIC     digest.update(json.dumps(settings, sort_keys=True).encode("utf-8"))
+# MAGIC     return digest.hexdigest()
+# MAGIC
+# MAGIC
+# MAGIC class PredictionCache:
+# MAGIC     """
+# MAGIC     Agent responses stored as one JSON file per request, keyed by a hash of the request and of
+# MAGIC     everything that changes the agent's behaviour (see ToolCallingAgent.fingerprint)
+# MAGIC     """
+# MAGIC
+# MAGIC     def __init__(self, directory: str = PREDICTION_CACHE_DIR):
+# MAGIC         self.directory = directory
+# MAGIC         os.makedirs(directory, exist_ok=True)
+# MAGIC
+# MAGIC     @staticmethod
+# MAGIC     def make_key(agent_fingerprint: str, request: dict) -> str:
+# MAGIC         canonical = json.dumps(request, sort_keys=True, default=str)
+# MAGIC         return hashlib.sha256(f"{agent_fingerprint}\n{canonical}".encode("utf-8")).hexdigest()
+# MAGIC
+# MAGIC     def _path(self, key: str) -> str:
+# MAGIC         return os.path.join(self.directory, f"{key}.json")
+# MAGIC
+# MAGIC     def get(self, key: str) -> Optional[dict]:
+# MAGIC         try:
+# MAGIC             with open(self._path(key)) as f:
+# MAGIC                 return json.load(f)
+# MAGIC         except (OSError, ValueError):
+# MAGIC             return None
+# MAGIC
+# MAGIC     def put(self, key: str, response: dict) -> None:
+# MAGIC         # Written to a temp file first so a concurrent reader never sees a partial prediction
+# MAGIC         tmp_path = f"{self._path(key)}.{uuid4().hex}.tmp"
+# MAGIC         with open(tmp_path, "w") as f:
+# MAGIC             json.dump(response, f, default=str)
+# MAGIC         os.replace(tmp_path, self._path(key))
+# MAGIC
+# MAGIC
+# MAGIC class CustomerNameIndex:
+# MAGIC     """In-memory index from full customer names (as lowercase word sequences) and customer IDs to names."""
+# MAGIC
+# MAGIC     _WORD_RE = re.compile(r"[a-z]+")
+# MAGIC     _ID_RE = re.compile(r"\b(?:customer\s*id|cust\s*id|id)\s*[:#-]?\s*(\d+)\b", re.IGNORECASE)
+# MAGIC
+# MAGIC     def __init__(self, customers: list[tuple[Any, str]]):
+# MAGIC         self._by_words: dict[tuple[str, ...], str] = {}
+# MAGIC         self._by_id: dict[str, str] = {}
+# MAGIC         for customer_id, name in customers:
+# MAGIC             words = tuple(self._WORD_RE.findall(str(name).lower()))
+# MAGIC             # Single words (first names only) match too many messages to be worth a speculative call
+# MAGIC             if len(words) >= 2:
+# MAGIC                 self._by_words[words] = name
+# MAGIC             self._by_id[str(customer_id)] = name
+# MAGIC         self.max_words = max((len(w) for w in self._by_words), default=0)
+# MAGIC
+# MAGIC     def __len__(self) -> int:
+# MAGIC         return len(self._by_id)
+# MAGIC
+# MAGIC     def find(self, text: str, limit: int = PREFETCH_MAX_CUSTOMERS) -> list[str]:
+# MAGIC         """Customer names mentioned in `text`, those referenced by ID first, then by full name in order of appearance."""
+# MAGIC         found = [self._by_id[m] for m in self._ID_RE.findall(text) if m in self._by_id]
+# MAGIC         words = self._WORD_RE.findall(text.lower())
+# MAGIC         i = 0
+# MAGIC         while i < len(words) and len(found) < limit:
+# MAGIC             for n in range(min(self.max_words, len(words) - i), 1, -1):
+# MAGIC                 name = self._by_words.get(tuple(words[i:i + n]))
+# MAGIC                 if name is not None:
+# MAGIC                     found.append(name)
+# MAGIC                     i += n - 1
+# MAGIC                     break
+# MAGIC             i += 1
+# MAGIC         return list(dict.fromkeys(found))[:limit]
+# MAGIC
+# MAGIC
+# MAGIC def load_customer_name_index() -> Optional[CustomerNameIndex]:
+# MAGIC     try:
+# MAGIC         if CUSTOMER_NAMES_CSV:
+# MAGIC             with open(CUSTOMER_NAMES_CSV, newline="") as f:
+# MAGIC                 rows = [(row["CustomerID"], row["Name"]) for row in csv.DictReader(f)]
+# MAGIC         elif CUSTOMER_NAMES_WAREHOUSE_ID:
+# MAGIC             result = WorkspaceClient().statement_execution.execute_statement(
+# MAGIC                 statement=CUSTOMER_NAMES_QUERY, warehouse_id=CUSTOMER_NAMES_WAREHOUSE_ID, wait_timeout="30s"
+# MAGIC             )
+# MAGIC             rows = [(row[0], row[1]) for row in (result.result.data_array or [])]
+# MAGIC         else:
+# MAGIC             return None
+# MAGIC     except Exception as e:
+# MAGIC         print(f"Customer prefetch disabled, could not load customer names: {e}")
+# MAGIC         return None
+# MAGIC     return CustomerNameIndex(rows)
+# MAGIC
+# MAGIC
+# MAGIC class PrefetchStats:
+# MAGIC     """Counts speculative lookups and how much latency the used ones saved."""
+# MAGIC
+# MAGIC     def __init__(self):
+# MAGIC         self._lock = threading.Lock()
+# MAGIC         self.issued = 0
+# MAGIC         self.hits = 0
+# MAGIC         self.timed_out = 0
+# MAGIC         self.saved_seconds = 0.0
+# MAGIC
+# MAGIC     def record_issued(self, n: int) -> None:
+# MAGIC         with self._lock:
+# MAGIC             self.issued += n
+# MAGIC
+# MAGIC     def record_hit(self, saved_seconds: float) -> None:
+# MAGIC         with self._lock:
+# MAGIC             self.hits += 1
+# MAGIC             self.saved_seconds += saved_seconds
+# MAGIC
+# MAGIC     def record_timed_out(self) -> None:
+# MAGIC         with self._lock:
+# MAGIC             self.timed_out += 1
+# MAGIC
+# MAGIC     def snapshot(self) -> dict:
+# MAGIC         with self._lock:
+# MAGIC             return {
+# MAGIC                 "issued": self.issued,
+# MAGIC                 "hits": self.hits,
+# MAGIC                 "hit_rate": round(self.hits / self.issued, 3) if self.issued else 0.0,
+# MAGIC                 "timed_out": self.timed_out,
+# MAGIC                 "saved_seconds": round(self.saved_seconds, 3),
+# MAGIC             }
+# MAGIC
+# MAGIC
+# MAGIC class ToolPool(Executor):
+# MAGIC     """
+# MAGIC     Bounded thread pool for tool calls that survives hung tools. A running thread cannot be stopped,
+# MAGIC     so a call that misses its deadline keeps its worker; abandon() then retires the pool it runs on:
+# MAGIC     new calls go to a fresh pool and the old one shuts down once its calls return. Submits made while
+# MAGIC     every worker is busy are counted as saturated.
+# MAGIC     """
+# MAGIC
+# MAGIC     def __init__(self, max_workers: int, thread_name_prefix: str):
+# MAGIC         self.max_workers = max_workers
+# MAGIC         self.thread_name_prefix = thread_name_prefix
+# MAGIC         self._lock = threading.Lock()
+# MAGIC         self._pool = self._new_pool()
+# MAGIC         self._in_flight = {self._pool: 0}
+# MAGIC         self._owners = {}
+# MAGIC         self.saturated_submits = 0
+# MAGIC         self.replaced_pools = 0
+# MAGIC
+# MAGIC     def _new_pool(self) -> ThreadPoolExecutor:
+# MAGIC         return ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.thread_name_prefix)
+# MAGIC
+# MAGIC     def saturated(self) -> bool:
+# MAGIC         with self._lock:
+# MAGIC             return self._in_flight[self._pool] >= self.max_workers
+# MAGIC
+# MAGIC     def submit(self, fn, /, *args, **kwargs):
+# MAGIC         with self._lock:
+# MAGIC             pool = self._pool
+# MAGIC             if self._in_flight[pool] >= self.max_workers:
+# MAGIC                 self.saturated_submits += 1
+# MAGIC             self._in_flight[pool] += 1
+# MAGIC             future = pool.submit(fn, *args, **kwargs)
+# MAGIC             self._owners[future] = pool
+# MAGIC         future.add_done_callback(self._release)
+# MAGIC         return future
+# MAGIC
+# MAGIC     def _release(self, future) -> None:
+# MAGIC         with self._lock:
+# MAGIC             pool = self._owners.pop(future)
+# MAGIC             self._in_flight[pool] -= 1
+# MAGIC             if pool is not self._pool and not self._in_flight[pool]:
+# MAGIC                 del self._in_flight[pool]
+# MAGIC
+# MAGIC     def abandon(self, future) -> bool:
+# MAGIC         """Give up on a call that missed its deadline. Returns True if its pool had to be replaced."""
+# MAGIC         if future.cancel():
+# MAGIC             return False
+# MAGIC         with self._lock:
+# MAGIC             pool = self._owners.get(future)
+# MAGIC             if pool is not self._pool:
+# MAGIC                 # Already finished, or its pool was retired before
+# MAGIC                 return False
+# MAGIC             self._pool = self._new_pool()
+# MAGIC             self._in_flight[self._pool] = 0
+# MAGIC             self.replaced_pools += 1
+# MAGIC         pool.shutdown(wait=False)
+# MAGIC         return True
+# MAGIC
+# MAGIC     def shutdown(self, wait: bool = True, *, cancel_futures: bool = False) -> None:
+# MAGIC         with self._lock:
+# MAGIC             pools = list(self._in_flight)
+# MAGIC         for pool in pools:
+# MAGIC             pool.shutdown(wait=wait, cancel_futures=cancel_futures)
+# MAGIC
+# MAGIC     def snapshot(self) -> dict:
+# MAGIC         with self._lock:
+# MAGIC             return {
+# MAGIC                 "in_flight": self._in_flight[self._pool],
+# MAGIC                 "retired_pools_in_flight": sum(n for pool, n in self._in_flight.items() if pool is not self._pool),
+# MAGIC                 "saturated_submits": self.saturated_submits,
+# MAGIC                 "replaced_pools": self.replaced_pools,
+# MAGIC             }
+# MAGIC
+# MAGIC
+# MAGIC class LoopState:
+# MAGIC     """Per-request bookkeeping of the agent loop: tool results by call, progress and monitoring counters."""
+# MAGIC
+# MAGIC     def __init__(self):
+# MAGIC         self.started = time.monotonic()
+# MAGIC         self.iterations = 0
+# MAGIC         self.llm_calls = 0
+# MAGIC         self.tool_calls = 0
+# MAGIC         self.deduplicated_tool_calls = 0
+# MAGIC         self.prompt_tokens = 0
+# MAGIC         self.completion_tokens = 0
+# MAGIC         self.stalled_turns = 0
+# MAGIC         self.stop_reason = "answered"
+# MAGIC         self.results: dict[str, str] = {}
+# MAGIC
+# MAGIC     @staticmethod
+# MAGIC     def call_key(tool_call: dict[str, Any]) -> str:
+# MAGIC         try:
+# MAGIC             arguments = json.dumps(json.loads(tool_call["arguments"] or "{}"), sort_keys=True)
+# MAGIC         except ValueError:
+# MAGIC             arguments = tool_call["arguments"]
+# MAGIC         return f"{tool_call['name']}:{arguments}"
+# MAGIC
+# MAGIC     def _count_prompt(self, messages: list[dict[str, Any]]) -> None:
+# MAGIC         self.llm_calls += 1
+# MAGIC         self.prompt_tokens += len(json.dumps(messages, default=str)) // CHARS_PER_TOKEN
+# MAGIC
+# MAGIC     def _count_chunk(self, chunk: dict[str, Any], completion_chars: int) -> int:
+# MAGIC         for choice in chunk.get("choices") or []:
+# MAGIC             delta = choice.get("delta") or {}
+# MAGIC             completion_chars += len(delta.get("content") or "")
+# MAGIC             for tool_call in delta.get("tool_calls") or []:
+# MAGIC                 completion_chars += len((tool_call.get("function") or {}).get("arguments") or "")
+# MAGIC         return completion_chars
+# MAGIC
+# MAGIC     def count_llm_call(self, messages: list[dict[str, Any]], chunks: Generator) -> Generator:
+# MAGIC         """Passes the LLM chunks through, estimating tokens at CHARS_PER_TOKEN."""
+# MAGIC         self._count_prompt(messages)
+# MAGIC         completion_chars = 0
+# MAGIC         for chunk in chunks:
+# MAGIC             completion_chars = self._count_chunk(chunk, completion_chars)
+# MAGIC             yield chunk
+# MAGIC         self.completion_tokens += completion_chars // CHARS_PER_TOKEN
+# MAGIC
+# MAGIC     async def acount_llm_call(self, messages: list[dict[str, Any]], chunks: AsyncGenerator) -> AsyncGenerator:
+# MAGIC         self._count_prompt(messages)
+# MAGIC         completion_chars = 0
+# MAGIC         async for chunk in chunks:
+# MAGIC             completion_chars = self._count_chunk(chunk, completion_chars)
+# MAGIC             yield chunk
+# MAGIC         self.completion_tokens += completion_chars // CHARS_PER_TOKEN
+# MAGIC
+# MAGIC     def metrics(self) -> dict[str, Any]:
+# MAGIC         return {
+# MAGIC             "agent.iterations": self.iterations,
+# MAGIC             "agent.llm_calls": self.llm_calls,
+# MAGIC             "agent.tool_calls": self.tool_calls,
+# MAGIC             "agent.deduplicated_tool_calls": self.deduplicated_tool_calls,
+# MAGIC             "agent.estimated_prompt_tokens": self.prompt_tokens,
+# MAGIC             "agent.estimated_completion_tokens": self.completion_tokens,
+# MAGIC             "agent.latency_ms": round((time.monotonic() - self.started) * 1000),
+# MAGIC             "agent.stop_reason": self.stop_reason,
+# MAGIC         }
+# MAGIC
+# MAGIC
+# MAGIC # Speculative tool calls started for the current request: prefetch key -> (future, start time)
+# MAGIC _prefetched_calls: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("prefetched_calls", default=None)
+# MAGIC
+# MAGIC # Identity of the caller of the current request, used to scope cached tool results
+# MAGIC _caller_identity: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("caller_identity", default=None)
+# MAGIC
 # MAGIC
 # MAGIC class ToolCallingAgent(ResponsesAgent):
 # MAGIC     """
 # MAGIC     Class representing a tool-calling Agent
 # MAGIC     """
 # MAGIC
-# MAGIC     def __init__(self, llm_endpoint: str, tools: list[ToolInfo]):
+# MAGIC     def __init__(
+# MAGIC         self,
+# MAGIC         llm_endpoint: str,
+# MAGIC         tools: list[ToolInfo],
+# MAGIC         model_serving_client: Optional[OpenAI] = None,
+# MAGIC         customer_index: Optional[CustomerNameIndex] = None,
+# MAGIC     ):
 # MAGIC         """Initializes the ToolCallingAgent with tools."""
 # MAGIC         self.llm_endpoint = llm_endpoint
-# MAGIC         self.workspace_client = WorkspaceClient()
+# MAGIC         # A client can be passed in (e.g. a scripted fake for benchmarks) to run without a workspace
+# MAGIC         self.workspace_client = WorkspaceClient() if model_serving_client is None else None
 # MAGIC         self.model_serving_client: OpenAI = (
-# MAGIC             self.workspace_client.serving_endpoints.get_open_ai_client()
+# MAGIC             model_serving_client or self.workspace_client.serving_endpoints.get_open_ai_client()
 # MAGIC         )
 # MAGIC         self._tools_dict = {tool.name: tool for tool in tools}
+# MAGIC         self._tool_executor = ToolPool(MAX_PARALLEL_TOOLS, "agent-tool")
+# MAGIC         self._tool_cache = ToolResultCache()
+# MAGIC         self._tool_outputs = ToolOutputCompactor()
+# MAGIC         fetch_tool = self._fetch_tool_result_info()
+# MAGIC         self._tools_dict[fetch_tool.name] = fetch_tool
+# MAGIC         self.customer_index = customer_index
+# MAGIC         self.prefetch_stats = PrefetchStats()
+# MAGIC
+# MAGIC     def _fetch_tool_result_info(self) -> ToolInfo:
+# MAGIC         """In-process tool that lets the LLM page through a compacted tool output by its result id."""
+# MAGIC         spec = {
+# MAGIC             "type": "function",
+# MAGIC             "function": {
+# MAGIC                 "name": "fetch_tool_result",
+# MAGIC                 "description": "Read part of a tool result that was compacted, by its result id.",
+# MAGIC                 "parameters": {
+# MAGIC                     "type": "object",
+# MAGIC                     "properties": {
+# MAGIC                         "result_id": {"type": "string", "description": "Result id from the compaction note"},
+# MAGIC                         "offset": {"type": "integer", "description": "Character offset to start from"},
+# MAGIC                         "limit": {"type": "integer", "description": "Number of characters to return"},
+# MAGIC                     },
+# MAGIC                     "required": ["result_id"],
+# MAGIC                 },
+# MAGIC             },
+# MAGIC         }
+# MAGIC
+# MAGIC         def fetch(result_id: str, offset: int = 0, limit: int = DEFAULT_TOOL_OUTPUT_TOKEN_BUDGET * CHARS_PER_TOKEN):
+# MAGIC             output = self._tool_outputs.get(result_id)
+# MAGIC             if output is None:
+# MAGIC                 return ToolError(f"Unknown or expired result id {result_id}")
+# MAGIC             limit = min(limit, DEFAULT_TOOL_OUTPUT_TOKEN_BUDGET * CHARS_PER_TOKEN)
+# MAGIC             return f"[characters {offset}-{min(offset + limit, len(output))} of {len(output)}]\n{output[offset:offset + limit]}"
+# MAGIC
+# MAGIC         return ToolInfo(name="fetch_tool_result", spec=spec, exec_fn=fetch, output_token_budget=None)
 # MAGIC
 # MAGIC     def get_tool_specs(self) -> list[dict]:
 # MAGIC         """Returns tool specifications in the format OpenAI expects."""
@@ -147,10 +976,27 @@
 # MAGIC
 # MAGIC     @mlflow.trace(span_type=SpanType.TOOL)
 # MAGIC     def execute_tool(self, tool_name: str, args: dict) -> Any:
-# MAGIC         """Executes the specified tool with the given arguments."""
-# MAGIC         return self._tools_dict[tool_name].exec_fn(**args)
+# MAGIC         """Executes the specified tool with the given arguments, reusing a cached result when allowed."""
+# MAGIC         tool = self._tools_dict[tool_name]
+# MAGIC         caller = _caller_identity.get()
+# MAGIC         # Callers without an identity cannot be told apart, so they must not share results
+# MAGIC         if tool.cache_ttl_seconds is None or caller is None:
+# MAGIC             return tool.exec_fn(**args)
 # MAGIC
-# MAGIC     def call_llm(self, messages: list[dict[str, Any]]) -> Generator[dict[str, Any], None, None]:
+# MAGIC         key = ToolResultCache.make_key(tool_name, args, caller)
+# MAGIC         hit, result = self._tool_cache.get(key)
+# MAGIC         span = mlflow.get_current_active_span()
+# MAGIC         if span is not None:
+# MAGIC             span.set_attributes({"tool.cache_hit": hit, "tool.cache_ttl_seconds": tool.cache_ttl_seconds})
+# MAGIC         if not hit:
+# MAGIC             result = tool.exec_fn(**args)
+# MAGIC             if not isinstance(result, ToolError):
+# MAGIC                 self._tool_cache.put(key, result, tool.cache_ttl_seconds)
+# MAGIC         return result
+# MAGIC
+# MAGIC     def call_llm(
+# MAGIC         self, messages: list[dict[str, Any]], deadline: Optional[float] = None
+# MAGIC     ) -> Generator[dict[str, Any], None, None]:
 # MAGIC         with warnings.catch_warnings():
 # MAGIC             warnings.filterwarnings("ignore", message="PydanticSerializationUnexpectedValue")
 # MAGIC             for chunk in self.model_serving_client.chat.completions.create(
@@ -158,9 +1004,67 @@
 # MAGIC                 messages=self.prep_msgs_for_cc_llm(messages),
 # MAGIC                 tools=self.get_tool_specs(),
 # MAGIC                 stream=True,
+# MAGIC                 **self._llm_timeout_kwargs(deadline),
 # MAGIC             ):
 # MAGIC                 yield chunk.to_dict()
 # MAGIC
+# MAGIC     @staticmethod
+# MAGIC     def _llm_timeout_kwargs(deadline: Optional[float]) -> dict:
+# MAGIC         if deadline is None:
+# MAGIC             return {}
+# MAGIC         return {"timeout": max(1.0, deadline - time.monotonic())}
+# MAGIC
+# MAGIC     def _tool_deadline(self, tool_call: dict[str, Any], start: float, deadline: Optional[float]) -> float:
+# MAGIC         """When a tool call started at `start` must finish: its own timeout, capped by the request deadline."""
+# MAGIC         tool = self._tools_dict.get(tool_call["name"])
+# MAGIC         tool_deadline = start + (tool.timeout_seconds if tool else TOOL_TIMEOUT_SECONDS)
+# MAGIC         return tool_deadline if deadline is None else min(tool_deadline, deadline)
+# MAGIC
+# MAGIC     def _timed_out_output(self, tool_call: dict[str, Any], waited_seconds: float) -> str:
+# MAGIC         self._record_trace_event(
+# MAGIC             "tool_timeout", {"tool.name": tool_call["name"], "tool.waited_seconds": round(waited_seconds, 3)}
+# MAGIC         )
+# MAGIC         return json.dumps({
+# MAGIC             "status": "timed_out",
+# MAGIC             "tool": tool_call["name"],
+# MAGIC             "waited_seconds": round(waited_seconds, 1),
+# MAGIC             "message": "The tool did not respond in time. Answer with the information already available, "
+# MAGIC                        "or tell the user this data is temporarily unavailable.",
+# MAGIC         })
+# MAGIC
+# MAGIC     def _budget_exhausted_event(self, budget_seconds: float) -> ResponsesAgentStreamEvent:
+# MAGIC         self._record_trace_event("latency_budget_exhausted", {"agent.latency_budget_seconds": budget_seconds})
+# MAGIC         return ResponsesAgentStreamEvent(
+# MAGIC             type="response.output_item.done",
+# MAGIC             item=self.create_text_output_item(
+# MAGIC                 "I could not finish gathering the information within the time available. "
+# MAGIC                 "Please try again or narrow down the question.",
+# MAGIC                 str(uuid4()),
+# MAGIC             ),
+# MAGIC         )
+# MAGIC
+# MAGIC     def _submit_tool(self, pool: ToolPool, fn: Callable, *args) -> Any:
+# MAGIC         """Submit `fn` to `pool` in a copy of the current context, tagging the trace when the pool is full."""
+# MAGIC         if pool.saturated():
+# MAGIC             self._record_trace_event("tool_pool_saturated", {"tool.pool_workers": pool.max_workers})
+# MAGIC         return pool.submit(contextvars.copy_context().run, fn, *args)
+# MAGIC
+# MAGIC     def _abandon_tool(self, pool: ToolPool, future, tool_name: str) -> None:
+# MAGIC         if pool.abandon(future):
+# MAGIC             self._record_trace_event("tool_pool_replaced", {"tool.name": tool_name})
+# MAGIC
+# MAGIC     @staticmethod
+# MAGIC     def _record_trace_event(name: str, attributes: dict[str, Any]) -> None:
+# MAGIC         """Adds an event to the active MLflow span and tags the trace, so timeouts are searchable."""
+# MAGIC         span = mlflow.get_current_active_span()
+# MAGIC         if span is None:
+# MAGIC             return
+# MAGIC         span.add_event(SpanEvent(name=name, attributes=attributes))
+# MAGIC         try:
+# MAGIC             mlflow.update_current_trace(tags={f"agent.{name}": "true"})
+# MAGIC         except Exception:
+# MAGIC             pass
+# MAGIC
 # MAGIC     def handle_tool_call(
 # MAGIC         self,
 # MAGIC         tool_call: dict[str, Any],
@@ -169,34 +1073,210 @@
 # MAGIC         """
 # MAGIC         Execute tool calls, add them to the running message history, and return a ResponsesStreamEvent w/ tool output
 # MAGIC         """
-# MAGIC         args = json.loads(tool_call["arguments"])
-# MAGIC         result = str(self.execute_tool(tool_name=tool_call["name"], args=args))
+# MAGIC         result = self.run_tool_call(tool_call)
 # MAGIC
 # MAGIC         tool_call_output = self.create_function_call_output_item(tool_call["call_id"], result)
 # MAGIC         messages.append(tool_call_output)
 # MAGIC         return ResponsesAgentStreamEvent(type="response.output_item.done", item=tool_call_output)
 # MAGIC
-# MAGIC     def call_and_run_tools(
+# MAGIC     @staticmethod
+# MAGIC     def _prefetch_key(tool_name: str, args: dict) -> str:
+# MAGIC         return json.dumps(
+# MAGIC             {k: " ".join(v.lower().split()) if isinstance(v, str) else v for k, v in args.items()},
+# MAGIC             sort_keys=True,
+# MAGIC             default=str,
+# MAGIC         ) + tool_name
+# MAGIC
+# MAGIC     def start_prefetch(self, messages: list[dict[str, Any]]) -> None:
+# MAGIC         """Start the customer lookup for customers named in the latest user message, without waiting."""
+# MAGIC         tool_name = PREFETCH_TOOL_UDF.replace(".", "__")
+# MAGIC         last_user = next((m for m in reversed(messages) if m.get("role") == "user"), None)
+# MAGIC         if self.customer_index is None or tool_name not in self._tools_dict or last_user is None:
+# MAGIC             return
+# MAGIC         content = last_user.get("content")
+# MAGIC         if not isinstance(content, str):
+# MAGIC             content = " ".join(part.get("text", "") for part in content or [] if isinstance(part, dict))
+# MAGIC         prefetched = {}
+# MAGIC         for name in self.customer_index.find(content):
+# MAGIC             args = {"customer_name": name}
+# MAGIC             future = self._submit_tool(self._tool_executor, self._run_prefetch, tool_name, args)
+# MAGIC             prefetched[self._prefetch_key(tool_name, args)] = (future, time.monotonic())
+# MAGIC         _prefetched_calls.set(prefetched)
+# MAGIC         self.prefetch_stats.record_issued(len(prefetched))
+# MAGIC
+# MAGIC     def _run_prefetch(self, tool_name: str, args: dict) -> tuple[Any, float]:
+# MAGIC         return self.execute_tool(tool_name, args), time.monotonic()
+# MAGIC
+# MAGIC     def _take_prefetched(self, tool_name: str, args: dict) -> tuple[bool, Any]:
+# MAGIC         prefetched = _prefetched_calls.get()
+# MAGIC         entry = prefetched.pop(self._prefetch_key(tool_name, args), None) if prefetched else None
+# MAGIC         if entry is None:
+# MAGIC             return False, None
+# MAGIC         future, started = entry
+# MAGIC         requested = time.monotonic()
+# MAGIC         tool = self._tools_dict.get(tool_name)
+# MAGIC         timeout = tool.timeout_seconds if tool else TOOL_TIMEOUT_SECONDS
+# MAGIC         # Wait until the lookup's own deadline, but leave at least half of the real call's deadline
+# MAGIC         # for a fresh call in case the speculative one is stuck
+# MAGIC         wait = max(0.0, min(started + timeout, requested + timeout / 2) - requested)
+# MAGIC         try:
+# MAGIC             result, finished = future.result(timeout=wait)
+# MAGIC         except FutureTimeoutError:
+# MAGIC             self._abandon_tool(self._tool_executor, future, tool_name)
+# MAGIC             self.prefetch_stats.record_timed_out()
+# MAGIC             self._record_trace_event("prefetch_timed_out", {"tool.name": tool_name})
+# MAGIC             return False, None
+# MAGIC         except Exception:
+# MAGIC             return False, None
+# MAGIC         # The part of the lookup that ran before the LLM asked for it
+# MAGIC         saved_seconds = max(0.0, min(finished, requested) - started)
+# MAGIC         self.prefetch_stats.record_hit(saved_seconds)
+# MAGIC         self._record_trace_event("prefetch_hit", {"tool.name": tool_name, "prefetch.saved_ms": round(saved_seconds * 1000)})
+# MAGIC         return True, result
+# MAGIC
+# MAGIC     def run_tool_call(self, tool_call: dict[str, Any]) -> str:
+# MAGIC         args = json.loads(tool_call["arguments"])
+# MAGIC         hit, result = self._take_prefetched(tool_call["name"], args)
+# MAGIC         if not hit:
+# MAGIC             result = self.execute_tool(tool_name=tool_call["name"], args=args)
+# MAGIC         result = str(result)
+# MAGIC         return self._tool_outputs.compact(result, self._tools_dict[tool_call["name"]].output_token_budget)
+# MAGIC
+# MAGIC     def pending_tool_calls(self, messages: list[dict[str, Any]]) -> list[dict[str, Any]]:
+# MAGIC         """Returns the function calls from the latest LLM turn that have no output yet, in call order."""
+# MAGIC         answered = {m["call_id"] for m in messages if m.get("type") == "function_call_output"}
+# MAGIC         pending = []
+# MAGIC         for msg in reversed(messages):
+# MAGIC             if msg.get("type") == "function_call":
+# MAGIC                 if msg["call_id"] not in answered:
+# MAGIC                     pending.append(msg)
+# MAGIC             elif msg.get("type") != "function_call_output":
+# MAGIC                 break
+# MAGIC         return pending[::-1]
+# MAGIC
+# MAGIC     def handle_tool_calls(
 # MAGIC         self,
+# MAGIC         tool_calls: list[dict[str, Any]],
 # MAGIC         messages: list[dict[str, Any]],
-# MAGIC         max_iter: int = 10,
+# MAGIC         deadline: Optional[float] = None,
+# MAGIC         state: Optional[LoopState] = None,
 # MAGIC     ) -> Generator[ResponsesAgentStreamEvent, None, None]:
-# MAGIC         for _ in range(max_iter):
-# MAGIC             last_msg = messages[-1]
-# MAGIC             if last_msg.get("role", None) == "assistant":
-# MAGIC                 return
-# MAGIC             elif last_msg.get("type", None) == "function_call":
-# MAGIC                 yield self.handle_tool_call(last_msg, messages)
+# MAGIC         """
+# MAGIC         Execute all tool calls of one LLM turn concurrently, then add their outputs to the running
+# MAGIC         message history in call order, so the history does not depend on which tool finished first.
+# MAGIC         Calls already answered in this request, or repeated within the turn, run only once.
+# MAGIC         """
+# MAGIC         state = state or LoopState()
+# MAGIC         # Each call runs in a copy of the current context so its MLflow span nests under this request
+# MAGIC         start = time.monotonic()
+# MAGIC         futures = {}
+# MAGIC         for key, tool_call in self._new_tool_calls(tool_calls, state).items():
+# MAGIC             futures[key] = self._submit_tool(self._tool_executor, self.run_tool_call, tool_call)
+# MAGIC         for tool_call in tool_calls:
+# MAGIC             key = LoopState.call_key(tool_call)
+# MAGIC             if key in state.results:
+# MAGIC                 result = REPEATED_CALL_NOTE + state.results[key]
 # MAGIC             else:
-# MAGIC                 yield from self.output_to_responses_items_stream(
-# MAGIC                     chunks=self.call_llm(messages), aggregator=messages
-# MAGIC                 )
+# MAGIC                 try:
+# MAGIC                     tool_deadline = self._tool_deadline(tool_call, start, deadline)
+# MAGIC                     result = state.results[key] = futures[key].result(
+# MAGIC                         timeout=max(0.0, tool_deadline - time.monotonic())
+# MAGIC                     )
+# MAGIC                 except (FutureTimeoutError, CancelledError):
+# MAGIC                     self._abandon_tool(self._tool_executor, futures[key], tool_call["name"])
+# MAGIC                     result = self._timed_out_output(tool_call, time.monotonic() - start)
+# MAGIC             tool_call_output = self.create_function_call_output_item(tool_call["call_id"], result)
+# MAGIC             messages.append(tool_call_output)
+# MAGIC             yield ResponsesAgentStreamEvent(type="response.output_item.done", item=tool_call_output)
 # MAGIC
-# MAGIC         yield ResponsesAgentStreamEvent(
-# MAGIC             type="response.output_item.done",
-# MAGIC             item=self.create_text_output_item("Max iterations reached. Stopping.", str(uuid4())),
+# MAGIC     def _new_tool_calls(self, tool_calls: list[dict[str, Any]], state: LoopState) -> dict[str, dict[str, Any]]:
+# MAGIC         """
+# MAGIC         The calls of this turn that have to run, one per distinct (tool, arguments). A turn that only
+# MAGIC         repeats calls answered earlier counts as stalled.
+# MAGIC         """
+# MAGIC         new_calls = {}
+# MAGIC         for tool_call in tool_calls:
+# MAGIC             key = LoopState.call_key(tool_call)
+# MAGIC             if key in state.results or key in new_calls:
+# MAGIC                 state.deduplicated_tool_calls += 1
+# MAGIC             else:
+# MAGIC                 new_calls[key] = tool_call
+# MAGIC         state.tool_calls += len(tool_calls)
+# MAGIC         state.stalled_turns = 0 if new_calls else state.stalled_turns + 1
+# MAGIC         if len(new_calls) < len(tool_calls):
+# MAGIC             self._record_trace_event("repeated_tool_calls", {"tool.repeated": len(tool_calls) - len(new_calls)})
+# MAGIC         return new_calls
+# MAGIC
+# MAGIC     def _best_available_answer(self, messages: list[dict[str, Any]], first_new: int) -> ResponsesAgentStreamEvent:
+# MAGIC         """
+# MAGIC         Final message for a loop that stopped making progress: defer to the answer text the LLM already
+# MAGIC         streamed in this request, or else pass on the latest tool result
+# MAGIC         """
+# MAGIC         new_messages = messages[first_new:]
+# MAGIC         has_text = any(m.get("role") == "assistant" and m.get("type") == "message" for m in new_messages)
+# MAGIC         if has_text:
+# MAGIC             text = "I have stopped here because further lookups were not returning new information."
+# MAGIC         else:
+# MAGIC             last_output = next(
+# MAGIC                 (m["output"] for m in reversed(new_messages) if m.get("type") == "function_call_output"), None
+# MAGIC             )
+# MAGIC             text = "I could not complete this request because the same lookups kept repeating."
+# MAGIC             if last_output:
+# MAGIC                 last_output = str(last_output).removeprefix(REPEATED_CALL_NOTE)
+# MAGIC                 text += " The most recent result I retrieved was:\n\n" + last_output[:DEFAULT_TOOL_OUTPUT_TOKEN_BUDGET * CHARS_PER_TOKEN]
+# MAGIC         self._record_trace_event("loop_short_circuit", {"agent.first_new_message": first_new})
+# MAGIC         return ResponsesAgentStreamEvent(
+# MAGIC             type="response.output_item.done", item=self.create_text_output_item(text, str(uuid4()))
 # MAGIC         )
 # MAGIC
+# MAGIC     def _record_loop_metrics(self, state: LoopState) -> None:
+# MAGIC         """Per-request iteration, token and latency counts on the active span and as trace tags."""
+# MAGIC         metrics = state.metrics()
+# MAGIC         span = mlflow.get_current_active_span()
+# MAGIC         if span is not None:
+# MAGIC             span.set_attributes(metrics)
+# MAGIC         try:
+# MAGIC             mlflow.update_current_trace(tags={k: str(v) for k, v in metrics.items()})
+# MAGIC         except Exception:
+# MAGIC             pass
+# MAGIC
+# MAGIC     def call_and_run_tools(
+# MAGIC         self,
+# MAGIC         messages: list[dict[str, Any]],
+# MAGIC         max_iter: int = 10,
+# MAGIC         budget_seconds: float = REQUEST_LATENCY_BUDGET_SECONDS,
+# MAGIC     ) -> Generator[ResponsesAgentStreamEvent, None, None]:
+# MAGIC         deadline = time.monotonic() + budget_seconds
+# MAGIC         state, first_new = LoopState(), len(messages)
+# MAGIC         try:
+# MAGIC             for _ in range(max_iter):
+# MAGIC                 state.iterations += 1
+# MAGIC                 last_msg = messages[-1]
+# MAGIC                 if last_msg.get("role", None) == "assistant":
+# MAGIC                     return
+# MAGIC                 elif time.monotonic() >= deadline:
+# MAGIC                     state.stop_reason = "latency_budget"
+# MAGIC                     yield self._budget_exhausted_event(budget_seconds)
+# MAGIC                     return
+# MAGIC                 elif last_msg.get("type", None) == "function_call":
+# MAGIC                     yield from self.handle_tool_calls(self.pending_tool_calls(messages), messages, deadline, state)
+# MAGIC                     if state.stalled_turns >= LOOP_MAX_STALLED_TURNS:
+# MAGIC                         state.stop_reason = "stalled"
+# MAGIC                         yield self._best_available_answer(messages, first_new)
+# MAGIC                         return
+# MAGIC                 else:
+# MAGIC                     yield from self.output_to_responses_items_stream(
+# MAGIC                         chunks=state.count_llm_call(messages, self.call_llm(messages, deadline)), aggregator=messages
+# MAGIC                     )
+# MAGIC
+# MAGIC             state.stop_reason = "max_iterations"
+# MAGIC             yield ResponsesAgentStreamEvent(
+# MAGIC                 type="response.output_item.done",
+# MAGIC                 item=self.create_text_output_item("Max iterations reached. Stopping.", str(uuid4())),
+# MAGIC             )
+# MAGIC         finally:
+# MAGIC             self._record_loop_metrics(state)
+# MAGIC
 # MAGIC     def predict(self, request: ResponsesAgentRequest) -> ResponsesAgentResponse:
 # MAGIC         outputs = [
 # MAGIC             event.item
@@ -211,13 +1291,351 @@
 # MAGIC         messages = self.prep_msgs_for_cc_llm([i.model_dump() for i in request.input])
 # MAGIC         if SYSTEM_PROMPT:
 # MAGIC             messages.insert(0, {"role": "system", "content": SYSTEM_PROMPT})
+# MAGIC         _caller_identity.set(getattr(request.context, "user_id", None) if request.context else None)
+# MAGIC         self.start_prefetch(messages)
 # MAGIC         yield from self.call_and_run_tools(messages=messages)
 # MAGIC
+# MAGIC     def fingerprint(self) -> str:
+# MAGIC         """Hash of the configuration that determines this agent's answers, used to key cached predictions."""
+# MAGIC         config = {
+# MAGIC             "llm_endpoint": self.llm_endpoint,
+# MAGIC             "system_prompt": SYSTEM_PROMPT,
+# MAGIC             "tools": [tool.spec for tool in self._tools_dict.values()],
+# MAGIC             "code": agent_code_version(),
+# MAGIC             "documents": LOCAL_DOCS_INDEX.version() if LOCAL_DOCS_INDEX is not None else None,
+# MAGIC         }
+# MAGIC         return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+# MAGIC
+# MAGIC     def predict_batch(
+# MAGIC         self,
+# MAGIC         requests: list,
+# MAGIC         max_concurrency: int = BATCH_MAX_CONCURRENCY,
+# MAGIC         cache: Optional[PredictionCache] = None,
+# MAGIC     ) -> tuple[list[ResponsesAgentResponse], list[bool]]:
+# MAGIC         """
+# MAGIC         Predict a list of requests (ResponsesAgentRequest or dicts) with at most `max_concurrency`
+# MAGIC         in flight, sharing this agent's clients, pools and tool cache. Requests found in `cache`
+# MAGIC         are not re-run. Returns the responses in request order and, per request, whether it was a
+# MAGIC         cache hit; a request that fails yields None instead of aborting the batch.
+# MAGIC         """
+# MAGIC         request_dicts = [r.model_dump() if isinstance(r, BaseModel) else dict(r) for r in requests]
+# MAGIC         fingerprint = self.fingerprint()
+# MAGIC         keys = [PredictionCache.make_key(fingerprint, r) for r in request_dicts]
+# MAGIC
+# MAGIC         def run_one(request: dict, key: str) -> Optional[ResponsesAgentResponse]:
+# MAGIC             try:
+# MAGIC                 response = self.predict(ResponsesAgentRequest(**request))
+# MAGIC             except Exception as e:
+# MAGIC                 print(f"Prediction failed for request {key[:12]}: {e}")
+# MAGIC                 return None
+# MAGIC             if cache is not None:
+# MAGIC                 cache.put(key, response.model_dump())
+# MAGIC             return response
+# MAGIC
+# MAGIC         results: list[Optional[ResponsesAgentResponse]] = [None] * len(requests)
+# MAGIC         hits = [False] * len(requests)
+# MAGIC         misses = []
+# MAGIC         for i, key in enumerate(keys):
+# MAGIC             cached = cache.get(key) if cache is not None else None
+# MAGIC             if cached is not None:
+# MAGIC                 results[i], hits[i] = ResponsesAgentResponse(**cached), True
+# MAGIC             else:
+# MAGIC                 misses.append(i)
+# MAGIC
+# MAGIC         with ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="agent-batch") as pool:
+# MAGIC             futures = {
+# MAGIC                 i: pool.submit(contextvars.copy_context().run, run_one, request_dicts[i], keys[i]) for i in misses
+# MAGIC             }
+# MAGIC             for i, future in futures.items():
+# MAGIC                 results[i] = future.result()
+# MAGIC         return results, hits
+# MAGIC
+# MAGIC
+# MAGIC class _DatabricksAuth(httpx.Auth):
+# MAGIC     """Adds fresh Databricks auth headers to every request made by the async OpenAI client."""
+# MAGIC
+# MAGIC     def __init__(self, config):
+# MAGIC         self._config = config
+# MAGIC
+# MAGIC     def auth_flow(self, request):
+# MAGIC         request.headers.update(self._config.authenticate())
+# MAGIC         yield request
+# MAGIC
+# MAGIC     async def async_auth_flow(self, request):
+# MAGIC         # authenticate() may refresh a token over the network, which must not block the event loop
+# MAGIC         request.headers.update(await asyncio.to_thread(self._config.authenticate))
+# MAGIC         yield request
+# MAGIC
+# MAGIC
+# MAGIC class AsyncToolCallingAgent(ToolCallingAgent):
+# MAGIC     """
+# MAGIC     asyncio-native variant of ToolCallingAgent: LLM streaming and tool execution are awaited,
+# MAGIC     so a single worker can keep many conversations in flight while they wait on the network.
+# MAGIC     Use apredict/apredict_stream from async code; predict/predict_stream keep the synchronous
+# MAGIC     ResponsesAgent contract by running the async loop on a shared event-loop thread.
+# MAGIC     """
+# MAGIC
+# MAGIC     def __init__(
+# MAGIC         self,
+# MAGIC         llm_endpoint: str,
+# MAGIC         tools: list[ToolInfo],
+# MAGIC         async_client: Optional[AsyncOpenAI] = None,
+# MAGIC         model_serving_client: Optional[OpenAI] = None,
+# MAGIC         customer_index: Optional[CustomerNameIndex] = None,
+# MAGIC     ):
+# MAGIC         super().__init__(llm_endpoint, tools, model_serving_client, customer_index)
+# MAGIC         if async_client is None:
+# MAGIC             config = (self.workspace_client or WorkspaceClient()).config
+# MAGIC             async_client = AsyncOpenAI(
+# MAGIC                 base_url=f"{config.host}/serving-endpoints",
+# MAGIC                 api_key="no-token",
+# MAGIC                 http_client=httpx.AsyncClient(auth=_DatabricksAuth(config), timeout=httpx.Timeout(300.0)),
+# MAGIC             )
+# MAGIC         self.async_model_serving_client: AsyncOpenAI = async_client
+# MAGIC         # UC function calls are blocking, so they run on a pool sized for many concurrent conversations
+# MAGIC         self._async_tool_executor = ToolPool(ASYNC_TOOL_WORKERS, "agent-async-tool")
+# MAGIC         self._loop = asyncio.new_event_loop()
+# MAGIC         threading.Thread(target=self._loop.run_forever, name="agent-event-loop", daemon=True).start()
+# MAGIC         # catch_warnings() swaps process-wide state, so it cannot wrap awaits shared by concurrent
+# MAGIC         # tasks; the filter is installed once here instead
+# MAGIC         warnings.filterwarnings("ignore", message="PydanticSerializationUnexpectedValue")
+# MAGIC
+# MAGIC     async def acall_llm(
+# MAGIC         self, messages: list[dict[str, Any]], deadline: Optional[float] = None
+# MAGIC     ) -> AsyncGenerator[dict[str, Any], None]:
+# MAGIC         stream = await self.async_model_serving_client.chat.completions.create(
+# MAGIC             model=self.llm_endpoint,
+# MAGIC             messages=self.prep_msgs_for_cc_llm(messages),
+# MAGIC             tools=self.get_tool_specs(),
+# MAGIC             stream=True,
+# MAGIC             **self._llm_timeout_kwargs(deadline),
+# MAGIC         )
+# MAGIC         try:
+# MAGIC             async for chunk in stream:
+# MAGIC                 yield chunk.to_dict()
+# MAGIC         finally:
+# MAGIC             # Release the HTTP stream promptly if the request is cancelled mid-answer
+# MAGIC             close = getattr(stream, "close", None)
+# MAGIC             if close is not None:
+# MAGIC                 await close()
+# MAGIC
+# MAGIC     async def aoutput_to_responses_items_stream(
+# MAGIC         self,
+# MAGIC         chunks: AsyncGenerator[dict[str, Any], None],
+# MAGIC         aggregator: list[dict[str, Any]],
+# MAGIC     ) -> AsyncGenerator[ResponsesAgentStreamEvent, None]:
+# MAGIC         """Async counterpart of output_to_responses_items_stream for chat completion chunks."""
+# MAGIC         text, text_id = "", None
+# MAGIC         tool_calls: dict[int, dict[str, str]] = {}
+# MAGIC         async for chunk in chunks:
+# MAGIC             if not chunk.get("choices"):
+# MAGIC                 continue
+# MAGIC             delta = chunk["choices"][0].get("delta") or {}
+# MAGIC             if delta.get("content"):
+# MAGIC                 text_id = text_id or chunk.get("id") or str(uuid4())
+# MAGIC                 text += delta["content"]
+# MAGIC                 yield ResponsesAgentStreamEvent(**self.create_text_delta(delta=delta["content"], item_id=text_id))
+# MAGIC             for tool_call_delta in delta.get("tool_calls") or []:
+# MAGIC                 tool_call = tool_calls.setdefault(tool_call_delta["index"], {"id": "", "name": "", "arguments": ""})
+# MAGIC                 tool_call["id"] = tool_call_delta.get("id") or tool_call["id"]
+# MAGIC                 function = tool_call_delta.get("function") or {}
+# MAGIC                 tool_call["name"] += function.get("name") or ""
+# MAGIC                 tool_call["arguments"] += function.get("arguments") or ""
+# MAGIC
+# MAGIC         if text:
+# MAGIC             item = self.create_text_output_item(text, text_id)
+# MAGIC             aggregator.append(item)
+# MAGIC             yield ResponsesAgentStreamEvent(type="response.output_item.done", item=item)
+# MAGIC         for index in sorted(tool_calls):
+# MAGIC             tool_call = tool_calls[index]
+# MAGIC             item = self.create_function_call_item(
+# MAGIC                 id=str(uuid4()),
+# MAGIC                 call_id=tool_call["id"],
+# MAGIC                 name=tool_call["name"],
+# MAGIC                 arguments=tool_call["arguments"] or "{}",
+# MAGIC             )
+# MAGIC             aggregator.append(item)
+# MAGIC             yield ResponsesAgentStreamEvent(type="response.output_item.done", item=item)
+# MAGIC
+# MAGIC     async def arun_tool_call(self, tool_call: dict[str, Any]) -> str:
+# MAGIC         future = self._submit_tool(self._async_tool_executor, self.run_tool_call, tool_call)
+# MAGIC         try:
+# MAGIC             return await asyncio.wrap_future(future)
+# MAGIC         except asyncio.CancelledError:
+# MAGIC             # Timed out or no longer needed: drop the queued call, or retire the pool it is stuck on
+# MAGIC             self._abandon_tool(self._async_tool_executor, future, tool_call["name"])
+# MAGIC             raise
+# MAGIC
+# MAGIC     async def ahandle_tool_calls(
+# MAGIC         self,
+# MAGIC         tool_calls: list[dict[str, Any]],
+# MAGIC         messages: list[dict[str, Any]],
+# MAGIC         deadline: Optional[float] = None,
+# MAGIC         state: Optional[LoopState] = None,
+# MAGIC     ) -> AsyncGenerator[ResponsesAgentStreamEvent, None]:
+# MAGIC         state = state or LoopState()
+# MAGIC         start = time.monotonic()
+# MAGIC         tasks = {
+# MAGIC             key: asyncio.ensure_future(asyncio.wait_for(
+# MAGIC                 self.arun_tool_call(tool_call),
+# MAGIC                 max(0.0, self._tool_deadline(tool_call, start, deadline) - start),
+# MAGIC             ))
+# MAGIC             for key, tool_call in self._new_tool_calls(tool_calls, state).items()
+# MAGIC         }
+# MAGIC         try:
+# MAGIC             for tool_call in tool_calls:
+# MAGIC                 key = LoopState.call_key(tool_call)
+# MAGIC                 if key in state.results:
+# MAGIC                     result = REPEATED_CALL_NOTE + state.results[key]
+# MAGIC                 else:
+# MAGIC                     try:
+# MAGIC                         result = state.results[key] = await tasks[key]
+# MAGIC                     except asyncio.TimeoutError:
+# MAGIC                         result = self._timed_out_output(tool_call, time.monotonic() - start)
+# MAGIC                 tool_call_output = self.create_function_call_output_item(tool_call["call_id"], result)
+# MAGIC                 messages.append(tool_call_output)
+# MAGIC                 yield ResponsesAgentStreamEvent(type="response.output_item.done", item=tool_call_output)
+# MAGIC         finally:
+# MAGIC             # Cooperative cancellation: stop waiting on tools nobody will read
+# MAGIC             for task in tasks.values():
+# MAGIC                 task.cancel()
+# MAGIC
+# MAGIC     async def acall_and_run_tools(
+# MAGIC         self,
+# MAGIC         messages: list[dict[str, Any]],
+# MAGIC         max_iter: int = 10,
+# MAGIC         budget_seconds: float = REQUEST_LATENCY_BUDGET_SECONDS,
+# MAGIC     ) -> AsyncGenerator[ResponsesAgentStreamEvent, None]:
+# MAGIC         deadline = time.monotonic() + budget_seconds
+# MAGIC         state, first_new = LoopState(), len(messages)
+# MAGIC         try:
+# MAGIC             for _ in range(max_iter):
+# MAGIC                 state.iterations += 1
+# MAGIC                 last_msg = messages[-1]
+# MAGIC                 if last_msg.get("role", None) == "assistant":
+# MAGIC                     return
+# MAGIC                 elif time.monotonic() >= deadline:
+# MAGIC                     state.stop_reason = "latency_budget"
+# MAGIC                     yield self._budget_exhausted_event(budget_seconds)
+# MAGIC                     return
+# MAGIC                 elif last_msg.get("type", None) == "function_call":
+# MAGIC                     async for event in self.ahandle_tool_calls(
+# MAGIC                         self.pending_tool_calls(messages), messages, deadline, state
+# MAGIC                     ):
+# MAGIC                         yield event
+# MAGIC                     if state.stalled_turns >= LOOP_MAX_STALLED_TURNS:
+# MAGIC                         state.stop_reason = "stalled"
+# MAGIC                         yield self._best_available_answer(messages, first_new)
+# MAGIC                         return
+# MAGIC                 else:
+# MAGIC                     async for event in self.aoutput_to_responses_items_stream(
+# MAGIC                         chunks=state.acount_llm_call(messages, self.acall_llm(messages, deadline)), aggregator=messages
+# MAGIC                     ):
+# MAGIC                         yield event
+# MAGIC
+# MAGIC             state.stop_reason = "max_iterations"
+# MAGIC             yield ResponsesAgentStreamEvent(
+# MAGIC                 type="response.output_item.done",
+# MAGIC                 item=self.create_text_output_item("Max iterations reached. Stopping.", str(uuid4())),
+# MAGIC             )
+# MAGIC         finally:
+# MAGIC             self._record_loop_metrics(state)
+# MAGIC
+# MAGIC     async def apredict(self, request: ResponsesAgentRequest) -> ResponsesAgentResponse:
+# MAGIC         outputs = [
+# MAGIC             event.item
+# MAGIC             async for event in self.apredict_stream(request)
+# MAGIC             if event.type == "response.output_item.done"
+# MAGIC         ]
+# MAGIC         return ResponsesAgentResponse(output=outputs, custom_outputs=request.custom_inputs)
+# MAGIC
+# MAGIC     async def apredict_stream(
+# MAGIC         self, request: ResponsesAgentRequest
+# MAGIC     ) -> AsyncGenerator[ResponsesAgentStreamEvent, None]:
+# MAGIC         messages = self.prep_msgs_for_cc_llm([i.model_dump() for i in request.input])
+# MAGIC         if SYSTEM_PROMPT:
+# MAGIC             messages.insert(0, {"role": "system", "content": SYSTEM_PROMPT})
+# MAGIC         _caller_identity.set(getattr(request.context, "user_id", None) if request.context else None)
+# MAGIC         self.start_prefetch(messages)
+# MAGIC         async for event in self.acall_and_run_tools(messages=messages):
+# MAGIC             yield event
+# MAGIC
+# MAGIC     async def apredict_batch(
+# MAGIC         self,
+# MAGIC         requests: list,
+# MAGIC         max_concurrency: int = BATCH_MAX_CONCURRENCY,
+# MAGIC         cache: Optional[PredictionCache] = None,
+# MAGIC     ) -> tuple[list[ResponsesAgentResponse], list[bool]]:
+# MAGIC         """Async counterpart of predict_batch: all requests share one event loop, bounded by a semaphore."""
+# MAGIC         request_dicts = [r.model_dump() if isinstance(r, BaseModel) else dict(r) for r in requests]
+# MAGIC         fingerprint = self.fingerprint()
+# MAGIC         semaphore = asyncio.Semaphore(max_concurrency)
+# MAGIC
+# MAGIC         async def run_one(request: dict) -> tuple[Optional[ResponsesAgentResponse], bool]:
+# MAGIC             key = PredictionCache.make_key(fingerprint, request)
+# MAGIC             cached = cache.get(key) if cache is not None else None
+# MAGIC             if cached is not None:
+# MAGIC                 return ResponsesAgentResponse(**cached), True
+# MAGIC             async with semaphore:
+# MAGIC                 try:
+# MAGIC                     response = await self.apredict(ResponsesAgentRequest(**request))
+# MAGIC                 except Exception as e:
+# MAGIC                     print(f"Prediction failed for request {key[:12]}: {e}")
+# MAGIC                     return None, False
+# MAGIC             if cache is not None:
+# MAGIC                 cache.put(key, response.model_dump())
+# MAGIC             return response, False
+# MAGIC
+# MAGIC         outcomes = await asyncio.gather(*(run_one(r) for r in request_dicts))
+# MAGIC         return [response for response, _ in outcomes], [hit for _, hit in outcomes]
+# MAGIC
+# MAGIC     def predict_batch(
+# MAGIC         self,
+# MAGIC         requests: list,
+# MAGIC         max_concurrency: int = BATCH_MAX_CONCURRENCY,
+# MAGIC         cache: Optional[PredictionCache] = None,
+# MAGIC     ) -> tuple[list[ResponsesAgentResponse], list[bool]]:
+# MAGIC         return asyncio.run_coroutine_threadsafe(
+# MAGIC             self.apredict_batch(requests, max_concurrency, cache), self._loop
+# MAGIC         ).result()
+# MAGIC
+# MAGIC     def predict_stream(
+# MAGIC         self, request: ResponsesAgentRequest
+# MAGIC     ) -> Generator[ResponsesAgentStreamEvent, None, None]:
+# MAGIC         # The whole stream runs as one task on the event loop, so per-request context variables
+# MAGIC         # (caller identity, prefetched calls) stay set between events
+# MAGIC         events: queue.Queue = queue.Queue()
+# MAGIC         done = object()
+# MAGIC
+# MAGIC         async def drain():
+# MAGIC             try:
+# MAGIC                 async for event in self.apredict_stream(request):
+# MAGIC                     events.put(event)
+# MAGIC             except BaseException as e:
+# MAGIC                 events.put(e)
+# MAGIC                 raise
+# MAGIC             events.put(done)
+# MAGIC
+# MAGIC         future = asyncio.run_coroutine_threadsafe(drain(), self._loop)
+# MAGIC         try:
+# MAGIC             while True:
+# MAGIC                 event = events.get()
+# MAGIC                 if event is done:
+# MAGIC                     return
+# MAGIC                 if isinstance(event, BaseException):
+# MAGIC                     raise event
+# MAGIC                 yield event
+# MAGIC         finally:
+# MAGIC             future.cancel()
+# MAGIC
 # MAGIC
 # MAGIC # Log the model using MLflow
-# MAGIC mlflow.openai.autolog()
-# MAGIC AGENT = ToolCallingAgent(llm_endpoint=LLM_ENDPOINT_NAME, tools=TOOL_INFOS)
-# MAGIC mlflow.models.set_model(AGENT)
+# MAGIC if not AGENT_OFFLINE:
+# MAGIC     mlflow.openai.autolog()
+# MAGIC     AGENT = (AsyncToolCallingAgent if USE_ASYNC_AGENT else ToolCallingAgent)(
+# MAGIC         llm_endpoint=LLM_ENDPOINT_NAME, tools=TOOL_INFOS, customer_index=load_customer_name_index()
+# MAGIC     )
+# MAGIC     mlflow.models.set_model(AGENT)
 
 # COMMAND ----------
 
@@ -247,6 +1665,185 @@ for chunk in AGENT.predict_stream(
 
 # COMMAND ----------
 
+# MAGIC %md
+# MAGIC ### Customer profile prefetch
+# MAGIC With `AGENT_CUSTOMER_NAMES_CSV` or `AGENT_CUSTOMER_NAMES_WAREHOUSE_ID` set, a customer named in the user message is looked up while the first LLM call runs. The stats show how often the LLM then asked for that lookup and how much latency it saved.
+
+# COMMAND ----------
+
+AGENT.predict({"input": [{"role": "user", "content": "What is the profile of Tiya Sood?"}]})
+print(AGENT.prefetch_stats.snapshot())
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ### Benchmark parallel tool execution
+# MAGIC When the LLM requests several tools in one turn, `call_and_run_tools` runs them concurrently on a bounded thread pool. The cell below runs the same multi-tool turn serially and in parallel, with tools that simulate the latency of the UC functions.
+
+# COMMAND ----------
+
+import json
+import time
+from agent import LLM_ENDPOINT_NAME, ToolCallingAgent, ToolInfo
+
+def make_slow_tool(name, seconds):
+    spec = {"type": "function", "function": {"name": name, "description": f"Simulated {name}", "parameters": {"type": "object", "properties": {}}}}
+    return ToolInfo(name=name, spec=spec, exec_fn=lambda **kwargs: time.sleep(seconds) or f"{name} result")
+
+bench_tools = [make_slow_tool("lookup_customer_info", 1.5), make_slow_tool("genie_wrapper", 3.0), make_slow_tool("genie_query", 2.0)]
+bench_agent = ToolCallingAgent(llm_endpoint=LLM_ENDPOINT_NAME, tools=bench_tools)
+tool_calls = [
+    {"type": "function_call", "id": f"fc_{i}", "call_id": f"call_{i}", "name": tool.name, "arguments": "{}"}
+    for i, tool in enumerate(bench_tools)
+]
+
+start = time.perf_counter()
+for tool_call in tool_calls:
+    bench_agent.handle_tool_call(tool_call, [])
+serial_seconds = time.perf_counter() - start
+
+start = time.perf_counter()
+list(bench_agent.handle_tool_calls(tool_calls, []))
+parallel_seconds = time.perf_counter() - start
+
+print(f"Serial: {serial_seconds:.2f}s | Parallel: {parallel_seconds:.2f}s | Speedup: {serial_seconds / parallel_seconds:.1f}x")
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ### Benchmark the async agent
+# MAGIC `AsyncToolCallingAgent` awaits the LLM stream and runs blocking UC tools off the event loop, so one worker can keep many conversations in flight. The cell below stubs the LLM (one tool call, then an answer) and the tool, and compares requests per second of the synchronous agent serving one conversation at a time with the async agent serving them concurrently.
+
+# COMMAND ----------
+
+import asyncio
+import time
+from types import SimpleNamespace
+from agent import AsyncToolCallingAgent, LLM_ENDPOINT_NAME, ToolCallingAgent
+from mlflow.types.responses import ResponsesAgentRequest
+
+LLM_LATENCY_SECONDS, TOOL_LATENCY_SECONDS, N_REQUESTS = 0.5, 0.8, 64
+
+class FakeChunk:
+    def __init__(self, data):
+        self.data = data
+
+    def to_dict(self):
+        return self.data
+
+def scripted_chunks(messages):
+    # First turn asks for the tool, the turn after the tool output answers
+    if messages[-1].get("role") == "tool":
+        return [FakeChunk({"id": "answer", "choices": [{"delta": {"content": "Here is the client profile."}}]})]
+    tool_call = {"index": 0, "id": "call_0", "function": {"name": "lookup_customer_info", "arguments": '{"customer_name": "Tiya Sood"}'}}
+    return [FakeChunk({"id": "tool", "choices": [{"delta": {"tool_calls": [tool_call]}}]})]
+
+class FakeCompletions:
+    def create(self, messages, **kwargs):
+        time.sleep(LLM_LATENCY_SECONDS)
+        return scripted_chunks(messages)
+
+class FakeAsyncCompletions:
+    async def create(self, messages, **kwargs):
+        async def stream():
+            await asyncio.sleep(LLM_LATENCY_SECONDS)
+            for chunk in scripted_chunks(messages):
+                yield chunk
+        return stream()
+
+lookup_tool = make_slow_tool("lookup_customer_info", TOOL_LATENCY_SECONDS)
+request = {"input": [{"role": "user", "content": "What is the profile of Tiya Sood?"}]}
+
+sync_agent = ToolCallingAgent(llm_endpoint=LLM_ENDPOINT_NAME, tools=[lookup_tool])
+sync_agent.model_serving_client = SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions()))
+start = time.perf_counter()
+for _ in range(4):
+    sync_agent.predict(request)
+sync_rps = 4 / (time.perf_counter() - start)
+
+async_agent = AsyncToolCallingAgent(
+    llm_endpoint=LLM_ENDPOINT_NAME,
+    tools=[lookup_tool],
+    async_client=SimpleNamespace(chat=SimpleNamespace(completions=FakeAsyncCompletions())),
+)
+async def run_concurrently():
+    start = time.perf_counter()
+    await asyncio.gather(*[async_agent.apredict(ResponsesAgentRequest(**request)) for _ in range(N_REQUESTS)])
+    return N_REQUESTS / (time.perf_counter() - start)
+# Run on the agent's own event-loop thread, as a serving worker would
+async_rps = asyncio.run_coroutine_threadsafe(run_concurrently(), async_agent._loop).result()
+
+print(f"Sync agent, one worker: {sync_rps:.2f} req/s | Async agent, one worker: {async_rps:.2f} req/s ({N_REQUESTS} concurrent)")
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ### Measure tool output compaction
+# MAGIC Large tool outputs are compacted to a per-tool token budget before they enter the message history, and every later LLM call in the loop re-sends that history. The cell below builds a Genie-style answer with a few hundred rows and compares the prompt tokens the loop would send over the remaining iterations with and without compaction.
+
+# COMMAND ----------
+
+import json
+from agent import CHARS_PER_TOKEN, TOOL_OUTPUT_TOKEN_BUDGETS, ToolOutputCompactor
+
+genie_rows = ", ".join(
+    f"{{'Customer ID': {i}, 'Customer Name': 'Client {i}', 'Product Type': 'Mutual Fund', 'Account Balance': {1000 * i + 0.5}, 'KYC Expiry Date': datetime.date(2027, {i % 12 + 1}, 11)}}"
+    for i in range(400)
+)
+genie_output = json.dumps({
+    "is_truncated": False,
+    "columns": ["output"],
+    "rows": [[f"Genie Results are: \nSQL Query: SELECT ...\nSQL Query Result: [{genie_rows}]\nError: None"]],
+})
+compacted = ToolOutputCompactor().compact(
+    genie_output, TOOL_OUTPUT_TOKEN_BUDGETS["demo_soumyashree_patra.bharat_bank_rm._genie_wrapper"]
+)
+
+remaining_iterations = 5
+full_tokens = len(genie_output) // CHARS_PER_TOKEN
+compacted_tokens = len(compacted) // CHARS_PER_TOKEN
+print(f"Tool output: {full_tokens} tokens -> {compacted_tokens} tokens after compaction")
+print(f"Prompt tokens re-sent over {remaining_iterations} later LLM calls: {full_tokens * remaining_iterations} -> {compacted_tokens * remaining_iterations}")
+print(compacted)
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ### Benchmark local document retrieval
+# MAGIC Set `AGENT_LOCAL_DOCS_DIR` (e.g. a UC Volume folder of product sheets and SOPs) to register the in-process `search_product_documents` tool. This cell indexes a generated folder and times top-k queries.
+
+# COMMAND ----------
+
+import os
+import random
+import tempfile
+import time
+
+from agent import LocalDocumentIndex
+
+docs_dir = tempfile.mkdtemp(prefix="rm_docs_")
+vocabulary = "savings fd interest rate kyc renewal aadhaar pan loan emi tenure insurance premium nominee sip mutual fund nav redemption charges eligibility".split()
+for i in range(300):
+    with open(os.path.join(docs_dir, f"sheet_{i}.md"), "w") as f:
+        f.write("\n\n".join(" ".join(random.choice(vocabulary) for _ in range(120)) for _ in range(10)))
+
+start = time.perf_counter()
+index = LocalDocumentIndex(docs_dir)
+print(f"Indexed {len(index._index['chunks'])} chunks in {time.perf_counter() - start:.2f}s")
+
+with open(os.path.join(docs_dir, "sheet_0.md"), "a") as f:
+    f.write("\n\nSenior citizen FD rates are 50 bps higher.")
+start = time.perf_counter()
+print(index.refresh(), f"re-indexed in {time.perf_counter() - start:.2f}s")
+
+n_queries = 500
+start = time.perf_counter()
+for _ in range(n_queries):
+    results = index.search("KYC renewal charges for senior citizen FD", top_k=5)
+print(f"{(time.perf_counter() - start) / n_queries * 1000:.2f} ms per query; top hit: {results[0]['source']}")
+
+# COMMAND ----------
+
 # MAGIC %md
 # MAGIC ### Log the `agent` as an MLflow model
 # MAGIC Determine Databricks resources to specify for automatic auth passthrough at deployment time
@@ -287,6 +1884,7 @@ with mlflow.start_run():
         pip_requirements=[
             "databricks-openai",
             "backoff",
+            "numpy",
             f"databricks-connect=={get_distribution('databricks-connect').version}",
         ],
         resources=resources,
@@ -347,9 +1945,25 @@ eval_dataset = [
     }
 ]
 
+from agent import PredictionCache
+
+# Predict the whole eval set concurrently; predictions are cached by input hash, so only new or
+# changed examples (or a change to the agent's code, settings, prompt, endpoint, tools or
+# documents) call the agent again
+predictions, cache_hits = AGENT.predict_batch(
+    [row["inputs"] for row in eval_dataset], max_concurrency=8, cache=PredictionCache()
+)
+print(f"Predicted {len(eval_dataset)} examples, {sum(cache_hits)} from the prediction cache")
+
+# Every example is scored, cached or not, so the run's metrics always cover the whole set;
+# cached predictions only save the agent calls, the scorers still run
+eval_rows = [
+    {**row, "outputs": prediction.model_dump()}
+    for row, prediction in zip(eval_dataset, predictions)
+    if prediction is not None
+]
 eval_results = mlflow.genai.evaluate(
-    data=eval_dataset,
-    predict_fn=lambda input: AGENT.predict({"input": input}),
+    data=eval_rows,
     scorers=[RelevanceToQuery(), Safety()], # add more scorers here if they're applicable
 )
 
@@ -0,0 +1,121 @@
+"""
+Precomputed answers for the "⚡ Expert Guidance" quick actions in the Agent-isstant tab.
+
+Answers are personalized per RM, generated in the background the first time an RM is
+seen and regenerated on a refresh schedule, so clicking a quick action only reads the
+cached text. Until an answer is ready the app shows the canned guidance instead.
+"""
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+QUICK_ACTION_REFRESH_SECONDS = float(os.getenv("QUICK_ACTION_REFRESH_SECONDS", str(6 * 3600)))
+QUICK_ACTION_CHECK_SECONDS = 60
+
+QUICK_ACTIONS = {
+    "compliance": {
+        "label": "⚖️ Compliance Check",
+        "user_message": "Check compliance status",
+        "canned_query": "compliance status and requirements",
+        "prompt": (
+            "I am {name}, relationship manager at the {branch} branch ({region}) with {clients_assigned} clients. "
+            "Summarise the compliance status of my client book: KYC renewals due, pending AML screenings, "
+            "overdue risk profile updates and the actions I should take first."
+        ),
+    },
+    "products": {
+        "label": "💡 Product Recommendations",
+        "user_message": "Recommend products for my clients",
+        "canned_query": "recommend products for clients",
+        "prompt": (
+            "I am {name}, relationship manager at the {branch} branch with {clients_assigned} clients, "
+            "current AUM ₹{current_aum:,} against a target of ₹{aum_target:,}. "
+            "Recommend the products I should pitch to my clients to close the gap, with the clients to start with."
+        ),
+    },
+    "process": {
+        "label": "📋 Process Guidance",
+        "user_message": "Guide me through processes",
+        "canned_query": "process guidance for account opening",
+        "prompt": (
+            "I am {name}, relationship manager at the {branch} branch ({region}). Guide me through the account "
+            "opening, loan processing and service request SLAs and escalation steps that apply to my branch."
+        ),
+    },
+}
+
+
+class QuickActionStore:
+    """
+    Process-wide cache of quick-action answers keyed by (RM id, action).
+    `generate_fn(rm_profile, prompt)` produces an answer; it runs on a small background
+    pool and is re-run for every registered RM once an answer is older than `refresh_seconds`.
+    """
+
+    def __init__(self, generate_fn, refresh_seconds: float = QUICK_ACTION_REFRESH_SECONDS,
+                 check_seconds: float = QUICK_ACTION_CHECK_SECONDS, max_workers: int = 2):
+        self._generate_fn = generate_fn
+        self.refresh_seconds = refresh_seconds
+        self.check_seconds = check_seconds
+        self._answers: dict[tuple[str, str], tuple[str, float]] = {}
+        self._profiles: dict[str, dict] = {}
+        self._pending: set[tuple[str, str]] = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="quick-actions")
+        self._scheduler = None
+
+    def register(self, rm_id: str, rm_profile: dict) -> None:
+        """Make sure answers for this RM exist or are being generated."""
+        with self._lock:
+            is_new = rm_id not in self._profiles
+            self._profiles[rm_id] = dict(rm_profile)
+            if self._scheduler is None:
+                self._scheduler = threading.Thread(target=self._schedule_loop, name="quick-actions-refresh", daemon=True)
+                self._scheduler.start()
+        if is_new:
+            self.refresh_stale()
+
+    def get(self, rm_id: str, action: str):
+        """The cached answer for this RM and action, or None if it has not been generated yet."""
+        with self._lock:
+            entry = self._answers.get((rm_id, action))
+        return entry[0] if entry else None
+
+    def refresh_stale(self) -> None:
+        now = time.time()
+        with self._lock:
+            due = [
+                (rm_id, action)
+                for rm_id in self._profiles
+                for action in QUICK_ACTIONS
+                if (rm_id, action) not in self._pending
+                and ((rm_id, action) not in self._answers
+                     or now - self._answers[(rm_id, action)][1] >= self.refresh_seconds)
+            ]
+            self._pending.update(due)
+        for rm_id, action in due:
+            self._executor.submit(self._generate, rm_id, action)
+
+    def _generate(self, rm_id: str, action: str) -> None:
+        try:
+            profile = self._profiles[rm_id]
+            answer = self._generate_fn(profile, QUICK_ACTIONS[action]["prompt"].format(**profile))
+        except Exception:
+            # Left missing so the next scheduled check retries it; the canned answer is shown meanwhile
+            logger.exception("Could not precompute quick action %s for RM %s", action, rm_id)
+        else:
+            with self._lock:
+                self._answers[(rm_id, action)] = (answer, time.time())
+        finally:
+            with self._lock:
+                self._pending.discard((rm_id, action))
+
+    def _schedule_loop(self) -> None:
+        while True:
+            time.sleep(self.check_seconds)
+            self.refresh_stale()
@@ -0,0 +1,97 @@
+"""
+Process-wide coalescing of identical in-flight requests (single-flight).
+
+Streamlit re-runs app.py for every session, but imported modules are shared by the
+whole process, so the coalescer below is shared by all RMs connected to this app
+instance. When several sessions issue the same request (same target, same normalized
+payload, same permission scope) while one is already running, they wait for that call
+and all receive its result instead of hitting the endpoint or warehouse again.
+"""
+
+import hashlib
+import json
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class _InFlightCall:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time; concurrent callers with the same key share its outcome."""
+
+    def __init__(self):
+        self._calls: dict[str, _InFlightCall] = {}
+        self._lock = threading.Lock()
+        self.calls_started = 0
+        self.calls_coalesced = 0
+
+    def do(self, key: str, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _InFlightCall()
+                self.calls_started += 1
+            else:
+                call.waiters += 1
+                self.calls_coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+            if call.waiters:
+                logger.info("Coalesced %d identical in-flight requests", call.waiters)
+        return call.result
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "calls_started": self.calls_started,
+                "calls_coalesced": self.calls_coalesced,
+                "in_flight": len(self._calls),
+            }
+
+
+def _normalize(value):
+    """Collapse insignificant whitespace so trivially different payloads share a key."""
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def make_key(kind: str, target: str, payload, scope: str) -> str:
+    """Key for a request of `kind` against `target` with `payload`, issued under permission `scope`."""
+    raw = json.dumps([kind, target, _normalize(payload), scope], sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+coalescer = SingleFlight()
+
+
+def coalesce(kind: str, target: str, payload, scope: str, fn):
+    """Run `fn` through the process-wide coalescer under the key built from the other arguments."""
+    return coalescer.do(make_key(kind, target, payload, scope), fn)
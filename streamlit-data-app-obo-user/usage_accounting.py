@@ -0,0 +1,169 @@
+"""
+Per-user usage accounting for the LLM, Genie and warehouse calls made by the app.
+
+Each call is wrapped in `track(feature)`, which measures latency and collects prompt and
+completion tokens (from the endpoint `usage` field) and bytes for the user set with
+`set_current_user`. Records are summed in memory per (user, feature) and flushed in
+batches to a JSON-lines file by a background thread, so the heavy users driving load
+can be found without adding a write to every request.
+"""
+
+import atexit
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+USAGE_LOG_PATH = os.getenv("USAGE_LOG_PATH", "usage_log.jsonl")
+USAGE_FLUSH_SECONDS = float(os.getenv("USAGE_FLUSH_SECONDS", "60"))
+
+_current_user = contextvars.ContextVar("usage_current_user", default=None)
+_active_record = contextvars.ContextVar("usage_active_record", default=None)
+
+
+class UsageRecord:
+    """Usage of a single tracked call."""
+
+    def __init__(self, user: str, feature: str):
+        self.user = user
+        self.feature = feature
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.bytes = 0
+        self.latency_seconds = 0.0
+        self.error = False
+
+
+class UsageAggregator:
+    """
+    Sums usage per (user, feature) in memory and periodically appends the totals
+    accumulated since the last flush to `path` as one JSON line per (user, feature).
+    """
+
+    def __init__(self, path: str = USAGE_LOG_PATH, flush_seconds: float = USAGE_FLUSH_SECONDS):
+        self.path = path
+        self.flush_seconds = flush_seconds
+        self._totals: dict[tuple[str, str], dict] = {}
+        self._lock = threading.Lock()
+        self._flusher = None
+
+    def add(self, record: UsageRecord) -> None:
+        key = (record.user or "unknown", record.feature)
+        with self._lock:
+            totals = self._totals.setdefault(key, {
+                "calls": 0, "errors": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                "bytes": 0, "latency_seconds": 0.0, "max_latency_seconds": 0.0,
+            })
+            totals["calls"] += 1
+            totals["errors"] += int(record.error)
+            totals["prompt_tokens"] += record.prompt_tokens
+            totals["completion_tokens"] += record.completion_tokens
+            totals["bytes"] += record.bytes
+            totals["latency_seconds"] += record.latency_seconds
+            totals["max_latency_seconds"] = max(totals["max_latency_seconds"], record.latency_seconds)
+            if self._flusher is None:
+                self._start_flusher()
+
+    def snapshot(self) -> dict:
+        """Totals accumulated since the last flush, keyed by (user, feature)."""
+        with self._lock:
+            return {key: dict(totals) for key, totals in self._totals.items()}
+
+    def flush(self) -> int:
+        """Append the pending totals to the usage log as one batch and reset them. Returns the rows written."""
+        with self._lock:
+            pending, self._totals = self._totals, {}
+        if not pending:
+            return 0
+        flushed_at = datetime.now(timezone.utc).isoformat()
+        lines = [
+            json.dumps({"flushed_at": flushed_at, "user": user, "feature": feature, **totals})
+            for (user, feature), totals in pending.items()
+        ]
+        try:
+            with open(self.path, "a") as f:
+                f.write("\n".join(lines) + "\n")
+        except OSError:
+            logger.exception("Could not write usage batch to %s", self.path)
+            return 0
+        return len(lines)
+
+    def _start_flusher(self) -> None:
+        def loop():
+            while True:
+                time.sleep(self.flush_seconds)
+                self.flush()
+
+        self._flusher = threading.Thread(target=loop, name="usage-flusher", daemon=True)
+        self._flusher.start()
+        atexit.register(self.flush)
+
+
+aggregator = UsageAggregator()
+
+
+def set_current_user(user) -> None:
+    """Attribute calls made from the current Streamlit script run to `user`."""
+    _current_user.set(user)
+
+
+@contextmanager
+def track(feature: str, user=None):
+    """Measure one call of `feature`; tokens and bytes can be added to the yielded record."""
+    record = UsageRecord(user or _current_user.get(), feature)
+    token = _active_record.set(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException:
+        record.error = True
+        raise
+    finally:
+        record.latency_seconds = time.perf_counter() - start
+        _active_record.reset(token)
+        aggregator.add(record)
+
+
+def add_usage(usage) -> None:
+    """Add an endpoint `usage` field ({"prompt_tokens", "completion_tokens", ...}) to the active record."""
+    record = _active_record.get()
+    if record is None or not usage:
+        return
+    record.prompt_tokens += int(usage.get("prompt_tokens") or usage.get("input_tokens") or 0)
+    record.completion_tokens += int(usage.get("completion_tokens") or usage.get("output_tokens") or 0)
+
+
+def add_bytes(n: int) -> None:
+    """Add `n` payload bytes to the active record."""
+    record = _active_record.get()
+    if record is not None:
+        record.bytes += int(n)
+
+
+def run_isolated(fn):
+    """
+    Call `fn` with the usage it adds collected in a separate record, and return (result, record).
+    Used when several attempts race for one answer, so only the one whose result is used is counted.
+    """
+    record = UsageRecord(None, None)
+    token = _active_record.set(record)
+    try:
+        return fn(), record
+    finally:
+        _active_record.reset(token)
+
+
+def merge_usage(record: UsageRecord) -> None:
+    """Add the tokens and bytes of a record from run_isolated to the active record."""
+    active = _active_record.get()
+    if active is None:
+        return
+    active.prompt_tokens += record.prompt_tokens
+    active.completion_tokens += record.completion_tokens
+    active.bytes += record.bytes
@@ -0,0 +1,99 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from ingestion import changefeed
+from ingestion.changefeed import CHANGE_LOG_DIR_NAME, ChangeLog, publish_table_changes
+
+
+@pytest.fixture
+def log(tmp_path):
+    return ChangeLog(str(tmp_path / CHANGE_LOG_DIR_NAME))
+
+
+def _changes(customer_ids, version=1):
+    return {"customer_ids": customer_ids, "partitions": [], "version": version}
+
+
+def test_empty_log(log):
+    assert log.entry_ids() == []
+    assert log.entries() == []
+    assert log.affected_customers() == (set(), None)
+    assert log.read_cursor("app_cache") is None
+
+
+def test_entries_keep_publication_order(log):
+    log.publish("portfolio", _changes([1, 2]))
+    log.publish("transactions", _changes([3]))
+    entries = log.entries()
+    assert [e["table"] for e in entries] == ["portfolio", "transactions"]
+    assert [e["entry_id"] for e in entries] == log.entry_ids()
+    assert entries[0]["customer_ids"] == [1, 2]
+    assert log.entries(since=entries[0]["entry_id"]) == entries[1:]
+
+
+def test_concurrent_publishes_get_distinct_increasing_ids(log):
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda i: log.publish(f"table_{i}", _changes([i])), range(50)))
+    ids = log.entry_ids()
+    assert len(ids) == 50
+    assert [e["entry_id"] for e in log.entries()] == ids
+
+
+def test_ids_increase_when_the_clock_does_not(log, monkeypatch):
+    frozen = datetime(2026, 1, 31, tzinfo=timezone.utc)
+    monkeypatch.setattr(changefeed, "datetime", SimpleNamespace(now=lambda tz: frozen))
+    for i in range(3):
+        log.publish("portfolio", _changes([i]))
+    assert [e["customer_ids"] for e in log.entries()] == [[0], [1], [2]]
+
+
+def test_affected_customers_since_cursor(log):
+    log.publish("portfolio", _changes([1, 2]))
+    customers, last = log.affected_customers()
+    assert customers == {1, 2}
+    log.commit_cursor("app_cache", last)
+
+    log.publish("portfolio", _changes([2, 5]))
+    log.publish("campaigns", _changes(None))
+    since = log.read_cursor("app_cache")
+    assert since == last
+    customers, newest = log.affected_customers(since, tables=["portfolio"])
+    assert customers == {2, 5}
+    assert newest == log.entry_ids()[-1]
+
+
+def test_overwrite_means_every_customer(log):
+    log.publish("portfolio", _changes([1]))
+    log.publish("transactions", _changes(None))
+    log.publish("portfolio", _changes([2]))
+    assert log.affected_customers()[0] is None
+    assert log.affected_customers(tables=["portfolio"])[0] == {1, 2}
+
+
+def test_pruned_cursor_means_every_customer(log):
+    for i in range(5):
+        log.publish("portfolio", _changes([i]))
+    stale = log.entry_ids()[0]
+    log.prune(keep=3)
+    assert len(log.entry_ids()) == 3
+    customers, last = log.affected_customers(stale)
+    assert customers is None
+    assert last == log.entry_ids()[-1]
+
+
+def test_commit_cursor_ignores_none(log):
+    log.commit_cursor("app_cache", None)
+    assert log.read_cursor("app_cache") is None
+
+
+def test_publish_table_changes(tmp_path):
+    manifest = SimpleNamespace(state_dir=str(tmp_path))
+    path = publish_table_changes(manifest, SimpleNamespace(name="portfolio"), _changes([7], version=3))
+    assert path.startswith(str(tmp_path / CHANGE_LOG_DIR_NAME))
+    [entry] = ChangeLog.for_manifest(manifest).entries()
+    assert entry["table"] == "portfolio"
+    assert entry["version"] == 3
+    assert entry["customer_ids"] == [7]